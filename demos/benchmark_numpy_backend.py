@@ -0,0 +1,133 @@
+# Benchmarks for performance-critical operations of the NumPy/SciPy backend.
+# Run with the names of the benchmarks to execute, e.g. `python benchmark_numpy_backend.py resample`, or without arguments to run all.
+import sys
+import time
+import tracemalloc
+
+from phi.flow import *
+from phi.backend.backend_helper import InterpolationPlan
+from phi.backend.scipy_backend import SciPyBackend, conv_method, separable_factors
+from phi.math.nd import _conv_laplace_2d, _conv_laplace_3d
+from phi.physics.pressuresolver.geom import GeometricCG
+
+
+BENCHMARKS = sys.argv[1:] or ['resample', 'gather_nd', 'stencils', 'conv', 'buffer_pool']
+SCIPY = SciPyBackend()
+
+
+def timed(function, repeat=3):
+    """ Returns the best wall time of `repeat` calls to `function` in seconds. """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        best = min(best, time.time() - start)
+    return best
+
+
+def gather_nd_resample(grid, plan):
+    """ Samples `grid` by gathering the corners of `plan` with `gather_nd` and interpolating one axis at a time. """
+    values = [SCIPY.gather_nd(grid, indices, batch_dims=1) for indices in plan.corner_indices]
+    for axis in reversed(range(len(plan.resolution))):
+        values = [lo * plan.lo_weights[axis] + hi * plan.hi_weights[axis] for lo, hi in zip(values[0::2], values[1::2])]
+    return values[0]
+
+
+if 'resample' in BENCHMARKS:
+    print('--- Linear resampling at random points (replicate boundaries, 3 channels) ---')
+    for resolution in ([64, 64], [256, 256], [32, 32, 32], [64, 64, 64]):
+        for batch_size in (1, 4, 16, 64):
+            if batch_size * np.prod(resolution) > 2 ** 22:
+                continue
+            grid = np.random.rand(batch_size, *resolution, 3).astype(np.float32)
+            coords = (np.random.rand(batch_size, *resolution, len(resolution)) * resolution).astype(np.float32)
+            plan = InterpolationPlan(coords, resolution, 'replicate', SCIPY)
+            plan.corner_indices  # precompute for gather_nd_resample
+            gather_seconds = timed(lambda: gather_nd_resample(grid, plan))
+            flat_seconds = timed(lambda: plan.apply(grid))
+            resample_seconds = timed(lambda: math.resample(grid, coords, boundary='replicate'))
+            print('%-12s batch %2d   gather_nd %8.4f s   flat indices %8.4f s (%5.1fx)   resample incl. plan %8.4f s' % ('x'.join(str(dim) for dim in resolution), batch_size, gather_seconds, flat_seconds, gather_seconds / flat_seconds, resample_seconds))
+
+
+def looped_gather_nd(values, indices):
+    """ Gathers with one batch dimension by indexing each example separately. """
+    return np.stack([example_values[tuple(np.moveaxis(example_indices, -1, 0))] for example_values, example_indices in zip(values, indices)])
+
+
+if 'gather_nd' in BENCHMARKS:
+    print('--- gather_nd with one batch dimension (3 channels, one index per cell) ---')
+    for resolution in ([64, 64], [256, 256], [32, 32, 32], [64, 64, 64]):
+        for batch_size in (1, 4, 16, 64):
+            if batch_size * np.prod(resolution) > 2 ** 22:
+                continue
+            values = np.random.rand(batch_size, *resolution, 3).astype(np.float32)
+            indices = np.stack([np.random.randint(0, dim, [batch_size] + resolution) for dim in resolution], axis=-1)
+            looped_seconds = timed(lambda: looped_gather_nd(values, indices))
+            vectorized_seconds = timed(lambda: SCIPY.gather_nd(values, indices, batch_dims=1))
+            print('%-12s batch %2d   per-example loop %8.4f s   vectorized %8.4f s (%5.1fx)' % ('x'.join(str(dim) for dim in resolution), batch_size, looped_seconds, vectorized_seconds, looped_seconds / vectorized_seconds))
+
+
+if 'stencils' in BENCHMARKS:
+    print('--- Laplace (replicate padding), gradient and divergence ---')
+    for resolution in ([64, 64], [256, 256], [32, 32, 32], [64, 64, 64]):
+        for batch_size, channels in ((1, 1), (4, 1), (4, 2)):
+            tensor = np.random.rand(batch_size, *resolution, channels).astype(np.float32)
+            padded = math.pad(tensor, [[0, 0]] + [[1, 1]] * len(resolution) + [[0, 0]], 'replicate')
+            conv_laplace = _conv_laplace_2d if len(resolution) == 2 else _conv_laplace_3d
+            conv_seconds = timed(lambda: conv_laplace(padded))
+            laplace_seconds = timed(lambda: math.laplace(tensor))
+            gradient_seconds = timed(lambda: math.gradient(tensor[..., :1]))
+            vector = np.random.rand(batch_size, *resolution, len(resolution)).astype(np.float32)
+            divergence_seconds = timed(lambda: math.divergence(vector))
+            print('%-12s batch %d  %d channels   laplace: conv %8.4f s  stencil %8.4f s (%5.1fx)   gradient %8.4f s   divergence %8.4f s' % ('x'.join(str(dim) for dim in resolution), batch_size, channels, conv_seconds, laplace_seconds, conv_seconds / laplace_seconds, gradient_seconds, divergence_seconds))
+
+
+if 'conv' in BENCHMARKS:
+    print('--- SciPyBackend.conv methods by kernel size (batch 4, 1 channel, same padding) ---')
+    for resolution, widths in (([256, 256], (3, 5, 7, 11, 15, 21, 31, 61)), ([64, 64, 64], (3, 5, 7, 11, 15))):
+        tensor = np.random.rand(4, *resolution, 1).astype(np.float32)
+        for width in widths:
+            gaussian = np.exp(-0.5 * np.linspace(-2, 2, width) ** 2)
+            for name, kernel in (('random', np.random.rand(*[width] * len(resolution))), ('gaussian', np.prod(np.meshgrid(*[gaussian] * len(resolution), indexing='ij'), axis=0))):
+                kernel = np.reshape(kernel, kernel.shape + (1, 1))
+                separable = separable_factors(kernel) is not None
+                methods = ['direct', 'fft'] + (['separable'] if separable else [])
+                seconds = {method: timed(lambda: SCIPY.conv(tensor, kernel, method=method), repeat=1) for method in methods}
+                print('%-12s %-8s kernel %2d^%d   %s   auto: %s' % ('x'.join(str(dim) for dim in resolution), name, width, len(resolution), '   '.join('%s %8.4f s' % (method, seconds[method]) for method in methods), conv_method(kernel.shape[:-2], separable)))
+
+
+def peak_memory(function):
+    """ Returns the peak size of memory allocated during a call to `function` in bytes. """
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def pooled(function, pool):
+    def run():
+        with math.buffer_pool(pool):
+            function()
+    return run
+
+
+if 'buffer_pool' in BENCHMARKS:
+    # The pool only covers the geometric pressure solve, see phi.math.buffer_pool(). The full step includes advection which allocates as before.
+    print('--- Smoke simulation with GeometricCG with and without buffer pool: full step and pressure solve ---')
+    for resolution in ([64, 64], [256, 256], [32, 32, 32]):
+        domain = Domain(resolution, boundaries=CLOSED)
+        fluid = Fluid(domain, buoyancy_factor=0.1, batch_size=2)
+        fluid = fluid.copied_with(density=fluid.density + domain.centered_grid(Noise(), batch_size=2))
+        solver = GeometricCG(accuracy=1e-3, max_iterations=100)
+        physics = IncompressibleFlow(pressure_solver=solver)
+        pool = math.BufferPool()
+        fluid = physics.step(fluid, dt=1.0)  # the initial velocity is zero, the pressure solve only iterates from the second step on
+        velocity = fluid.solve_info['divergent_velocity']
+        phases = [('step', lambda: physics.step(fluid, dt=1.0)), ('pressure', lambda: divergence_free(velocity, domain, (), pressure_solver=solver))]
+        for name, function in phases:
+            pooled(function, pool)()  # fill the pool
+            seconds = timed(function), timed(pooled(function, pool))
+            peaks = peak_memory(function), peak_memory(pooled(function, pool))
+            print('%-12s %-8s   allocating %8.4f s, peak %6.1f MB   pooled %8.4f s, peak %6.1f MB' % ('x'.join(str(dim) for dim in resolution), name, seconds[0], peaks[0] / 1e6, seconds[1], peaks[1] / 1e6))
+        print('%-12s %s' % ('', pool))
@@ -0,0 +1,74 @@
+# Benchmarks for the NumPy/SciPy pressure solve pipeline.
+# Run with the names of the benchmarks to execute, e.g. `python benchmark_pressure_solve.py assembly`, or without arguments to run all.
+import os
+import sys
+import time
+
+from phi.flow import *
+from phi.physics.pressuresolver.parallel import DomainDecompositionCG
+from phi.physics.pressuresolver.sparse import sparse_pressure_matrix
+
+
+BENCHMARKS = sys.argv[1:] or ['assembly', 'preconditioners', 'cg_variants', 'parallel']
+
+
+def timed(function, repeat=3):
+    """ Returns the best wall time of `repeat` calls to `function` in seconds. """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        best = min(best, time.time() - start)
+    return best
+
+
+if 'assembly' in BENCHMARKS:
+    print('--- Pressure matrix assembly (sparse_pressure_matrix) ---')
+    for resolution in ([64, 64], [128, 128], [256, 256], [512, 512], [16, 16, 16], [32, 32, 32], [64, 64, 64], [128, 128, 128]):
+        mask = np.ones([1] + [dim + 2 for dim in resolution] + [1], np.float32)
+        seconds = timed(lambda: sparse_pressure_matrix(resolution, mask, mask, periodic=False))
+        print('%-16s %10d cells %9.4f s' % ('x'.join(str(dim) for dim in resolution), np.prod(resolution), seconds))
+
+
+if 'preconditioners' in BENCHMARKS:
+    print('--- Preconditioned conjugate gradient (closed boundaries, random divergence) ---')
+    SOLVERS = [SparseCG(), SparseCG(preconditioner='jacobi'), SparseCG(preconditioner='ic'), SparseCG(preconditioner='multigrid'), GeometricCG(), GeometricCG(preconditioner='multigrid')]
+    for resolution in ([128, 128], [512, 512], [32, 32, 32], [64, 64, 64], [128, 128, 128]):
+        domain = Domain(resolution, boundaries=CLOSED)
+        divergence = CenteredGrid(np.random.RandomState(0).rand(1, *resolution, 1).astype(np.float32) - 0.5)
+        divergence -= math.mean(divergence.data)
+        for solver in SOLVERS:
+            iterations = poisson_solve(divergence, domain, solver)[1]  # also fills the matrix cache
+            seconds = timed(lambda: poisson_solve(divergence, domain, solver), repeat=1)
+            print('%-16s %-34s %-10s %6d iterations %9.3f s' % ('x'.join(str(dim) for dim in resolution), solver.name, solver.preconditioner, iterations, seconds))
+
+
+if 'cg_variants' in BENCHMARKS:
+    print('--- Standard vs. fused (single-reduction) conjugate gradient (closed boundaries, random divergence) ---')
+    SOLVERS = [SparseCG(), SparseCG(method='fused'), SparseCG(method='fused', check_interval=16), GeometricCG(), GeometricCG(method='fused'), GeometricCG(method='fused', check_interval=16)]
+    for resolution in ([128, 128], [512, 512], [32, 32, 32], [64, 64, 64]):
+        domain = Domain(resolution, boundaries=CLOSED)
+        divergence = CenteredGrid(np.random.RandomState(0).rand(1, *resolution, 1).astype(np.float32) - 0.5)
+        divergence -= math.mean(divergence.data)
+        for solver in SOLVERS:
+            iterations = poisson_solve(divergence, domain, solver)[1]  # also fills the matrix cache
+            seconds = timed(lambda: poisson_solve(divergence, domain, solver), repeat=1)
+            print('%-16s %-26s %-10s %3d %6d iterations %9.3f s' % ('x'.join(str(dim) for dim in resolution), solver.name, solver.method, solver.check_interval, iterations, seconds))
+
+
+if 'parallel' in BENCHMARKS:
+    print('--- Domain-decomposed CG (closed boundaries, random divergence), %d CPU cores ---' % os.cpu_count())
+    WORKERS = sorted({2 ** i for i in range(int(np.log2(os.cpu_count())) + 1)} | {os.cpu_count()})
+    for resolution in ([1024, 1024], [64, 64, 64], [128, 128, 128]):
+        domain = Domain(resolution, boundaries=CLOSED)
+        divergence = CenteredGrid(np.random.RandomState(0).rand(1, *resolution, 1).astype(np.float32) - 0.5)
+        divergence -= math.mean(divergence.data)
+        serial_seconds = None
+        for workers in WORKERS:
+            solver = DomainDecompositionCG(workers=workers)
+            iterations = poisson_solve(divergence, domain, solver)[1]  # starts the workers
+            seconds = timed(lambda: poisson_solve(divergence, domain, solver), repeat=1)
+            solver.close()
+            serial_seconds = serial_seconds or seconds
+            speedup = serial_seconds / seconds
+            print('%-16s %3d workers %6d iterations %9.3f s   speedup %5.2f   parallel efficiency %4.0f%%' % ('x'.join(str(dim) for dim in resolution), workers, iterations, seconds, speedup, 100 * speedup / workers))
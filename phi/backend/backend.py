@@ -318,6 +318,17 @@ If `multiples` has more dimensions than `value`, these dimensions are added to `
     def sparse_tensor(self, indices, values, shape):
         raise NotImplementedError(self)
 
+    def sparse_tensor_with_values(self, sparse_tensor, values):
+        """
+        Creates a sparse tensor with the same indices and shape as `sparse_tensor` but different values.
+        This avoids converting the indices again.
+
+        :param sparse_tensor: sparse tensor created by `sparse_tensor()`
+        :param values: new values, ordered like the values of `sparse_tensor`
+        :return: sparse tensor
+        """
+        raise NotImplementedError(self)
+
     # --- Math function with default implementation ---
 
     def ndims(self, tensor):
@@ -1,3 +1,5 @@
+import itertools
+
 import six
 from collections import namedtuple
 
@@ -62,55 +64,147 @@ def general_grid_sample_nd(grid, coords, boundary, constant_values, math, reduce
     :param math: backend
     :return: tensor of sampled values from the grid
     """
-    if not isinstance(reduce, NeighbourReduce):
-        reduce = {
-            'linear': NeighbourReduce(True, lambda v1, v2, w1, w2: v1 * w1 + v2 * w2),
-            'min': NeighbourReduce(False, lambda v1, v2: math.minimum(v1, v2)),
-            'max': NeighbourReduce(False, lambda v1, v2: math.maximum(v1, v2)),
-            'minmax': NeighbourReduce(False, lambda v1, v2: (math.minimum(v1[0], v2[0]), math.maximum(v1[1], v2[1])) if isinstance(v1, tuple) else (math.minimum(v1, v2), math.maximum(v1, v2))),
-        }[reduce]
-    grid, coords, boundary = pad_constant_boundaries(grid, coords, boundary, constant_values, math)
-
-    resolution = np.array([int(d) for d in grid.shape[1:-1]])
-    sp_rank = math.ndims(grid) - 2
-    # --- Compute weights ---
-    floor = math.floor(coords)
-    lo_coords = math.to_int(floor)
-    hi_coords = apply_boundary(boundary, lo_coords + 1, resolution, math)
-    lo_coords = apply_boundary(boundary, lo_coords, resolution, math)
-    if reduce.requires_weights:
-        hi_weights = coords - floor
-        lo_weights = math.unstack(1 - hi_weights, axis=-1, keepdims=True)
-        hi_weights = math.unstack(hi_weights, axis=-1, keepdims=True)
-
-    def interpolate_nd(is_hi_by_axis, axis):
-        is_hi_by_axis_2 = is_hi_by_axis | np.array([ax == axis for ax in range(sp_rank)])
-        coords1 = math.where(is_hi_by_axis, hi_coords, lo_coords)
-        coords2 = math.where(is_hi_by_axis_2, hi_coords, lo_coords)
-        if axis == sp_rank - 1:
-            lo_values = math.gather_nd(grid, coords1, batch_dims=1)
-            hi_values = math.gather_nd(grid, coords2, batch_dims=1)
-        else:
-            lo_values = interpolate_nd(is_hi_by_axis, axis + 1)
-            hi_values = interpolate_nd(is_hi_by_axis_2, axis + 1)
-        if reduce.requires_weights:
-            return reduce.f(lo_values, hi_values, lo_weights[axis], hi_weights[axis])
+    plan = InterpolationPlan(coords, math.staticshape(grid)[1:-1], boundary, math)
+    return plan.apply(grid, constant_values, reduce)
+
+
+class InterpolationPlan(object):
+
+    def __init__(self, coords, resolution, boundary, math):
+        """
+        Interpolation stencil of a fixed set of sample points, computed once and applied to any number of grids.
+
+        The plan stores the grid indices of the 2^d cell corners surrounding each point with the boundary conditions already applied, as well as the interpolation weights along each axis.
+        Sampling a grid with `apply()` then only gathers and combines the corner values.
+        All grids passed to `apply()` must have the given spatial resolution but may differ in the number of channels and in their constant extrapolation values.
+
+        For NumPy coordinates, the corners are additionally stored as flat indices into the raveled grid together with the product of their weights.
+        NumPy grids are then sampled with one `np.take` per corner without recomputing the flat indices.
+
+        :param coords: tensor of shape (batch_dim, ..., spatial_rank) holding the sample points in index space
+        :param resolution: spatial resolution of the sampled grids
+        :param boundary: boundary mode per face, see `general_grid_sample_nd()`
+        :param math: backend
+        """
+        self.math = math
+        self.resolution = tuple(int(d) for d in resolution)
+        self.boundary = boundary
+        self.pad_widths, padded_boundary = constant_boundary_padding(boundary, len(self.resolution))
+        lower_pads = [lu[0] for lu in self.pad_widths]
+        if sum(lower_pads) > 0:
+            coords = math.add(coords, math.cast(lower_pads, math.dtype(coords)))
+        padded_resolution = np.array(self.resolution) + np.sum(self.pad_widths, axis=1)
+        # --- Neighbour indices and weights per axis ---
+        self._lo_coords, self._hi_coords, self.lo_weights, self.hi_weights = [], [], [], []
+        for dim, axis_coords in enumerate(math.unstack(coords, axis=-1)):
+            floor = math.floor(axis_coords)
+            lo_coords = math.to_int(floor)
+            self._hi_coords.append(apply_axis_boundary(padded_boundary, dim, lo_coords + 1, padded_resolution[dim], math))
+            self._lo_coords.append(apply_axis_boundary(padded_boundary, dim, lo_coords, padded_resolution[dim], math))
+            hi_weights = math.expand_dims(axis_coords - floor, -1)
+            self.hi_weights.append(hi_weights)
+            self.lo_weights.append(1 - hi_weights)
+        self._corner_indices = None
+        self._flat_indices = None
+        if isinstance(coords, np.ndarray):
+            # --- NumPy: flat indices into the raveled padded grid and combined weights of all corners ---
+            strides = np.cumprod([1] + list(padded_resolution[:0:-1]))[::-1]
+            lo_flat = [lo_coords * strides[dim] for dim, lo_coords in enumerate(self._lo_coords)]
+            hi_flat = [hi_coords * strides[dim] for dim, hi_coords in enumerate(self._hi_coords)]
+            self._cells = int(np.prod(padded_resolution))
+            self._flat_indices = {1: [_corner_product(lo_flat, hi_flat, is_hi_by_axis, np.add) for is_hi_by_axis in _corners(len(strides))]}
+            self._flat_weights = [_corner_product(self.lo_weights, self.hi_weights, is_hi_by_axis, np.multiply) for is_hi_by_axis in _corners(len(strides))]
+
+    @property
+    def corner_indices(self):
+        """ Grid indices of the 2^d corners surrounding each point for use with `gather_nd`, the last axis varies fastest. """
+        if self._corner_indices is None:
+            self._corner_indices = [self.math.stack([hi if is_hi else lo for lo, hi, is_hi in zip(self._lo_coords, self._hi_coords, is_hi_by_axis)], axis=-1) for is_hi_by_axis in _corners(len(self.resolution))]
+        return self._corner_indices
+
+    def _batch_flat_indices(self, batch_size):
+        """ Flat corner indices into a raveled padded NumPy grid holding `batch_size` examples. """
+        if batch_size not in self._flat_indices:
+            offsets = np.reshape(np.arange(batch_size) * self._cells, [batch_size] + [1] * (self._flat_indices[1][0].ndim - 1))
+            self._flat_indices[batch_size] = [indices + offsets for indices in self._flat_indices[1]]
+        return self._flat_indices[batch_size]
+
+    def apply(self, grid, constant_values=0, reduce='linear'):
+        """
+        Samples `grid` at the points of this plan.
+
+        :param grid: tensor of shape (batch_dim, spatial dims..., channels) with the resolution of this plan
+        :param constant_values: extrapolation values of constant boundaries (same options as in pad)
+        :param reduce: 'linear', 'min', 'max', 'minmax' or NeighbourReduce combining the values of two neighbouring corners
+        :return: tensor of sampled values, a tuple (min, max) for reduce='minmax'
+        """
+        math = self.math
+        assert tuple(math.staticshape(grid)[1:-1]) == self.resolution, 'grid of shape %s does not match interpolation plan for resolution %s' % (math.staticshape(grid), self.resolution)
+        if not isinstance(reduce, NeighbourReduce):
+            reduce = {
+                'linear': NeighbourReduce(True, _linear),
+                'min': NeighbourReduce(False, lambda v1, v2: math.minimum(v1, v2)),
+                'max': NeighbourReduce(False, lambda v1, v2: math.maximum(v1, v2)),
+                'minmax': NeighbourReduce(False, lambda v1, v2: (math.minimum(v1[0], v2[0]), math.maximum(v1[1], v2[1])) if isinstance(v1, tuple) else (math.minimum(v1, v2), math.maximum(v1, v2))),
+            }[reduce]
+        if np.sum(self.pad_widths) > 0:
+            grid = math.pad(grid, [[0, 0]] + self.pad_widths + [[0, 0]], mode='constant', constant_values=constant_values)
+        if self._flat_indices is not None and isinstance(grid, np.ndarray):
+            raveled = np.reshape(grid, [-1, grid.shape[-1]])
+            values = [np.take(raveled, indices, axis=0) for indices in self._batch_flat_indices(grid.shape[0])]
+            if reduce.requires_weights and reduce.f is _linear:
+                result = values[0] * self._flat_weights[0]
+                for corner_values, weights in zip(values[1:], self._flat_weights[1:]):
+                    result += corner_values * weights
+                return result
         else:
-            return reduce.f(lo_values, hi_values)
-    result = interpolate_nd(np.array([False] * sp_rank), 0)
+            values = [math.gather_nd(grid, indices, batch_dims=1) for indices in self.corner_indices]
+        # --- Combine neighbouring corners, innermost axis first ---
+        for axis in reversed(range(len(self.resolution))):
+            if reduce.requires_weights:
+                values = [reduce.f(lo, hi, self.lo_weights[axis], self.hi_weights[axis]) for lo, hi in zip(values[0::2], values[1::2])]
+            else:
+                values = [reduce.f(lo, hi) for lo, hi in zip(values[0::2], values[1::2])]
+        return values[0]
+
+
+def _linear(v1, v2, w1, w2):
+    return v1 * w1 + v2 * w2
+
+
+def _corners(spatial_rank):
+    """ Enumerates the corners of a d-dimensional cell as tuples of booleans indicating the upper side per axis, the last axis varies fastest. """
+    return itertools.product((False, True), repeat=spatial_rank)
+
+
+def _corner_product(lo_values, hi_values, is_hi_by_axis, combine):
+    """ Combines the lower or upper per-axis values of one cell corner. """
+    result = hi_values[0] if is_hi_by_axis[0] else lo_values[0]
+    for lo, hi, is_hi in zip(lo_values[1:], hi_values[1:], is_hi_by_axis[1:]):
+        result = combine(result, hi if is_hi else lo)
     return result
 
 
-def pad_constant_boundaries(grid, coords, boundary, constant_values, math):
+def constant_boundary_padding(boundary, spatial_rank):
+    """
+    Determines how grids must be padded so that constant boundaries can be sampled like 'replicate' boundaries.
+
+    :param boundary: boundary mode per face
+    :param spatial_rank: number of spatial dimensions
+    :return: pad widths of the spatial dimensions, boundary with constant faces replaced by 'replicate'
+    """
     boundary = CT(boundary)
-    spatial_rank = math.staticshape(coords)[-1]
     pad_widths = [[1 if boundary[dim, upper] in ('zero', 'constant') else 0 for upper in (False, True)] for dim in range(-spatial_rank - 1, -1)]
     boundary = [['replicate' if boundary[dim, upper] in ('zero', 'constant') else boundary[dim, upper] for upper in (False, True)] for dim in range(-spatial_rank - 1, -1)]
+    return pad_widths, collapse(boundary)
+
+
+def pad_constant_boundaries(grid, coords, boundary, constant_values, math):
+    pad_widths, boundary = constant_boundary_padding(boundary, math.staticshape(coords)[-1])
     lower_pads = [lu[0] for lu in pad_widths]
     grid = math.pad(grid, [[0, 0]] + pad_widths + [[0, 0]], mode='constant', constant_values=constant_values)
     if sum(lower_pads) > 0:
         coords = math.add(coords, math.cast(lower_pads, math.dtype(coords)))
-    boundary = collapse(boundary)
     return grid, coords, boundary
 
 
@@ -119,16 +213,28 @@ def apply_boundary(boundary, coords, input_size, math):
         return _apply_single_boundary(boundary, coords, input_size, math)
     coords = math.unstack(coords, axis=-1)
     assert len(boundary) == len(input_size) == len(coords)
+    return math.stack([apply_axis_boundary(boundary, dim, dim_coords, input_size[dim], math) for dim, dim_coords in enumerate(coords)], axis=-1)
+
+
+def apply_axis_boundary(boundary, dim, coords, input_size, math):
+    """
+    Maps integer indices along one axis into the valid range [0, input_size) according to the boundary conditions of that axis.
+
+    :param boundary: boundary mode as string or per face
+    :param dim: spatial axis of `coords`
+    :param coords: integer tensor of indices along `dim`
+    :param input_size: size of the axis
+    :return: integer tensor like `coords`
+    """
+    if isinstance(boundary, six.string_types):
+        return _apply_single_boundary(boundary, coords, input_size, math)
     boundary = CT(boundary)
-    result = []
-    for dim, dim_coords in enumerate(coords):
-        if boundary[dim, 0] == boundary[dim, 1]:
-            result.append(_apply_single_boundary(boundary[dim, 0], dim_coords, input_size[dim], math))
-        else:  # separate boundary for lower and upper face
-            lower = _apply_single_boundary(boundary[dim, 0], dim_coords, input_size[dim], math)
-            upper = _apply_single_boundary(boundary[dim, 1], dim_coords, input_size[dim], math)
-            result.append(math.where(dim_coords <= 0, lower, upper))
-    return math.stack(result, axis=-1)
+    if boundary[dim, 0] == boundary[dim, 1]:
+        return _apply_single_boundary(boundary[dim, 0], coords, input_size, math)
+    # --- separate boundary for lower and upper face ---
+    lower = _apply_single_boundary(boundary[dim, 0], coords, input_size, math)
+    upper = _apply_single_boundary(boundary[dim, 1], coords, input_size, math)
+    return math.where(coords <= 0, lower, upper)
 
 
 def _apply_single_boundary(boundary, coords, input_size, math):
@@ -245,6 +245,9 @@ class DynamicBackend(Backend):
     def sparse_tensor(self, indices, values, shape):
         return self.choose_backend([indices, values]).sparse_tensor(indices, values, shape)
 
+    def sparse_tensor_with_values(self, sparse_tensor, values):
+        return self.choose_backend([sparse_tensor, values]).sparse_tensor_with_values(sparse_tensor, values)
+
     def dtype(self, array):
         return self.choose_backend(array).dtype(array)
 
@@ -1,8 +1,11 @@
 import collections
 import numbers
+import threading
 import warnings
+from contextlib import contextmanager
 
 import numpy as np
+import scipy.ndimage
 import scipy.signal
 import scipy.sparse
 
@@ -209,22 +212,36 @@ class SciPyBackend(Backend):
     def exp(self, x):
         return np.exp(x)
 
-    def conv(self, tensor, kernel, padding="SAME"):
-        """ apply convolution of kernel on tensor """
+    def conv(self, tensor, kernel, padding="SAME", method='auto'):
+        """
+        Correlates `tensor` with `kernel` for all examples and channels at once.
+
+        :param tensor: tensor of shape (batch, spatial dimensions..., in channels)
+        :param kernel: tensor of shape (kernel dimensions..., in channels, out channels)
+        :param padding: 'SAME' to zero-pad the result to the size of `tensor` or 'VALID'
+        :param method: 'direct' to add up one shifted copy of `tensor` per kernel entry, 'separable' to correlate along one axis at a time (requires a rank-1 kernel for each channel pair), 'fft' or 'auto' to choose by kernel size, see `conv_method()`
+        """
         assert tensor.shape[-1] == kernel.shape[-2]
-        # kernel = kernel[[slice(None)] + [slice(None, None, -1)] + [slice(None)]*(len(kernel.shape)-3) + [slice(None)]]
+        kernel = np.asarray(kernel)
+        kernel_size = kernel.shape[:-2]
         if padding.lower() == "same":
-            result = np.zeros(tensor.shape[:-1] + (kernel.shape[-1],), dtype=self.precision_dtype)
-        elif padding.lower() == "valid":
-            valid = [tensor.shape[i + 1] - (kernel.shape[i] + 1) // 2 for i in range(tensor_spatial_rank(tensor))]
-            result = np.zeros([tensor.shape[0]] + valid + [kernel.shape[-1]], dtype=self.precision_dtype)
-        else:
+            tensor = np.pad(tensor, [[0, 0]] + [[k // 2, (k - 1) // 2] for k in kernel_size] + [[0, 0]])
+        elif padding.lower() != "valid":
             raise ValueError("Illegal padding: %s" % padding)
-        for batch in range(tensor.shape[0]):
-            for o in range(kernel.shape[-1]):
-                for i in range(tensor.shape[-1]):
-                    result[batch, ..., o] += scipy.signal.correlate(tensor[batch, ..., i], kernel[..., i, o], padding.lower())
-        return result
+        factors = separable_factors(kernel) if method in ('auto', 'separable') else None
+        if method == 'auto':
+            method = conv_method(kernel_size, factors is not None)
+        if method == 'direct':
+            result = _direct_correlate(tensor, kernel)
+        elif method == 'separable':
+            assert factors is not None, 'kernel is not separable'
+            result = _separable_correlate(tensor, factors)
+        elif method == 'fft':
+            flipped = kernel[tuple([slice(None, None, -1)] * len(kernel_size))]
+            result = np.sum(scipy.signal.fftconvolve(tensor[..., np.newaxis], flipped[np.newaxis], mode='valid', axes=tuple(range(1, len(kernel_size) + 1))), axis=-2)
+        else:
+            raise ValueError("Illegal method: %s" % method)
+        return result.astype(self.precision_dtype, copy=False)
 
     def expand_dims(self, a, axis=0, number=1):
         for _i in range(number):
@@ -264,29 +281,25 @@ class SciPyBackend(Backend):
 
     def gather_nd(self, values, indices, batch_dims=0):
         assert indices.shape[-1] == self.ndims(values) - batch_dims - 1
-        if batch_dims == 0:
-            indices_list = self.unstack(indices, axis=-1)
-            return values[indices_list]
         for dim in range(batch_dims):
             assert indices.shape[dim] == values.shape[dim] or values.shape[dim] == 1 or indices.shape[dim] == 1, 'Batch dimension %d does not match: %s (values) and %s (indices)' % (dim, values.shape, indices.shape)
-        values_batch_max = np.array(values.shape[:batch_dims]) - 1
-        indices_batch_max = np.array(indices.shape[:batch_dims]) - 1
-
-        def inner_gather_nd(*pos):
-            batch_idx_values = tuple([np.minimum(pos[i], values_batch_max[i]) for i in range(len(pos))])
-            values_batch = values[batch_idx_values]
-            batch_idx_indices = tuple([np.minimum(pos[i], indices_batch_max[i]) for i in range(len(pos))])
-            indices_batch = indices[batch_idx_indices]
-            result = values_batch[self.unstack(indices_batch, axis=-1)]
-            return result
-        # --- Iterate over batch dimensions ---
-        batch_pos = np.meshgrid(*[range(dim) for dim in indices.shape[:batch_dims]], indexing='ij')
-        batch_pos = np.stack(batch_pos, axis=-1).reshape([-1, batch_dims])
-        result = np.empty(indices.shape[:-1] + (values.shape[-1],), values.dtype)
-        for i in range(batch_pos.shape[0]):
-            gathered = inner_gather_nd(*batch_pos[i])
-            result[tuple(batch_pos[i])] = gathered
-        return result
+        # --- Flat indices into the raveled values, batch dimensions of size 1 broadcast on either side ---
+        index_rank = self.ndims(indices) - 1
+        flat_indices = 0
+        for dim in range(batch_dims):
+            if values.shape[dim] > 1:
+                flat_indices = flat_indices * values.shape[dim] + np.reshape(np.arange(values.shape[dim]), [values.shape[dim] if d == dim else 1 for d in range(index_rank)])
+        for i, size in enumerate(values.shape[batch_dims:-1]):
+            spatial_indices = indices[..., i] if values.size < 2 ** 31 else indices[..., i].astype(np.int64)
+            # --- Per-axis bounds like NumPy indexing, otherwise invalid indices would address another element of the flat array ---
+            if spatial_indices.size > 0:
+                lowest, highest = np.min(spatial_indices), np.max(spatial_indices)
+                if lowest < -size or highest >= size:
+                    raise IndexError('gather_nd: index %d is out of bounds for axis %d with size %d' % (lowest if lowest < -size else highest, batch_dims + i, size))
+                if lowest < 0:
+                    spatial_indices = np.where(spatial_indices < 0, spatial_indices + size, spatial_indices)
+            flat_indices = flat_indices * size + spatial_indices
+        return np.take(np.reshape(values, [-1, values.shape[-1]]), flat_indices, axis=0)
 
     def std(self, x, axis=None, keepdims=False):
         return np.std(x, axis, keepdims=keepdims)
@@ -372,3 +385,224 @@ def tensor_spatial_rank(field):
     dims = len(field.shape) - 2
     assert dims > 0, "channel has no spatial dimensions"
     return dims
+
+
+DIRECT_CONV_MAX_ENTRIES = 27
+""" Largest number of entries of a non-separable kernel for which `SciPyBackend.conv` prefers direct over FFT-based correlation. """
+
+
+def conv_method(kernel_size, separable):
+    """
+    Chooses how `SciPyBackend.conv` correlates with a kernel.
+
+    Kernels that factor into one vector per axis are applied one axis at a time at a cost proportional to the sum instead of the product of the kernel dimensions.
+    Other kernels are applied directly if they are small and in Fourier space otherwise.
+
+    :param kernel_size: spatial dimensions of the kernel
+    :param separable: whether the kernel is rank-1 for each channel pair
+    :return: 'direct', 'separable' or 'fft'
+    """
+    if separable:
+        return 'separable'
+    return 'direct' if np.prod(kernel_size) <= DIRECT_CONV_MAX_ENTRIES else 'fft'
+
+
+def separable_factors(kernel):
+    """
+    Factors the spatial part of a convolution kernel into one vector per axis if possible.
+
+    :param kernel: tensor of shape (kernel dimensions..., in channels, out channels)
+    :return: nested list indexed by [in channel][out channel] holding one 1D factor per spatial axis, or None if any channel pair is not rank-1
+    """
+    rank = len(kernel.shape) - 2
+    factors = []
+    for in_channel in range(kernel.shape[-2]):
+        factors.append([])
+        for out_channel in range(kernel.shape[-1]):
+            entries = kernel[..., in_channel, out_channel]
+            pivot = np.unravel_index(np.argmax(np.abs(entries)), entries.shape)
+            if entries[pivot] == 0:
+                factors[-1].append([np.zeros(n, kernel.dtype) for n in entries.shape])
+                continue
+            axis_factors = [entries[pivot[:axis] + (slice(None),) + pivot[axis + 1:]] for axis in range(rank)]
+            axis_factors[0] = axis_factors[0] / entries[pivot] ** (rank - 1)
+            outer = axis_factors[0]
+            for factor in axis_factors[1:]:
+                outer = np.multiply.outer(outer, factor)
+            if not np.allclose(outer, entries, rtol=1e-5, atol=1e-6 * abs(entries[pivot])):
+                return None
+            factors[-1].append(axis_factors)
+    return factors
+
+
+def _valid_shape(tensor, kernel_size):
+    return [n - k + 1 for n, k in zip(tensor.shape[1:-1], kernel_size)]
+
+
+def _direct_correlate(tensor, kernel):
+    """ Valid correlation adding one shifted, channel-mixed copy of `tensor` per nonzero kernel entry. """
+    kernel_size = kernel.shape[:-2]
+    valid = _valid_shape(tensor, kernel_size)
+    result = np.zeros([tensor.shape[0]] + valid + [kernel.shape[-1]], np.result_type(tensor, kernel))
+    for offset in np.ndindex(*kernel_size):
+        weights = kernel[offset]
+        if not np.any(weights):
+            continue
+        window = tensor[(slice(None),) + tuple(slice(o, o + n) for o, n in zip(offset, valid)) + (slice(None),)]
+        result += window * weights[0] if tensor.shape[-1] == 1 else np.matmul(window, weights)
+    return result
+
+
+def _separable_correlate(tensor, factors):
+    """ Valid correlation applying the 1D factors of each channel pair along one axis at a time. """
+    valid = _valid_shape(tensor, [len(factor) for factor in factors[0][0]])
+    result = np.zeros([tensor.shape[0]] + valid + [len(factors[0])], np.result_type(tensor, factors[0][0][0]))
+    for in_channel, channel_factors in enumerate(factors):
+        for out_channel, axis_factors in enumerate(channel_factors):
+            correlated = tensor[..., in_channel]
+            for axis, factor in enumerate(axis_factors):
+                correlated = scipy.ndimage.correlate1d(correlated, factor, axis=axis + 1, mode='constant')
+                correlated = correlated[(slice(None),) * (axis + 1) + (slice(len(factor) // 2, len(factor) // 2 + valid[axis]),)]
+            result[..., out_channel] += correlated
+    return result
+
+
+class BufferPool(object):
+
+    def __init__(self):
+        """
+        Reusable NumPy arrays for the temporaries of operations executed in place, see `buffer_pool()`.
+
+        Each operation requests its buffers under its own keys, so buffers that are alive at the same time never alias.
+        A buffer is reused whenever the same key, shape and dtype are requested again, e.g. in the next iteration or simulation step.
+        Values written to a buffer are only valid until the operation owning the key runs again.
+        """
+        self.allocations = 0
+        self._buffers = {}
+
+    def get(self, key, shape, dtype):
+        """
+        Returns the buffer stored under `key` with the given shape and dtype, allocating it on first use.
+
+        :param key: hashable identifier of the buffer, unique among the buffers alive at the same time
+        :param shape: shape of the buffer
+        :param dtype: NumPy data type of the buffer
+        :return: uninitialized or previously used NumPy array
+        """
+        buffer_key = (key, tuple(shape), np.dtype(dtype))
+        buffer = self._buffers.get(buffer_key, None)
+        if buffer is None:
+            self.allocations += 1
+            buffer = self._buffers[buffer_key] = np.empty(shape, dtype)
+        return buffer
+
+    @property
+    def nbytes(self):
+        """ Total size of all pooled buffers in bytes. """
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    def clear(self):
+        """ Releases all buffers and resets the allocation counter. """
+        self._buffers.clear()
+        self.allocations = 0
+
+    def __len__(self):
+        return len(self._buffers)
+
+    def __repr__(self):
+        return 'BufferPool(%d buffers, %d bytes)' % (len(self), self.nbytes)
+
+
+_BUFFER_POOLS = threading.local()  # per-thread stack, concurrent steps in other threads must not share buffers
+
+
+def _buffer_pool_stack():
+    stack = getattr(_BUFFER_POOLS, 'stack', None)
+    if stack is None:
+        stack = _BUFFER_POOLS.stack = []
+    return stack
+
+
+@contextmanager
+def buffer_pool(pool=None):
+    """
+    Enables the in-place execution mode of NumPy operations within the context in the current thread.
+
+    While a pool is active, the following operations keep their temporaries in pooled buffers instead of allocating new arrays:
+    the padded copies of `laplace()`, `gradient()` and `StaggeredGrid.gradient()`, the stencil operators of `GeometricCG` and `GeometricMultigrid`
+    and the unpreconditioned `conjugate_gradient()` used by `GeometricCG(method='standard')` and the multigrid coarse solves.
+    Passing the same pool to the contexts of successive simulation steps lets the steps reuse each other's buffers.
+
+    The scope is limited to these pressure solves.
+    Advection, mask construction, preconditioned or fused CG and the other NumPy solvers such as `SparseCG` and `DCTSolver` allocate as before.
+    As semi-Lagrangian advection dominates the memory of a simulation step, the peak memory of a full `step` does not decrease.
+    The pool lowers the peak of the pressure solve and keeps its vectors from being reallocated every step.
+
+    Example:
+        pool = BufferPool()
+        physics = IncompressibleFlow(pressure_solver=GeometricCG())
+        for _ in range(100):
+            with buffer_pool(pool):
+                state = physics.step(state)
+
+    :param pool: BufferPool to use or None to create a new one
+    :return: the active BufferPool
+    """
+    pool = BufferPool() if pool is None else pool
+    stack = _buffer_pool_stack()
+    stack.append(pool)
+    try:
+        yield pool
+    finally:
+        stack.pop()
+
+
+def active_buffer_pool():
+    """
+    :return: the BufferPool of the innermost `buffer_pool()` context of the current thread or None if the in-place execution mode is not enabled
+    :rtype: BufferPool
+    """
+    stack = _buffer_pool_stack()
+    return stack[-1] if stack else None
+
+
+PAD_INTO_MODES = ('constant', 'replicate', 'circular')
+
+
+def pad_into(value, pad_width, mode, out, constant_values=0):
+    """
+    Pads `value` like `SciPyBackend.pad` but writes the result into the preallocated array `out`.
+
+    The interior is copied and the padded faces are filled one axis at a time, so corners are filled like in successive `np.pad` calls.
+
+    :param value: NumPy array
+    :param pad_width: (lower, upper) number of cells for every axis of `value`
+    :param mode: one of PAD_INTO_MODES or a list containing one mode per axis
+    :param out: array of the padded shape
+    :param constant_values: value of constant faces
+    :return: out
+    """
+    modes = mode if isinstance(mode, (tuple, list)) else [mode] * value.ndim
+    shape = tuple(n + lower + upper for n, (lower, upper) in zip(value.shape, pad_width))
+    assert out.shape == shape, 'out has shape %s but padding %s by %s requires %s' % (out.shape, value.shape, pad_width, shape)
+    interior = tuple(slice(lower, lower + n) for n, (lower, _) in zip(value.shape, pad_width))
+    out[interior] = value
+    for axis, ((lower, upper), axis_mode, n) in enumerate(zip(pad_width, modes, value.shape)):
+        if lower == 0 and upper == 0:
+            continue
+        assert axis_mode in PAD_INTO_MODES, axis_mode
+
+        def face(start, stop, axis=axis):
+            return (slice(None),) * axis + (slice(start, stop),) + interior[axis + 1:]
+
+        if axis_mode == 'constant':
+            out[face(0, lower)] = constant_values
+            out[face(lower + n, None)] = constant_values
+        elif axis_mode == 'replicate':
+            out[face(0, lower)] = out[face(lower, lower + 1)]
+            out[face(lower + n, None)] = out[face(lower + n - 1, lower + n)]
+        else:  # circular
+            assert lower <= n and upper <= n, 'circular padding must not exceed the axis size'
+            out[face(0, lower)] = out[face(n, n + lower)]
+            out[face(lower + n, None)] = out[face(lower, lower + upper)]
+    return out
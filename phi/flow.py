@@ -12,10 +12,14 @@ from .physics.obstacle import *
 from .physics.material import *
 from .physics.domain import *
 from .physics.field.effect import *
-from .physics.pressuresolver.solver_api import PoissonDomain, PoissonSolver
+from .physics.pressuresolver.solver_api import PoissonDomain, PoissonSolver, SolveTelemetry
 from .physics.pressuresolver.sparse import SparseCG, SparseSciPy
 from .physics.pressuresolver.geom import GeometricCG
+from .physics.pressuresolver.multigrid import GeometricMultigrid
+from .physics.pressuresolver.sor import RedBlackSOR
 from .physics.pressuresolver.fourier import FourierSolver
+from .physics.pressuresolver.dct import DCTSolver
+from .physics.pressuresolver.autotune import AutotunedSolver
 
 from .data.fluidformat import *
 from .data.dataset import *
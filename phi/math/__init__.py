@@ -1,6 +1,6 @@
 from phi.backend.backend import Backend
 from phi.backend.dynamic_backend import DYNAMIC_BACKEND
-from phi.backend.scipy_backend import SciPyBackend
+from phi.backend.scipy_backend import SciPyBackend, BufferPool, buffer_pool
 from phi.struct.struct_backend import StructBroadcastBackend
 from .math_util import types, is_static_shape, zeros, ones, randn, randfreq, interpolate
 from .helper import is_scalar, axes, rank
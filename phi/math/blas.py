@@ -2,12 +2,15 @@
 import warnings
 
 from ..backend.dynamic_backend import DYNAMIC_BACKEND as math
-from .optim import conjugate_gradient as new_cg
+from .optim import conjugate_gradient as new_cg, preconditioned_conjugate_gradient as new_pcg
 
 
-def conjugate_gradient(k, apply_A, initial_x=None, accuracy=1e-5, max_iterations=1024, back_prop=False):
+def conjugate_gradient(k, apply_A, initial_x=None, accuracy=1e-5, max_iterations=1024, back_prop=False, preconditioner=None, compact=False):
     warnings.warn("conjugate_gradient from phi.math.blas is deprecated. Use phi.math.optim.conjugate_gradient instead.", DeprecationWarning)
     if initial_x is None:
         initial_x = math.zeros_like(k)
-    result = new_cg(function=apply_A, y=k, x0=initial_x, accuracy=accuracy, max_iterations=max_iterations, back_prop=back_prop)
+    if preconditioner is None:
+        result = new_cg(function=apply_A, y=k, x0=initial_x, accuracy=accuracy, max_iterations=max_iterations, back_prop=back_prop, compact=compact)
+    else:
+        result = new_pcg(function=apply_A, y=k, x0=initial_x, preconditioner=preconditioner, accuracy=accuracy, max_iterations=max_iterations, back_prop=back_prop, compact=compact)
     return result.x, result.iterations
@@ -5,6 +5,7 @@ import numpy as np
 
 from phi import struct
 from phi.backend.dynamic_backend import DYNAMIC_BACKEND as math
+from phi.backend.scipy_backend import PAD_INTO_MODES, active_buffer_pool, pad_into
 from phi.struct.functions import mappable
 
 from .helper import (_contains_axis, _dim_shifted, _get_pad_width,
@@ -183,8 +184,12 @@ def _divergence_nd(tensor, relative_shifts):
     components = []
     for dimension in range(rank):
         lower, upper = _dim_shifted(tensor, dimension, relative_shifts, diminish_others=(-relative_shifts[0], relative_shifts[1]), components=rank - dimension - 1)
-        components.append(upper - lower)
-    return math.sum(components, 0)
+        if isinstance(tensor, np.ndarray) and components:  # accumulate in place instead of stacking all differences
+            components[0] += upper
+            components[0] -= lower
+        else:
+            components.append(upper - lower)
+    return math.sum(components, 0) if len(components) > 1 else components[0]
 
 
 # Gradient
@@ -214,7 +219,13 @@ def gradient(tensor, dx=1, difference='forward', padding='replicate'):
 
 def _gradient_nd(tensor, padding, relative_shifts):
     rank = spatial_rank(tensor)
-    tensor = math.pad(tensor, _get_pad_width(rank, (-relative_shifts[0], relative_shifts[1])), mode=padding)
+    tensor = pooled_pad(tensor, _get_pad_width(rank, (-relative_shifts[0], relative_shifts[1])), padding, key=_gradient_nd)
+    if isinstance(tensor, np.ndarray):  # write the differences directly into the result
+        result = np.empty(tuple(n - relative_shifts[1] + relative_shifts[0] if 0 < i <= rank else n for i, n in enumerate(tensor.shape[:-1])) + (rank,), tensor.dtype)
+        for dimension in range(rank):
+            lower, upper = _dim_shifted(tensor, dimension, relative_shifts, diminish_others=(-relative_shifts[0], relative_shifts[1]))
+            np.subtract(upper, lower, out=result[..., dimension:dimension + 1])
+        return result
     components = []
     for dimension in range(rank):
         lower, upper = _dim_shifted(tensor, dimension, relative_shifts, diminish_others=(-relative_shifts[0], relative_shifts[1]))
@@ -233,6 +244,22 @@ def axis_gradient(tensor, spatial_axis):
 
 # Laplace
 
+def pooled_pad(tensor, pad_width, mode, key):
+    """
+    Pads `tensor` like `math.pad`.
+    In the in-place execution mode (see `phi.backend.scipy_backend.buffer_pool()`), NumPy arrays are padded into the pooled buffer stored under `key`.
+    The result is then only valid until the next padding with the same key and must not be returned to the caller.
+
+    :param key: identifies the pooled buffer, usually the calling function
+    :return: padded tensor
+    """
+    pool = active_buffer_pool()
+    if pool is None or not isinstance(tensor, np.ndarray) or mode not in PAD_INTO_MODES:
+        return math.pad(tensor, pad_width, mode)
+    shape = [n + lower + upper for n, (lower, upper) in zip(tensor.shape, pad_width)]
+    return pad_into(tensor, pad_width, mode, pool.get(key, shape, tensor.dtype))
+
+
 @mappable()
 def laplace(tensor, padding='replicate', axes=None, use_fft_for_periodic=False):
     """
@@ -252,7 +279,10 @@ def laplace(tensor, padding='replicate', axes=None, use_fft_for_periodic=False):
     elif padding in ('circular', 'wrap') and use_fft_for_periodic:
         return fourier_laplace(tensor)
     else:
-        tensor = math.pad(tensor, _get_pad_width_axes(rank, axes, val_true=[1, 1], val_false=[0, 0]), padding)
+        tensor = pooled_pad(tensor, _get_pad_width_axes(rank, axes, val_true=[1, 1], val_false=[0, 0]), padding, key=laplace)
+    if isinstance(tensor, np.ndarray):
+        dtype = math.choose_backend(tensor).precision_dtype if axes is None and rank in (2, 3) else None  # like the convolutional stencils below
+        return _numpy_laplace_nd(tensor, axes, dtype)
     # --- convolutional laplace ---
     if axes is not None:
         return _sliced_laplace_nd(tensor, axes)
@@ -315,6 +345,23 @@ def _sliced_laplace_nd(tensor, axes=None):
     return math.sum(components, 0)
 
 
+def _numpy_laplace_nd(tensor, axes=None, dtype=None):
+    """
+    Laplace stencil for padded NumPy arrays.
+    Instead of convolving each example and channel separately, the shifted neighbour slices of all examples and channels are added to the result in place.
+
+    :param dtype: data type of the result, None to use the type of `tensor`
+    """
+    rank = spatial_rank(tensor)
+    axes = [ax for ax in range(rank) if _contains_axis(axes, ax, rank)]
+    inner = [slice(1, -1) if ax in axes else slice(None) for ax in range(rank)]
+    result = np.multiply(tensor[tuple([slice(None)] + inner)], -2 * len(axes), dtype=dtype)
+    for ax in axes:
+        for neighbour in (slice(None, -2), slice(2, None)):
+            result += tensor[tuple([slice(None)] + inner[:ax] + [neighbour] + inner[ax + 1:])]
+    return result
+
+
 @mappable()
 def fourier_laplace(tensor, times=1):
     """
@@ -1,9 +1,12 @@
 from collections import namedtuple
 
+import numpy as np
+
 from phi.backend.dynamic_backend import DYNAMIC_BACKEND as math
+from phi.backend.scipy_backend import active_buffer_pool
 
 
-SolveResult = namedtuple('SolveResult', ['iterations', 'x', 'residual'])
+SolveResult = namedtuple('SolveResult', ['iterations', 'x', 'residual', 'example_iterations'])
 
 
 def broyden(function, x0, inv_J0, accuracy=1e-5, max_iterations=1000, back_prop=False):
@@ -40,10 +43,10 @@ def broyden(function, x0, inv_J0, accuracy=1e-5, max_iterations=1000, back_prop=
         return [next_x, next_y, next_inv_J, iterations + 1]
 
     x_, y_, _, iterations = math.while_loop(_max_residual_condition(1, accuracy), broyden_loop, [x0, y0, inv_J0, 0], back_prop=back_prop, name='Broyden', maximum_iterations=max_iterations)
-    return SolveResult(iterations, x_, y_)
+    return SolveResult(iterations, x_, y_, None)
 
 
-def conjugate_gradient(function, y, x0, accuracy=1e-5, max_iterations=1000, back_prop=False):
+def conjugate_gradient(function, y, x0, accuracy=1e-5, max_iterations=1000, back_prop=False, compact=False, callback=None):
     """
     Solve the linear system of equations `A·x=y`  using the conjugate gradient (CG) algorithm.
     A, x and y can have arbitrary matching shapes, i.e. this method can be used to solve vector and matrix equations.
@@ -52,31 +55,215 @@ def conjugate_gradient(function, y, x0, accuracy=1e-5, max_iterations=1000, back
 
     The implementation is based on https://nvlpubs.nist.gov/nistpubs/jres/049/jresv49n6p409_A1b.pdf
 
+    Convergence is tracked per example: once |f(x)-y| ≤ accuracy holds for an example, its x is frozen while the rest of the batch keeps iterating.
+    Within `phi.backend.scipy_backend.buffer_pool()`, NumPy vectors are updated in place in pooled buffers and `compact` is ignored.
+
     :param y: Desired output of `f(x)`
     :param function: linear function of x that returns A·x
     :param x0: initial guess for the value of x
     :param accuracy: (optional) the algorithm terminates once |f(x)-y| ≤ accuracy for every entry. If None, the algorithm runs until `max_iterations` is reached.
     :param max_iterations: (optional) maximum number of CG iterations to perform
     :param back_prop: Whether to enable auto-differentiation. This induces a memory cost scaling with the number of iterations. Otherwise, the memory cost is constant.
-    :return: Pair containing the result for x and the number of iterations performed
+    :param compact: If True and all tensors are NumPy arrays, converged examples are removed from the batch passed to `function`. This requires `function` to process any subset of the batch entries independently.
+    :param callback: (optional) function called with the residual after every iteration
+    :return: SolveResult holding the number of iterations, the result for x, the final residual and the number of iterations performed for each example
     """
+    pool = active_buffer_pool()
+    if pool is not None and not back_prop and isinstance(y, np.ndarray) and isinstance(x0, np.ndarray):
+        return _in_place_conjugate_gradient(function, y, x0, accuracy, max_iterations, callback, pool)
     y = math.to_float(y)
     x0 = math.to_float(x0)
     dx0 = residual0 = y - function(x0)
     dy0 = function(dx0)
     non_batch_dims = tuple(range(1, len(y.shape)))
 
-    def cg_loop(x, dx, dy, residual, iterations):
+    def cg_loop(x, dx, dy, residual, iterations, example_iterations):
+        active = _active_examples(residual, non_batch_dims, accuracy)
         dx_dy = math.sum(dx * dy, axis=non_batch_dims, keepdims=True)
-        step_size = math.divide_no_nan(math.sum(dx * residual, axis=non_batch_dims, keepdims=True), dx_dy)
-        x += step_size * dx
-        residual -= step_size * dy
-        dx = residual - math.divide_no_nan(math.sum(residual * dy, axis=non_batch_dims, keepdims=True) * dx, dx_dy)
+        step_size = active * math.divide_no_nan(math.sum(dx * residual, axis=non_batch_dims, keepdims=True), dx_dy)
+        x = x + step_size * dx
+        residual = residual - step_size * dy
+        dx = active * (residual - math.divide_no_nan(math.sum(residual * dy, axis=non_batch_dims, keepdims=True) * dx, dx_dy)) + (1 - active) * dx
+        dy = function(dx)
+        if callback is not None:
+            callback(residual)
+        return [x, dx, dy, residual, iterations + 1, example_iterations + math.to_int(math.sum(active, axis=non_batch_dims))]
+
+    loop_vars = [x0, dx0, dy0, residual0, 0, _zero_example_iterations(y, non_batch_dims)]
+    if _compactable(compact, accuracy, back_prop, y, x0):
+        x_, _, _, residual_, iterations_, example_iterations_ = _compacted_while_loop(cg_loop, loop_vars, 3, accuracy, max_iterations)
+    else:
+        x_, _, _, residual_, iterations_, example_iterations_ = math.while_loop(_max_residual_condition(3, accuracy), cg_loop, loop_vars, back_prop=back_prop, name="ConjGrad", maximum_iterations=max_iterations)
+    return SolveResult(iterations_, x_, residual_, example_iterations_)
+
+
+def _in_place_conjugate_gradient(function, y, x0, accuracy, max_iterations, callback, pool):
+    """
+    Variant of `conjugate_gradient()` for NumPy arrays that updates all vectors in place, keeping them in buffers of `pool`.
+    Only x and the residual of the result are newly allocated.
+    Converged examples are frozen but not removed from the batch.
+
+    `function` is applied through `apply_into()`, so operators supporting `out` write A·x directly into the pooled buffers.
+    """
+    dtype = math.to_float(0).dtype
+    non_batch_dims = tuple(range(1, len(y.shape)))
+    y_, x, residual, dx, dy, temp = [pool.get(('conjugate_gradient', name), y.shape, dtype) for name in ('y', 'x', 'residual', 'dx', 'dy', 'temp')]
+    np.copyto(y_, y)
+    np.copyto(x, x0)
+    np.subtract(y_, apply_into(function, x, residual), out=residual)
+    np.copyto(dx, residual)
+    apply_into(function, dx, dy)
+    iterations = 0
+    example_iterations = np.zeros(y.shape[0], np.int32)
+    while max_iterations is None or iterations < max_iterations:
+        max_residual = np.max(np.abs(residual, out=temp), axis=non_batch_dims, keepdims=True)
+        if accuracy is not None and np.max(max_residual) <= accuracy:
+            break
+        active = np.ones_like(max_residual) if accuracy is None else (max_residual > accuracy).astype(dtype)
+        dx_dy = np.sum(np.multiply(dx, dy, out=temp), axis=non_batch_dims, keepdims=True)
+        step_size = active * math.divide_no_nan(np.sum(np.multiply(dx, residual, out=temp), axis=non_batch_dims, keepdims=True), dx_dy)
+        x += np.multiply(step_size, dx, out=temp)
+        residual -= np.multiply(step_size, dy, out=temp)
+        beta = math.divide_no_nan(np.sum(np.multiply(residual, dy, out=temp), axis=non_batch_dims, keepdims=True), dx_dy)
+        np.subtract(residual, np.multiply(beta, dx, out=temp), out=temp)
+        np.copyto(dx, temp, where=active > 0)
+        apply_into(function, dx, dy)
+        if callback is not None:
+            callback(residual)
+        iterations += 1
+        example_iterations += np.sum(active, axis=non_batch_dims).astype(np.int32)
+    return SolveResult(iterations, np.array(x), np.array(residual), example_iterations)
+
+
+def apply_into(function, x, out):
+    """
+    Writes `function(x)` into the NumPy array `out`.
+    Functions with a true `supports_out` attribute are called with `out` and compute the result in place.
+
+    :return: out
+    """
+    if getattr(function, 'supports_out', False):
+        return function(x, out=out)
+    out[...] = function(x)
+    return out
+
+
+def preconditioned_conjugate_gradient(function, y, x0, preconditioner, accuracy=1e-5, max_iterations=1000, back_prop=False, compact=False, callback=None):
+    """
+    Solve the linear system of equations `A·x=y` using the preconditioned conjugate gradient (PCG) algorithm.
+    The preconditioner approximates the inverse of A, reducing the number of iterations required for ill-conditioned systems.
+
+    The search directions are updated with the Polak-Ribière formula.
+    This keeps the algorithm convergent when the preconditioner is not exactly linear, e.g. a multigrid cycle with an iterative coarse-grid solver.
+    Like `conjugate_gradient()`, converged examples are frozen while the rest of the batch keeps iterating.
+
+    :param function: linear function of x that returns A·x
+    :param y: Desired output of `f(x)`
+    :param x0: initial guess for the value of x
+    :param preconditioner: linear function mapping a residual r to an approximation of A⁻¹·r, tensors shaped like y
+    :param accuracy: (optional) the algorithm terminates once |f(x)-y| ≤ accuracy for every entry. If None, the algorithm runs until `max_iterations` is reached.
+    :param max_iterations: (optional) maximum number of PCG iterations to perform
+    :param back_prop: Whether to enable auto-differentiation. This induces a memory cost scaling with the number of iterations. Otherwise, the memory cost is constant.
+    :param compact: If True and all tensors are NumPy arrays, converged examples are removed from the batch passed to `function` and `preconditioner`, see `conjugate_gradient()`.
+    :param callback: (optional) function called with the residual after every iteration
+    :return: SolveResult holding the number of iterations, the result for x, the final residual and the number of iterations performed for each example
+    """
+    y = math.to_float(y)
+    x0 = math.to_float(x0)
+    residual0 = y - function(x0)
+    z0 = preconditioner(residual0)
+    non_batch_dims = tuple(range(1, len(y.shape)))
+
+    def pcg_loop(x, dx, dy, residual, z, iterations, example_iterations):
+        active = _active_examples(residual, non_batch_dims, accuracy)
+        residual_z = math.sum(residual * z, axis=non_batch_dims, keepdims=True)
+        step_size = active * math.divide_no_nan(residual_z, math.sum(dx * dy, axis=non_batch_dims, keepdims=True))
+        x = x + step_size * dx
+        next_residual = residual - step_size * dy
+        next_z = active * preconditioner(next_residual) + (1 - active) * z
+        beta = math.divide_no_nan(math.sum(next_z * (next_residual - residual), axis=non_batch_dims, keepdims=True), residual_z)
+        dx = active * (next_z + beta * dx) + (1 - active) * dx
         dy = function(dx)
-        return [x, dx, dy, residual, iterations + 1]
+        if callback is not None:
+            callback(next_residual)
+        return [x, dx, dy, next_residual, next_z, iterations + 1, example_iterations + math.to_int(math.sum(active, axis=non_batch_dims))]
+
+    loop_vars = [x0, z0, function(z0), residual0, z0, 0, _zero_example_iterations(y, non_batch_dims)]
+    if _compactable(compact, accuracy, back_prop, y, x0):
+        x_, _, _, residual_, _, iterations_, example_iterations_ = _compacted_while_loop(pcg_loop, loop_vars, 3, accuracy, max_iterations)
+    else:
+        x_, _, _, residual_, _, iterations_, example_iterations_ = math.while_loop(_max_residual_condition(3, accuracy), pcg_loop, loop_vars, back_prop=back_prop, name="PreconditionedConjGrad", maximum_iterations=max_iterations)
+    return SolveResult(iterations_, x_, residual_, example_iterations_)
+
 
-    x_, _, _, residual_, iterations_ = math.while_loop(_max_residual_condition(3, accuracy), cg_loop, [x0, dx0, dy0, residual0, 0], back_prop=back_prop, name="ConjGrad", maximum_iterations=max_iterations)
-    return SolveResult(iterations_, x_, residual_)
+def fused_conjugate_gradient(function, y, x0, preconditioner=None, accuracy=1e-5, max_iterations=1000, back_prop=False, check_interval=4, compact=False, callback=None):
+    """
+    Solve the linear system of equations `A·x=y` using the single-reduction (preconditioned) conjugate gradient algorithm by Chronopoulos and Gear.
+
+    Mathematically, the iterates equal those of `conjugate_gradient()` or `preconditioned_conjugate_gradient()`.
+    The direction update `A·p` is computed by recurrence from `w=A·u` so that both dot products of an iteration can be computed in a single fused reduction.
+    Convergence is only checked every `check_interval` iterations, saving the reduction for the maximum residual in between.
+    This reduces the number of synchronization points per iteration from two plus the stopping check to one, which pays off when the reductions dominate, e.g. for cheap operators on GPUs.
+    Unlike pipelined variants, this recurrence retains the attainable accuracy of the standard algorithm in single precision.
+
+    :param function: linear function of x that returns A·x
+    :param y: Desired output of `f(x)`
+    :param x0: initial guess for the value of x
+    :param preconditioner: (optional) linear function mapping a residual r to an approximation of A⁻¹·r, tensors shaped like y
+    :param accuracy: (optional) the algorithm terminates once |f(x)-y| ≤ accuracy for every entry. If None, the algorithm runs until `max_iterations` is reached.
+    :param max_iterations: (optional) maximum number of iterations to perform, rounded up to a multiple of `check_interval`
+    :param back_prop: Whether to enable auto-differentiation. This induces a memory cost scaling with the number of iterations. Otherwise, the memory cost is constant.
+    :param check_interval: number of iterations between convergence checks. Converged examples are frozen at the checks.
+    :param compact: If True and all tensors are NumPy arrays, converged examples are removed from the batch at the checks, see `conjugate_gradient()`.
+    :param callback: (optional) function called with the residual after every iteration
+    :return: SolveResult holding the number of iterations, the result for x, the final residual and the number of iterations performed for each example
+    """
+    y = math.to_float(y)
+    x0 = math.to_float(x0)
+    non_batch_dims = tuple(range(1, len(y.shape)))
+    residual0 = y - function(x0)
+    u0 = preconditioner(residual0) if preconditioner is not None else residual0
+    zeros = math.zeros_like(y)
+    scalar_zeros = math.sum(zeros, axis=non_batch_dims, keepdims=True)
+
+    def fused_loop(x, residual, u, w, s, p, gamma, alpha, iterations, example_iterations):
+        active = _active_examples(residual, non_batch_dims, accuracy)
+        for _ in range(check_interval):
+            next_gamma, delta = _fused_sums([residual * u, w * u], non_batch_dims)
+            beta = math.divide_no_nan(next_gamma, gamma)
+            alpha = math.divide_no_nan(next_gamma, delta - beta * math.divide_no_nan(next_gamma, alpha))
+            gamma = next_gamma
+            p = u + beta * p
+            s = w + beta * s
+            step_size = active * alpha
+            x = x + step_size * p
+            residual = residual - step_size * s
+            u = preconditioner(residual) if preconditioner is not None else residual
+            w = function(u)
+            if callback is not None:
+                callback(residual)
+        return [x, residual, u, w, s, p, gamma, alpha, iterations + check_interval, example_iterations + check_interval * math.to_int(math.sum(active, axis=non_batch_dims))]
+
+    loop_vars = [x0, residual0, u0, function(u0), zeros, zeros, scalar_zeros, scalar_zeros, 0, _zero_example_iterations(y, non_batch_dims)]
+    max_checks = None if max_iterations is None else -(-max_iterations // check_interval)
+    if _compactable(compact, accuracy, back_prop, y, x0):
+        result = _compacted_while_loop(fused_loop, loop_vars, 1, accuracy, max_checks)
+    else:
+        result = math.while_loop(_max_residual_condition(1, accuracy), fused_loop, loop_vars, back_prop=back_prop, name="FusedConjGrad", maximum_iterations=max_checks)
+    return SolveResult(result[8], result[0], result[1], result[9])
+
+
+def _fused_sums(products, non_batch_dims):
+    """
+    Sums each of the given tensors over all non-batch dimensions using a single reduction.
+    NumPy arrays are summed separately since their reductions involve no synchronization.
+
+    :return: list of tensors of shape (batch, 1, ...)
+    """
+    if all(isinstance(product, np.ndarray) for product in products):
+        return [np.sum(product, axis=non_batch_dims, keepdims=True) for product in products]
+    sums = math.sum(math.stack(products, axis=-1), axis=non_batch_dims, keepdims=True)
+    return math.unstack(sums, axis=-1)
 
 
 def _max_residual_condition(residual_index, accuracy):
@@ -85,3 +272,50 @@ def _max_residual_condition(residual_index, accuracy):
         return lambda *args: True
     else:
         return lambda *args: math.max(math.abs(args[residual_index])) > accuracy
+
+
+def _active_examples(residual, non_batch_dims, accuracy):
+    """
+    Mask that is 1 for examples whose residual exceeds `accuracy` and 0 for converged examples, shaped (batch, 1, ...).
+    """
+    if accuracy is None:
+        return math.ones_like(math.max(residual, axis=non_batch_dims, keepdims=True))
+    return math.to_float(math.max(math.abs(residual), axis=non_batch_dims, keepdims=True) > accuracy)
+
+
+def _zero_example_iterations(y, non_batch_dims):
+    return math.to_int(math.sum(y, axis=non_batch_dims)) * 0
+
+
+def _compactable(compact, accuracy, back_prop, *tensors):
+    return compact and accuracy is not None and not back_prop and all(isinstance(tensor, np.ndarray) for tensor in tensors)
+
+
+def _compacted_while_loop(body, loop_vars, residual_index, accuracy, max_iterations):
+    """
+    Replacement for `math.while_loop` on NumPy arrays that passes only the unconverged examples to `body`.
+    NumPy arrays among `loop_vars` are batched along their first axis, other loop variables are passed through `body` unchanged.
+
+    :return: final loop variables, batched ones containing all examples
+    """
+    loop_vars = [np.array(var) if isinstance(var, np.ndarray) else var for var in loop_vars]
+    batched = [isinstance(var, np.ndarray) for var in loop_vars]
+    batch_size = loop_vars[residual_index].shape[0]
+    non_batch_dims = tuple(range(1, loop_vars[residual_index].ndim))
+    active = np.arange(batch_size)
+    i = 0
+    while max_iterations is None or i < max_iterations:
+        active = active[np.max(np.abs(loop_vars[residual_index][active]), axis=non_batch_dims) > accuracy]
+        if len(active) == 0:
+            break
+        if len(active) == batch_size:
+            loop_vars = list(body(*loop_vars))
+        else:
+            result = body(*[var[active] if is_batched else var for var, is_batched in zip(loop_vars, batched)])
+            for index, value in enumerate(result):
+                if batched[index]:
+                    loop_vars[index][active] = value
+                else:
+                    loop_vars[index] = value
+        i += 1
+    return loop_vars
@@ -7,6 +7,7 @@ from .sampled import SampledField
 from .analytic import AnalyticField, SymbolicFieldBackend
 from .mask import GeometryMask, mask, union_mask
 from .noise import Noise
+from .lazy import lazy_operations
 from . import advect
 from . import manta
 from .util import diffuse, data_bounds, staggered_curl_2d
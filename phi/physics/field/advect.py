@@ -1,6 +1,9 @@
+import numpy as np
+
 from phi import math
 from phi.physics.field import SampledField, ConstantField, StaggeredGrid, CenteredGrid
 from .field import StaggeredSamplePoints, Field
+from .grid import _pad_mode, _pad_value
 
 
 def advect(field, velocity, dt):
@@ -38,10 +41,93 @@ def semi_lagrangian(field, velocity_field, dt):
         data = field.sample_at(x.data)
         return field.with_data(data)
     except StaggeredSamplePoints:
+        if isinstance(velocity_field, StaggeredGrid) and field.compatible(velocity_field):
+            return field.with_data(staggered_semi_lagrangian(field, velocity_field, dt))
         advected = [semi_lagrangian(component, velocity_field, dt) for component in field.unstack()]
         return field.with_data(advected)
 
 
+def semi_lagrangian_all(fields, velocity_field, dt):
+    """
+    Semi-Lagrangian advection of multiple fields by the same velocity.
+
+    CenteredGrids that share a box, resolution and extrapolation mode are backtraced once and sampled with a common interpolation plan.
+    All other fields are advected individually with `semi_lagrangian()`.
+
+    :param fields: list or tuple of Fields to be advected
+    :param velocity_field: vector field, need not be compatible with the fields
+    :param dt: time increment
+    :return: list of advected fields in the order of `fields`
+    """
+    result = [None] * len(fields)
+    plans = []  # (grid layout, InterpolationPlan)
+    for i, field in enumerate(fields):
+        if not isinstance(field, CenteredGrid):
+            result[i] = semi_lagrangian(field, velocity_field, dt)
+            continue
+        plan = None
+        for other, other_plan in plans:
+            if field.compatible(other) and np.all(field.resolution == other.resolution) and field.extrapolation == other.extrapolation:
+                plan = other_plan
+                break
+        if plan is None:
+            x0 = field.points
+            x = x0 - velocity_field.at(x0) * dt
+            plan = field.interpolation_plan(x.data)
+            plans.append((field, plan))
+        result[i] = field.with_data(field.sample_with(plan))
+    return result
+
+
+def staggered_semi_lagrangian(field, velocity, dt):
+    """
+    Semi-Lagrangian advection of all components of a StaggeredGrid by a staggered velocity field on the same grid, e.g. for self-advection.
+
+    Instead of sampling `velocity` at generic sample points, the velocity at the faces of each component is computed directly in index space.
+    The matching velocity component is already stored at these faces, the other components are averaged from the four surrounding faces.
+    The backtraced positions are then formed in index coordinates of the component grid and resampled in one call per component.
+
+    :param field: StaggeredGrid to be advected
+    :param velocity: StaggeredGrid compatible with `field`
+    :param dt: time increment
+    :return: list of advected component tensors
+    """
+    components = field.unstack()
+    velocity_components = velocity.unstack()
+    rank = field.rank
+    result = []
+    for axis, component in enumerate(components):
+        coordinates = []
+        for dim, velocity_component in enumerate(velocity_components):
+            face_velocity = velocity_component.data if dim == axis else _face_average(velocity_component, axis, dim)
+            shape = [1] * (rank + 2)
+            shape[dim + 1] = math.staticshape(component.data)[dim + 1]
+            index = math.choose_backend(face_velocity).as_tensor(math.to_float(np.reshape(np.arange(shape[dim + 1]), shape)))
+            coordinates.append(index - face_velocity * (dt / velocity.dx[dim]))
+        local_points = math.concat(coordinates, axis=-1)
+        result.append(math.resample(component.data, local_points, boundary=_pad_mode(component.extrapolation), interpolation=component.interpolation, constant_values=_pad_value(component.extrapolation_value)))
+    return result
+
+
+def _face_average(component, axis, dim):
+    """
+    Interpolates the velocity component stored at the faces normal to `dim` to the faces normal to `axis`.
+
+    Relative to the faces normal to `axis`, the grid of `component` is shifted by half a cell in the positive `dim` and negative `axis` directions.
+    Each value is therefore the mean of the four surrounding values, extrapolating `component` by one cell across the `axis` boundaries.
+
+    :param component: CenteredGrid holding the velocity component `dim` of a StaggeredGrid
+    :return: tensor shaped like the component `axis` of the StaggeredGrid
+    """
+    data = math.pad(component.data, [[0, 0]] + [[1, 1] if d == axis else [0, 0] for d in range(component.rank)] + [[0, 0]], _pad_mode(component.extrapolation), constant_values=_pad_value(component.extrapolation_value))
+    data = _axis_slice(data, axis, None, -1) + _axis_slice(data, axis, 1, None)
+    return 0.25 * (_axis_slice(data, dim, None, -1) + _axis_slice(data, dim, 1, None))
+
+
+def _axis_slice(tensor, dim, start, stop):
+    return tensor[(slice(None),) * (dim + 1) + (slice(start, stop),)]
+
+
 def mac_cormack(field, velocity_field, dt, correction_strength=1.0):
     """
     MacCormack advection uses a forward and backward lookup to determine the first-order error of semi-Lagrangian advection.
@@ -59,10 +145,11 @@ def mac_cormack(field, velocity_field, dt, correction_strength=1.0):
         v = velocity_field.at(x0)
         x_bwd = x0 - v * dt
         x_fwd = x0 + v * dt
-        field_semi_la = field.with_data(field.sample_at(x_bwd.data))  # semi-Lagrangian advection
+        plan_bwd = field.interpolation_plan(x_bwd.data)  # shared by the backward lookup and the clamping bounds
+        field_semi_la = field.with_data(field.sample_with(plan_bwd))  # semi-Lagrangian advection
         field_inv_semi_la = field.with_data(field_semi_la.sample_at(x_fwd.data))  # inverse semi-Lagrangian advection
         new_field = field_semi_la + correction_strength * 0.5 * (field - field_inv_semi_la)
-        field_clamped = math.clip(new_field, *field.general_sample_at(x_bwd.data, 'minmax'))  # Address overshoots
+        field_clamped = math.clip(new_field, *field.sample_with(plan_bwd, 'minmax'))  # Address overshoots
         return field_clamped
     except StaggeredSamplePoints:
         advected = [mac_cormack(component, velocity_field, dt) for component in field.unstack()]
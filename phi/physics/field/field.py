@@ -157,52 +157,56 @@ class Field(State):
         return self.copied_with(data=data, flags=())
 
     def __mul__(self, other):
-        return self.__dataop__(other, True, lambda d1, d2: math.mul(d1, d2))
+        return self.__dataop__(other, True, _mul)
 
     __rmul__ = __mul__
 
     def __truediv__(self, other):
-        return self.__dataop__(other, True, lambda d1, d2: math.div(d1, d2))
+        return self.__dataop__(other, True, _div)
 
     def __rtruediv__(self, other):
-        return self.__dataop__(other, False, lambda d1, d2: math.div(d2, d1))
+        return self.__dataop__(other, False, _rdiv)
 
     def __sub__(self, other):
-        return self.__dataop__(other, False, lambda d1, d2: math.sub(d1, d2))
+        return self.__dataop__(other, False, _sub)
 
     def __rsub__(self, other):
-        return self.__dataop__(other, False, lambda d1, d2: math.sub(d2, d1))
+        return self.__dataop__(other, False, _rsub)
 
     def __add__(self, other):
-        return self.__dataop__(other, False, lambda d1, d2: math.add(d1, d2))
+        return self.__dataop__(other, False, _add)
 
     __radd__ = __add__
 
     def __pow__(self, power, modulo=None):
-        return self.__dataop__(power, False, lambda f, p: math.pow(f, p))
+        return self.__dataop__(power, False, _pow)
 
     def __neg__(self):
         return self * -1
 
     def __gt__(self, other):
-        return self.__dataop__(other, False, lambda x, y: x > y)
+        return self.__dataop__(other, False, _gt)
 
     def __ge__(self, other):
-        return self.__dataop__(other, False, lambda x, y: x >= y)
+        return self.__dataop__(other, False, _ge)
 
     def __lt__(self, other):
-        return self.__dataop__(other, False, lambda x, y: x < y)
+        return self.__dataop__(other, False, _lt)
 
     def __le__(self, other):
-        return self.__dataop__(other, False, lambda x, y: x <= y)
+        return self.__dataop__(other, False, _le)
 
     def __and__(self, other):
-        return self.__dataop__(other, False, lambda x, y: x & y)
+        return self.__dataop__(other, False, _and)
 
     def __or__(self, other):
-        return self.__dataop__(other, False, lambda x, y: x | y)
+        return self.__dataop__(other, False, _or)
 
     def __dataop__(self, other, linear_if_scalar, data_operator):
+        from .lazy import lazy_dataop
+        lazy = lazy_dataop(self, other, linear_if_scalar, data_operator)
+        if lazy is not None:
+            return lazy
         if isinstance(other, Field):
             assert self.compatible(other), 'Fields are not compatible: %s and %s' % (self, other)
             flags = propagate_flags_operation(self.flags + other.flags, False, self.rank, self.component_count)
@@ -219,6 +223,60 @@ class Field(State):
         return FieldPhysics(self.name)
 
 
+# --- Data operators of the arithmetic and comparison operators, see phi.physics.field.lazy ---
+
+def _add(d1, d2):
+    return math.add(d1, d2)
+
+
+def _sub(d1, d2):
+    return math.sub(d1, d2)
+
+
+def _rsub(d1, d2):
+    return math.sub(d2, d1)
+
+
+def _mul(d1, d2):
+    return math.mul(d1, d2)
+
+
+def _div(d1, d2):
+    return math.div(d1, d2)
+
+
+def _rdiv(d1, d2):
+    return math.div(d2, d1)
+
+
+def _pow(f, p):
+    return math.pow(f, p)
+
+
+def _gt(x, y):
+    return x > y
+
+
+def _ge(x, y):
+    return x >= y
+
+
+def _lt(x, y):
+    return x < y
+
+
+def _le(x, y):
+    return x <= y
+
+
+def _and(x, y):
+    return x & y
+
+
+def _or(x, y):
+    return x | y
+
+
 class StaggeredSamplePoints(Exception):
 
     def __init__(self, *args):
@@ -1,8 +1,10 @@
+from collections import OrderedDict
+
 import numpy as np
 import six
 
 from phi import math, struct
-from phi.backend.backend_helper import general_grid_sample_nd
+from phi.backend.backend_helper import general_grid_sample_nd, InterpolationPlan
 from phi.geom import AABox, box
 from phi.geom.geometry import assert_same_rank
 from phi.math.helper import map_for_axes
@@ -22,6 +24,91 @@ def _crop_for_interpolation(data, offset_float, window_resolution):
     return data
 
 
+class SamplePointCache(object):
+
+    def __init__(self, max_size=32, max_bytes=2 ** 28):
+        """
+        Bounded least-recently-used cache for grids of sample points.
+
+        Simulations access the cell centers of the same grids in every step, e.g. for semi-Lagrangian advection.
+        Caching them avoids recomputing and reallocating identical coordinate arrays.
+        The cached arrays are marked read-only as they are shared between all users.
+
+        :param max_size: maximum number of point grids held at any time. The least recently used entry is evicted first.
+        :param max_bytes: maximum total size of the cached arrays in bytes. The most recently used entry is always kept.
+        """
+        assert max_size > 0, max_size
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, build):
+        """
+        Looks up the point grid stored under `key` or builds and stores it if not present.
+
+        :param key: key created by `sample_point_key()` or None to bypass the cache
+        :param build: function without arguments that creates the point grid
+        :return: cached or newly built CenteredGrid
+        """
+        if key is None:
+            return build()
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        self.misses += 1
+        points = build()
+        if not isinstance(points.data, np.ndarray):
+            return points
+        points.data.flags.writeable = False
+        self._entries[key] = points
+        while len(self._entries) > 1 and (len(self._entries) > self.max_size or self.nbytes > self.max_bytes):
+            self._entries.popitem(last=False)
+        return points
+
+    @property
+    def nbytes(self):
+        """ Total size of all cached point arrays in bytes. """
+        return sum(points.data.nbytes for points in self._entries.values())
+
+    def clear(self):
+        """ Removes all entries and resets the hit and miss counters. """
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return 'SamplePointCache(%d/%d entries, %.1f MB, %d hits, %d misses)' % (len(self._entries), self.max_size, self.nbytes / 2. ** 20, self.hits, self.misses)
+
+
+SAMPLE_POINT_CACHE = SamplePointCache()
+
+
+def sample_point_key(box, resolution):
+    """
+    Creates a cache key for the cell centers of a grid or returns None if the box is not defined by NumPy values.
+
+    :param box: AABox covering the grid
+    :param resolution: grid resolution
+    :return: hashable key or None
+    """
+    if not isinstance(box, AABox) or not all(isinstance(corner, (np.ndarray, np.number, float, int)) for corner in (box.lower, box.upper)):
+        return None
+    return tuple(np.reshape(box.lower, -1).tolist()), tuple(np.reshape(box.upper, -1).tolist()), tuple(int(dim) for dim in resolution), math.to_float(0).dtype
+
+
+def _compute_points(box, resolution):
+    idx_zyx = np.meshgrid(*[np.linspace(0.5 / dim, 1 - 0.5 / dim, dim) for dim in resolution], indexing="ij")
+    local_coords = math.to_float(math.expand_dims(math.stack(idx_zyx, axis=-1), 0))
+    points = box.local_to_global(local_coords)
+    return CenteredGrid(points, box, name='grid_centers(%s, %s)' % (box, resolution), flags=[SAMPLE_POINTS])
+
+
 @struct.definition()
 class CenteredGrid(Field):
 
@@ -122,6 +209,29 @@ class CenteredGrid(Field):
         result = general_grid_sample_nd(self.data, local_points, boundary=_pad_mode(self.extrapolation), constant_values=_pad_value(self.extrapolation_value), math=math.choose_backend([self.data, points]), reduce=reduce)
         return result
 
+    def interpolation_plan(self, points):
+        """
+        Precomputes the interpolation stencil for sampling this grid at `points`.
+        The plan can be passed to `sample_with()` of any CenteredGrid sharing the box, resolution and extrapolation mode of this grid.
+
+        :param points: tensor of shape (batch_dim, ..., rank) holding physical positions
+        :return: InterpolationPlan
+        """
+        local_points = self.box.global_to_local(points)
+        local_points = math.mul(local_points, math.to_float(self.resolution)) - 0.5
+        return InterpolationPlan(local_points, self.resolution, _pad_mode(self.extrapolation), math.choose_backend([self.data, points]))
+
+    def sample_with(self, plan, reduce='linear'):
+        """
+        Samples this grid using an interpolation plan created by `interpolation_plan()` of a grid with the same layout.
+
+        :param plan: InterpolationPlan
+        :param reduce: 'linear', 'min', 'max' or 'minmax', see `general_sample_at()`
+        :return: tensor of sampled values
+        """
+        assert plan.boundary == _pad_mode(self.extrapolation), 'interpolation plan was created for boundary %s but grid has %s' % (plan.boundary, _pad_mode(self.extrapolation))
+        return plan.apply(self.data, constant_values=_pad_value(self.extrapolation_value), reduce=reduce)
+
     def at(self, other_field):
         if self.compatible(other_field):
             return self
@@ -199,10 +309,15 @@ class CenteredGrid(Field):
 
     @staticmethod
     def getpoints(box, resolution):
-        idx_zyx = np.meshgrid(*[np.linspace(0.5 / dim, 1 - 0.5 / dim, dim) for dim in resolution], indexing="ij")
-        local_coords = math.to_float(math.expand_dims(math.stack(idx_zyx, axis=-1), 0))
-        points = box.local_to_global(local_coords)
-        return CenteredGrid(points, box, name='grid_centers(%s, %s)' % (box, resolution), flags=[SAMPLE_POINTS])
+        """
+        Creates a CenteredGrid holding the positions of the cell centers of a grid.
+        NumPy point grids are memoized in `SAMPLE_POINT_CACHE` and their data is read-only.
+
+        :param box: AABox covering the grid
+        :param resolution: grid resolution
+        :return: CenteredGrid with SAMPLE_POINTS flag
+        """
+        return SAMPLE_POINT_CACHE.get(sample_point_key(box, resolution), lambda: _compute_points(box, resolution))
 
     def laplace(self, physical_units=True, axes=None):
         if not physical_units:
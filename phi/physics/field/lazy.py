@@ -0,0 +1,194 @@
+"""
+Opt-in lazy evaluation of field arithmetic.
+
+Inside a `lazy_operations()` block, arithmetic and comparison operators on NumPy CenteredGrids build an expression tree instead of evaluating each operation eagerly.
+The tree is evaluated once, when its data is accessed, it is resampled with `at()` or it is used outside of the block.
+Intermediate results are owned by the tree, so subsequent operations write into them using NumPy `out=` buffers instead of allocating a new array per operator.
+
+Lazy fields are CenteredGrids with the same properties as the grids they are computed from.
+Struct functions such as `struct.map()` or `copied_with()` evaluate them and return plain CenteredGrids.
+
+Example:
+    with lazy_operations():
+        velocity += (density * -gravity * buoyancy_factor * dt).at(velocity)
+"""
+import threading
+from contextlib import contextmanager
+from numbers import Number
+
+import numpy as np
+
+from phi import math, struct
+
+from .field import (Field, propagate_flags_operation,
+                    _add, _sub, _rsub, _mul, _div, _rdiv, _pow, _gt, _ge, _lt, _le, _and, _or)
+from .grid import CenteredGrid
+
+
+_LAZY = threading.local()  # per-thread flag, lazy_operations() blocks in other threads do not affect each other
+
+
+def _is_lazy_mode():
+    return getattr(_LAZY, 'enabled', False)
+
+
+# --- NumPy ufuncs equivalent to the data operators of Field, (ufunc, swap_arguments, may_write_in_place) ---
+_UFUNCS = {
+    _add: (np.add, False, True),
+    _sub: (np.subtract, False, True),
+    _rsub: (np.subtract, True, True),
+    _mul: (np.multiply, False, True),
+    _div: (np.true_divide, False, True),
+    _rdiv: (np.true_divide, True, True),
+    _pow: (np.power, False, True),
+    _gt: (np.greater, False, False),
+    _ge: (np.greater_equal, False, False),
+    _lt: (np.less, False, False),
+    _le: (np.less_equal, False, False),
+    _and: (np.bitwise_and, False, False),
+    _or: (np.bitwise_or, False, False),
+}
+
+
+@contextmanager
+def lazy_operations(enabled=True):
+    """
+    Enables (or disables) lazy evaluation of arithmetic on NumPy CenteredGrids within the context in the current thread.
+
+    Outside of the context, operations involving a lazy field evaluate it first and return plain CenteredGrids.
+
+    :param enabled: whether operations within the context are evaluated lazily
+    """
+    previous = _is_lazy_mode()
+    _LAZY.enabled = enabled
+    try:
+        yield
+    finally:
+        _LAZY.enabled = previous
+
+
+def lazy_dataop(field, other, linear_if_scalar, data_operator):
+    """
+    Lazy counterpart of `Field.__dataop__`.
+
+    :return: _LazyOpField or None if the operation should be evaluated eagerly
+    """
+    if not _is_lazy_mode():
+        if isinstance(other, _LazyOpField):
+            other = other.evaluate()
+        if isinstance(field, _LazyOpField):
+            return field.evaluate().__dataop__(other, linear_if_scalar, data_operator)
+        return None
+    if _is_lazy_operand(field) and _is_lazy_operand(other, template=_template(field)):
+        if isinstance(other, Field):
+            flags = propagate_flags_operation(field.flags + other.flags, False, field.rank, field.component_count)
+        else:
+            flags = propagate_flags_operation(field.flags, linear_if_scalar, field.rank, field.component_count)
+        return _LazyOpField(data_operator, [field, other], _template(field), flags=flags)
+    if isinstance(field, _LazyOpField):
+        return field.evaluate().__dataop__(other, linear_if_scalar, data_operator)
+    return None
+
+
+def _template(field):
+    return field.template if isinstance(field, _LazyOpField) else field
+
+
+def _is_lazy_operand(value, template=None):
+    if isinstance(value, _LazyOpField):
+        value = value.template
+    elif isinstance(value, (Number, np.ndarray, np.generic)):
+        return True
+    if not isinstance(value, CenteredGrid) or not isinstance(value.data, np.ndarray):
+        return False
+    return template is None or template.compatible(value)
+
+
+@struct.definition()
+class _LazyOpField(CenteredGrid):
+    """
+    Unevaluated result of an operation on NumPy CenteredGrids.
+    All items except the data are copied from `template`, the data is computed from the expression tree when first accessed.
+    """
+
+    def __init__(self, function, function_args, template, flags=()):
+        assert isinstance(template, CenteredGrid)
+        self.function = function
+        self.function_args = tuple(function_args)
+        self.template = template
+        self._evaluated = None
+        items = struct.to_dict(template, item_condition=struct.ALL_ITEMS)
+        items.update(data=None, flags=flags)
+        CenteredGrid.__init__(self, **items)
+        del self._data  # reading the data evaluates the expression tree, see __getattr__
+
+    def __getattr__(self, name):
+        if name != '_data':
+            raise AttributeError(name)
+        self._data = self._compute()[0]
+        return self._data
+
+    def evaluate(self):
+        """
+        Evaluates the expression tree once and returns the result as a plain CenteredGrid.
+
+        :return: CenteredGrid
+        :rtype: CenteredGrid
+        """
+        if self._evaluated is None:
+            self._evaluated = self.template.copied_with(data=self.data, flags=self.flags)
+        return self._evaluated
+
+    def _compute(self):
+        """
+        Evaluates the expression tree, reusing buffers of intermediate results.
+
+        :return: (data, owned) where owned indicates that data is a new array that may be overwritten.
+        """
+        (a, a_owned), (b, b_owned) = [_operand_data(arg) for arg in self.function_args]
+        ufunc, swap, in_place = _UFUNCS.get(self.function, (None, False, False))
+        if ufunc is None or not isinstance(a, np.ndarray) and not isinstance(b, np.ndarray):
+            return self.function(a, b), True
+        if swap:
+            (a, a_owned), (b, b_owned) = (b, b_owned), (a, a_owned)
+        if in_place:
+            dtype = np.result_type(a, b)
+            for buffer, owned in ((a, a_owned), (b, b_owned)):
+                if owned and buffer.dtype == dtype and np.issubdtype(dtype, np.floating) and buffer.shape == np.broadcast(a, b).shape:
+                    return ufunc(a, b, out=buffer), True
+        return ufunc(a, b), True
+
+    def copied_with(self, change_type=None, **kwargs):
+        return self.evaluate().copied_with(change_type=change_type, **kwargs)
+
+    @property
+    def resolution(self):
+        return self.template.resolution
+
+    @property
+    def component_count(self):
+        return _static_shape(self)[-1]
+
+    def __repr__(self):
+        return '%s(%s)' % (self.function.__name__, ', '.join(repr(arg) for arg in self.function_args))
+
+
+def _static_shape(value):
+    if isinstance(value, _LazyOpField):
+        if vars(value).get('_data', None) is not None:  # evaluated, None while the grid is being constructed
+            return value.data.shape
+        shapes = [_static_shape(arg) for arg in value.function_args]
+        return np.broadcast(*[np.broadcast_to(np.empty((), np.bool_), shape) for shape in shapes]).shape
+    if isinstance(value, Field):
+        return value.data.shape
+    return np.shape(value)
+
+
+def _operand_data(value):
+    if isinstance(value, _LazyOpField):
+        if vars(value).get('_data', None) is not None:
+            return value.data, False
+        return value._compute()
+    data = value.data if isinstance(value, Field) else value
+    tensor = math.as_tensor(data, convert_external=False)  # enforces the backend precision like the eager operators
+    return tensor, tensor is not data
@@ -6,6 +6,7 @@ import numpy as np
 from phi import math, struct
 from phi.geom import AABox
 from phi.geom.geometry import assert_same_rank
+from phi.math.nd import pooled_pad
 from phi.struct.tensorop import collapse
 
 from ..domain import Domain
@@ -13,6 +14,7 @@ from .field import (Field, IncompatibleFieldTypes, StaggeredSamplePoints,
                     broadcast_at, propagate_flags_children,
                     propagate_flags_operation, propagate_flags_resample)
 from .grid import CenteredGrid
+from .lazy import lazy_operations
 
 _SUBSCRIPTS = ['x', 'y', 'z', 'w']
 
@@ -194,6 +196,10 @@ class StaggeredGrid(Field):
             return False
 
     def __dataop__(self, other, linear_if_scalar, data_operator):
+        with lazy_operations(False):  # components are stored as evaluated CenteredGrids
+            return self._dataop(other, linear_if_scalar, data_operator)
+
+    def _dataop(self, other, linear_if_scalar, data_operator):
         if isinstance(other, StaggeredGrid):
             assert self.compatible(other), 'Fields are not compatible: %s and %s' % (self, other)
             data = [data_operator(c1, c2) for c1, c2 in zip(self.data, other.data)]
@@ -246,8 +252,8 @@ class StaggeredGrid(Field):
             raise ValueError('input must be a scalar field')
         tensors = []
         for dim in math.spatial_dimensions(data):
-            upper = math.pad(data, [[0,1] if d == dim else [0,0] for d in math.all_dimensions(data)], padding_mode)
-            lower = math.pad(data, [[1,0] if d == dim else [0,0] for d in math.all_dimensions(data)], padding_mode)
+            upper = pooled_pad(data, [[0,1] if d == dim else [0,0] for d in math.all_dimensions(data)], padding_mode, key=(StaggeredGrid.gradient, 'upper'))
+            lower = pooled_pad(data, [[1,0] if d == dim else [0,0] for d in math.all_dimensions(data)], padding_mode, key=(StaggeredGrid.gradient, 'lower'))
             tensors.append((upper - lower) / scalar_field.dx[dim - 1])
         return StaggeredGrid(tensors, scalar_field.box, name='grad(%s)' % scalar_field.name,
                              batch_size=scalar_field._batch_size)
@@ -17,7 +17,7 @@ from .field import CenteredGrid, StaggeredGrid, advect, union_mask
 from .field.effect import Gravity, effect_applied, gravity_tensor, FieldEffect, FieldPhysics
 from .material import OPEN, Material
 from .physics import Physics, StateDependency
-from .pressuresolver.solver_api import FluidDomain, poisson_solve
+from .pressuresolver.solver_api import FluidDomain, SolveTelemetry, poisson_solve
 
 
 @struct.definition()
@@ -79,7 +79,12 @@ Supports buoyancy proportional to the marker density.
 Supports obstacles, density effects, velocity effects, global gravity.
     """
 
-    def __init__(self, pressure_solver=None, make_input_divfree=False, make_output_divfree=True, conserve_density=True):
+    def __init__(self, pressure_solver=None, make_input_divfree=False, make_output_divfree=True, conserve_density=True, warm_start=False, telemetry=None):
+        """
+        :param warm_start: If True, the pressure of the previous step, stored in `Fluid.solve_info['pressure']`, is used as initial guess for the pressure solve.
+            Only solvers that support initial guesses make use of it. `Fluid.solve_info['warm_start']` tells whether a guess was passed.
+        :param telemetry: None, 'summary' or 'full'. If not None, a SolveTelemetry of that level is stored in `Fluid.solve_info['telemetry']` after each step.
+        """
         Physics.__init__(self, [StateDependency('obstacles', 'obstacle', blocking=True),
                                 StateDependency('gravity', 'gravity', single_state=True),
                                 StateDependency('density_effects', 'density_effect', blocking=True),
@@ -88,17 +93,21 @@ Supports obstacles, density effects, velocity effects, global gravity.
         self.make_input_divfree = make_input_divfree
         self.make_output_divfree = make_output_divfree
         self.conserve_density = conserve_density
+        self.warm_start = warm_start
+        self.telemetry = telemetry
 
     def step(self, fluid, dt=1.0, obstacles=(), gravity=Gravity(), density_effects=(), velocity_effects=()):
         # pylint: disable-msg = arguments-differ
         gravity = gravity_tensor(gravity, fluid.rank)
         velocity = fluid.velocity
         density = fluid.density
+        guess = _warm_start_guess(fluid.solve_info, velocity) if self.warm_start else None
         if self.make_input_divfree:
-            velocity, solve_info = divergence_free(velocity, fluid.domain, obstacles, pressure_solver=self.pressure_solver, return_info=True)
+            velocity, solve_info = divergence_free(velocity, fluid.domain, obstacles, pressure_solver=self.pressure_solver, return_info=True, guess=guess, telemetry=self.telemetry)
+            solve_info['warm_start'] = guess is not None
         # --- Advection ---
-        density = advect.semi_lagrangian(density, velocity, dt=dt)
-        velocity = advected_velocity = advect.semi_lagrangian(velocity, velocity, dt=dt)
+        density, velocity = advect.semi_lagrangian_all([density, velocity], velocity, dt=dt)
+        advected_velocity = velocity
         if self.conserve_density and np.all(Material.solid(fluid.domain.boundaries)):
             density = density.normalized(fluid.density)
         # --- Effects ---
@@ -110,7 +119,8 @@ Supports obstacles, density effects, velocity effects, global gravity.
         divergent_velocity = velocity
         # --- Pressure solve ---
         if self.make_output_divfree:
-            velocity, solve_info = divergence_free(velocity, fluid.domain, obstacles, pressure_solver=self.pressure_solver, return_info=True)
+            velocity, solve_info = divergence_free(velocity, fluid.domain, obstacles, pressure_solver=self.pressure_solver, return_info=True, guess=guess, telemetry=self.telemetry)
+            solve_info['warm_start'] = guess is not None
         solve_info['advected_velocity'] = advected_velocity
         solve_info['divergent_velocity'] = divergent_velocity
         return fluid.copied_with(density=density, velocity=velocity, age=fluid.age + dt, solve_info=solve_info)
@@ -118,22 +128,45 @@ Supports obstacles, density effects, velocity effects, global gravity.
 
 class IncompressibleVFlow(Physics):
 
-    def __init__(self, boundaries, pressure_solver=None):
+    def __init__(self, boundaries, pressure_solver=None, telemetry=None):
+        """
+        Unlike `IncompressibleFlow`, this physics cannot warm-start the pressure solve since its velocity state has no place for the pressure and the physics object may be shared between simulations.
+
+        :param telemetry: None, 'summary' or 'full'. If not None, a SolveTelemetry of that level is stored in `self.solve_info['telemetry']` after each step.
+            `self.solve_info` only holds the iteration count and telemetry of the last solve, not its fields.
+        """
         Physics.__init__(self, dependencies=[
             StateDependency('obstacles', 'obstacle'),
             StateDependency('velocity_effects', 'velocity_effect', blocking=True),
         ])
         self.boundaries = boundaries
         self.pressure_solver = pressure_solver
+        self.telemetry = telemetry
+        self.solve_info = {}
 
     def step(self, velocity, dt=1.0, obstacles=(), velocity_effects=()):
         velocity = advect.semi_lagrangian(velocity, velocity, dt=dt)
         for effect in velocity_effects:  # this is where buoyancy is applied
             velocity = effect_applied(effect, velocity, dt)
-        velocity, _solve_info = divergence_free(velocity, Domain(velocity.resolution, self.boundaries, velocity.box), obstacles, pressure_solver=self.pressure_solver, return_info=True)
+        velocity, solve_info = divergence_free(velocity, Domain(velocity.resolution, self.boundaries, velocity.box), obstacles, pressure_solver=self.pressure_solver, return_info=True, telemetry=self.telemetry)
+        self.solve_info = {key: value for key, value in solve_info.items() if key in ('iterations', 'telemetry')}
         return velocity.copied_with(age=velocity.age + dt)
 
 
+def _warm_start_guess(previous_solve_info, velocity):
+    """
+    Returns the pressure of the previous solve if it matches the resolution and batch size of `velocity`, else None.
+    """
+    pressure = previous_solve_info.get('pressure', None)
+    if not isinstance(pressure, CenteredGrid) or pressure.rank != velocity.rank or not np.all(pressure.resolution == velocity.resolution):
+        return None
+    if math.staticshape(pressure.data)[0] != math.staticshape(velocity.data[0].data)[0]:
+        return None
+    if math.choose_backend(pressure.data) is not math.choose_backend(velocity.data[0].data):
+        return None
+    return pressure
+
+
 INCOMPRESSIBLE_FLOW = IncompressibleFlow()
 
 
@@ -214,7 +247,7 @@ Computes the pressure from the given velocity divergence using the specified sol
     return poisson_solve(divergence, fluiddomain, solver=pressure_solver, guess=guess)
 
 
-def divergence_free(velocity, domain=None, obstacles=(), pressure_solver=None, return_info=False, gradient='implicit'):
+def divergence_free(velocity, domain=None, obstacles=(), pressure_solver=None, return_info=False, gradient='implicit', guess=None, telemetry=None):
     """
 Projects the given velocity field by solving for and subtracting the pressure.
     :param return_info: if True, returns a dict holding information about the solve as a second object
@@ -222,9 +255,13 @@ Projects the given velocity field by solving for and subtracting the pressure.
     :param domain: Domain matching the velocity field, used for boundary conditions
     :param obstacles: list of Obstacles
     :param pressure_solver: PressureSolver. Uses default solver if none provided.
+    :param guess: (optional) pressure CenteredGrid of a previous projection, e.g. solve_info['pressure'], used as initial guess by solvers that support it
+    :param telemetry: (optional) SolveTelemetry or its level ('summary' or 'full'). The filled SolveTelemetry is stored in the info dict under 'telemetry'.
     :return: divergence-free velocity as StaggeredGrid
     """
     assert isinstance(velocity, StaggeredGrid)
+    if isinstance(telemetry, six.string_types):
+        telemetry = SolveTelemetry(telemetry)
     # --- Set up FluidDomain ---
     if domain is None:
         domain = Domain(velocity.resolution, OPEN)
@@ -244,8 +281,15 @@ Projects the given velocity field by solving for and subtracting the pressure.
             angular_velocity = AngularVelocity(location=obstacle.geometry.center, strength=obstacle.angular_velocity, falloff=None)
             velocity = ((1 - obs_mask) * velocity + obs_mask * (angular_velocity + obstacle.velocity)).at(velocity)
     divergence_field = velocity.divergence(physical_units=False)
-    pressure, iterations = poisson_solve(divergence_field, fluiddomain, solver=pressure_solver, gradient=gradient)
+    if guess is not None:
+        guess = guess.copied_with(data=guess.data / velocity.dx[0])  # solve_info['pressure'] is scaled by the cell size
+    pressure, iterations = poisson_solve(divergence_field, fluiddomain, solver=pressure_solver, guess=guess, gradient=gradient, telemetry=telemetry)
     pressure *= velocity.dx[0]
     gradp = StaggeredGrid.gradient(pressure)
     velocity -= fluiddomain.with_hard_boundary_conditions(gradp)
-    return velocity if not return_info else (velocity, {'pressure': pressure, 'iterations': iterations, 'divergence': divergence_field})
+    if not return_info:
+        return velocity
+    solve_info = {'pressure': pressure, 'iterations': iterations, 'divergence': divergence_field}
+    if telemetry is not None:
+        solve_info['telemetry'] = telemetry
+    return velocity, solve_info
@@ -0,0 +1,186 @@
+import json
+import os
+import time
+import warnings
+
+import numpy as np
+
+from phi import math
+from .solver_api import PoissonDomain, PoissonSolver, SolveTelemetry, claim_telemetry, telemetry_scope, _default_solver
+
+
+DEFAULT_CACHE_FILE = '~/phi/solver_autotune.json'
+
+
+class AutotunedSolver(PoissonSolver):
+
+    def __init__(self, candidates=None, trials=2, cache_file=DEFAULT_CACHE_FILE, accuracy=1e-5):
+        """
+        Selects the fastest solver for each kind of problem by timing candidate solvers on actual solves.
+
+        Problems are distinguished by resolution, batch size, boundaries, backend, precision and obstacle fraction, see `autotune_key()`.
+        The first solves of a new problem kind are distributed among the candidates until each candidate has been timed `trials` times.
+        Candidates that do not converge or end with a residual above `accuracy` are disqualified for that problem kind, regardless of their time.
+        The remaining candidate with the lowest time then handles all further solves of that kind.
+        If no candidate qualifies, a RuntimeWarning is issued and the timing starts over.
+        Winners are stored in `cache_file` so that subsequent runs skip the tuning phase.
+
+        Only eagerly evaluated tensors (NumPy, PyTorch) can be timed. On GPUs, pending operations are synchronized before the clock is read.
+        For symbolic tensors, the default solver selection is used unless a winner is already known.
+
+        Use `enable_autotuning()` to let `poisson_solve` use an AutotunedSolver whenever no solver is specified.
+
+        :param candidates: dict mapping unique names to PoissonSolvers or None to use `default_candidates()` for each problem
+        :param trials: number of timed solves per candidate. The best time of each candidate is compared.
+        :param cache_file: path of the JSON file holding the winners or None to keep them in memory only
+        :param accuracy: maximum residual a candidate must reach to qualify. Direct solvers that report no residual always qualify.
+        """
+        PoissonSolver.__init__(self, 'Autotuned', supported_devices=('CPU', 'GPU', 'TPU'), supports_guess=True, supports_loop_counter=True, supports_continuous_masks=True)
+        assert trials > 0, trials
+        self.candidates = candidates
+        self.trials = trials
+        self.cache_file = cache_file
+        self.accuracy = accuracy
+        self.timings = {}
+        self.winners = load_winners(cache_file) if cache_file is not None else {}
+
+    def solve(self, field, domain, guess, enable_backprop):
+        assert isinstance(domain, PoissonDomain)
+        key = autotune_key(field, domain)
+        candidates = self.candidates if self.candidates is not None else default_candidates(field, domain)
+        if self.winners.get(key, None) in candidates:
+            return _solve(candidates[self.winners[key]], field, domain, guess, enable_backprop)
+        backend = math.choose_backend(field)
+        if not (backend.matches_name('SciPy') or backend.matches_name('PyTorch')):
+            return _solve(_default_solver(math.staticshape(field)[1:-1], backend, domain), field, domain, guess, enable_backprop)
+        timings = self.timings.setdefault(key, {name: [] for name in candidates})
+        name = min(candidates, key=lambda candidate: len(timings[candidate]))
+        outer_telemetry = claim_telemetry()
+        telemetry = SolveTelemetry(outer_telemetry.level if outer_telemetry is not None else 'summary')
+        with telemetry_scope(telemetry):
+            _synchronize(field)
+            start = time.time()
+            result = _solve(candidates[name], field, domain, guess, enable_backprop)
+            _synchronize(result[0])
+            duration = time.time() - start
+        if outer_telemetry is not None:
+            vars(outer_telemetry).update(vars(telemetry))
+        accurate = telemetry.converged is not False and (telemetry.final_residual is None or telemetry.final_residual <= self.accuracy)
+        timings[name].append(duration if accurate else float('inf'))
+        if all(len(times) >= self.trials for times in timings.values()):
+            winner = min(timings, key=lambda candidate: min(timings[candidate]))
+            if min(timings[winner]) == float('inf'):
+                warnings.warn('No autotuning candidate reached the accuracy %s for %s, timing them again.' % (self.accuracy, key), RuntimeWarning)
+                self.timings[key] = {candidate: [] for candidate in candidates}
+                return result
+            self.winners[key] = winner
+            if self.cache_file is not None:
+                store_winner(self.cache_file, key, self.winners[key])
+        return result
+
+
+def _solve(solver, field, domain, guess, enable_backprop):
+    return solver.solve(field, domain, guess if solver.supports_guess else None, enable_backprop)
+
+
+def _synchronize(tensor):
+    """ Waits for pending CUDA operations on `tensor` so that they are included in the measured time. """
+    if math.choose_backend(tensor).matches_name('PyTorch') and tensor.is_cuda:
+        import torch
+        torch.cuda.synchronize(tensor.device)
+
+
+def autotune_key(field, domain):
+    """
+    Summarizes the properties of a pressure solve that affect which solver is fastest.
+    The obstacle fraction is rounded to multiples of 0.05 and unknown ('?') for symbolic masks.
+
+    :param field: right-hand side tensor of shape (batch, spatial dimensions..., 1)
+    :param domain: PoissonDomain
+    :return: str
+    """
+    shape = math.staticshape(field)
+    backend = math.choose_backend(field)
+    active = domain.active.data
+    obstacle_fraction = '%.2f' % (np.round((1 - np.mean(active)) * 20) / 20) if isinstance(active, np.ndarray) else '?'
+    return '%s|batch=%s|%s|%s-%s|obstacles=%s' % ('x'.join(str(dim) for dim in shape[1:-1]), shape[0], domain.domain.boundaries, backend.name, backend.precision, obstacle_fraction)
+
+
+def default_candidates(field, domain):
+    """
+    Lists the solvers applicable to the given problem.
+
+    :return: dict mapping names to PoissonSolvers
+    """
+    from .dct import DCTSolver, dct_transforms, has_obstacles
+    from .geom import GeometricCG
+    from .sparse import SparseCG, SparseSciPy
+    if not math.choose_backend(field).matches_name('SciPy'):
+        return {'SparseCG': SparseCG(), 'GeometricCG': GeometricCG()}
+    candidates = {
+        'SparseSciPy': SparseSciPy(),
+        'SparseSciPy(factorize)': SparseSciPy(factorize=True),
+        'SparseCG': SparseCG(),
+        'SparseCG(ic)': SparseCG(preconditioner='ic'),
+    }
+    if dct_transforms(domain.domain.boundaries, domain.rank) is not None:
+        if has_obstacles(domain):
+            candidates['SparseCG(dct)'] = SparseCG(preconditioner='dct')
+        else:
+            candidates['DCT'] = DCTSolver()
+    return candidates
+
+
+def load_winners(cache_file):
+    """
+    Reads the winners stored by `store_winner()`.
+
+    :return: dict mapping keys created by `autotune_key()` to candidate names
+    """
+    path = os.path.expanduser(cache_file)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def store_winner(cache_file, key, name):
+    """
+    Adds a winner to the cache file, keeping the entries written by other processes.
+    The file is replaced atomically.
+    """
+    path = os.path.expanduser(cache_file)
+    winners = load_winners(path)
+    winners[key] = name
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(winners, file, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+_AUTOTUNER = None
+
+
+def enable_autotuning(cache_file=DEFAULT_CACHE_FILE, trials=2, candidates=None, accuracy=1e-5):
+    """
+    Makes `poisson_solve` use an AutotunedSolver whenever no solver is specified.
+
+    :return: the AutotunedSolver
+    """
+    global _AUTOTUNER
+    _AUTOTUNER = AutotunedSolver(candidates=candidates, trials=trials, cache_file=cache_file, accuracy=accuracy)
+    return _AUTOTUNER
+
+
+def disable_autotuning():
+    """ Restores the default solver selection of `poisson_solve`. """
+    global _AUTOTUNER
+    _AUTOTUNER = None
+
+
+def active_autotuner():
+    """
+    :return: the AutotunedSolver installed by `enable_autotuning()` or None
+    """
+    return _AUTOTUNER
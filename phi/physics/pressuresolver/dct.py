@@ -0,0 +1,142 @@
+import numpy as np
+import scipy.fft
+
+from phi import math
+from phi.physics.material import Material
+from phi.struct.tensorop import collapsed_gather_nd
+from .solver_api import PoissonDomain, PoissonSolver, claim_telemetry
+
+
+class DCTSolver(PoissonSolver):
+
+    def __init__(self):
+        """
+        Direct solver for rectangular domains without obstacles based on discrete cosine, sine and Fourier transforms.
+
+        Along each axis, the pressure is expanded in the eigenvectors of the one-dimensional pressure stencil.
+        For solid boundaries (Neumann), these are the basis functions of the DCT-II, for open boundaries (Dirichlet) those of the DST-I and for periodic boundaries those of the FFT.
+        The solve then reduces to a division by the eigenvalues in transformed space and costs O(N log N).
+
+        Both faces of each axis must be of the same kind, see `dct_transforms()`.
+        Obstacles, i.e. active and accessible masks, are ignored.
+        For domains with obstacles, use DCTSolver as preconditioner instead, e.g. `SparseCG(preconditioner='dct')`.
+
+        The transforms are computed with scipy.fft on the CPU.
+        TensorFlow tensors are passed through a py_func.
+        """
+        PoissonSolver.__init__(self, 'DCT', supported_devices=('CPU',), supports_guess=False, supports_loop_counter=False, supports_continuous_masks=False)
+
+    def solve(self, field, domain, guess, enable_backprop):
+        assert isinstance(domain, PoissonDomain)
+        telemetry = claim_telemetry()
+        if telemetry is not None:
+            telemetry.converged = True  # direct solve
+        return dct_poisson(field, domain), None
+
+
+def dct_transforms(boundaries, rank):
+    """
+    Determines the transform used for each axis of a domain.
+
+    :param boundaries: Material or struct of Materials as stored in Domain.boundaries
+    :param rank: spatial rank of the domain
+    :return: list containing 'neumann' (solid), 'dirichlet' (open) or 'periodic' for each axis or None if the faces of an axis differ in kind
+    """
+    kinds = []
+    for axis in range(rank):
+        axis_kinds = set()
+        for upper in (0, 1):
+            if collapsed_gather_nd(Material.periodic(boundaries), [axis, upper]):
+                axis_kinds.add('periodic')
+            elif collapsed_gather_nd(Material.solid(boundaries), [axis, upper]):
+                axis_kinds.add('neumann')
+            else:
+                axis_kinds.add('dirichlet')
+        if len(axis_kinds) != 1:
+            return None
+        kinds.append(axis_kinds.pop())
+    return kinds
+
+
+def has_obstacles(domain):
+    """
+    Checks whether any cell of the PoissonDomain is inactive or inaccessible.
+    Masks that are not NumPy arrays cannot be checked and are assumed to contain obstacles.
+
+    :param domain: PoissonDomain
+    :return: bool
+    """
+    for mask in (domain.active.data, domain.accessible.data):
+        if not isinstance(mask, np.ndarray) or not np.all(mask == 1):
+            return True
+    return False
+
+
+def dct_poisson(tensor, domain):
+    """
+    Solves the Poisson equation on the obstacle-free domain in transformed space.
+    The operation is self-adjoint, so its gradient is computed by the same solve.
+
+    :param tensor: right-hand side of shape (batch, spatial dimensions..., 1)
+    :param domain: PoissonDomain or Domain defining the boundary conditions
+    :return: solution tensor like `tensor`. For domains without open boundaries, the solution has zero mean.
+    """
+    domain = domain.domain if isinstance(domain, PoissonDomain) else domain
+    kinds = dct_transforms(domain.boundaries, domain.rank)
+    assert kinds is not None, 'DCT solve requires both faces of each axis to be either solid, open or periodic but got %s' % (domain.boundaries,)
+    shape = math.staticshape(tensor)
+    dtype = math.dtype(tensor)
+    dtype = getattr(dtype, 'as_numpy_dtype', dtype)  # TensorFlow DType
+    inverse_eigenvalues = _inverse_eigenvalues(kinds, shape[1:-1])
+
+    def np_solve(rhs):
+        return _np_dct_poisson(rhs, kinds, inverse_eigenvalues).astype(dtype)
+
+    def np_solve_gradient(_op, grad_in):
+        return math.py_func(np_solve, [grad_in], dtype, shape)
+
+    if isinstance(tensor, np.ndarray):
+        return np_solve(tensor)
+    return math.py_func(np_solve, [tensor], dtype, shape, grad=np_solve_gradient)
+
+
+def _inverse_eigenvalues(kinds, resolution):
+    """
+    Computes the inverse eigenvalues of the pressure stencil in transformed space, broadcastable against tensors of shape (batch, resolution..., 1).
+    The zero eigenvalue of singular systems is mapped to 0, removing the mean of the solution.
+    """
+    eigenvalues = 0
+    for axis, (kind, n) in enumerate(zip(kinds, resolution)):
+        k = np.arange(n)
+        if kind == 'neumann':
+            axis_eigenvalues = 2 * np.cos(np.pi * k / n) - 2
+        elif kind == 'dirichlet':
+            axis_eigenvalues = 2 * np.cos(np.pi * (k + 1) / (n + 1)) - 2
+        else:
+            axis_eigenvalues = 2 * np.cos(2 * np.pi * k / n) - 2
+        eigenvalues = eigenvalues + np.reshape(axis_eigenvalues, [1] + [n if i == axis else 1 for i in range(len(resolution))] + [1])
+    with np.errstate(divide='ignore'):
+        return np.where(eigenvalues == 0, 0, 1. / eigenvalues)
+
+
+def _np_dct_poisson(rhs, kinds, inverse_eigenvalues):
+    # --- Forward transforms: real transforms first, FFT over periodic axes last ---
+    transformed = np.asarray(rhs, np.float64)
+    for axis, kind in enumerate(kinds):
+        if kind == 'neumann':
+            transformed = scipy.fft.dct(transformed, type=2, axis=axis + 1, norm='ortho')
+        elif kind == 'dirichlet':
+            transformed = scipy.fft.dst(transformed, type=1, axis=axis + 1, norm='ortho')
+    periodic_axes = tuple(axis + 1 for axis, kind in enumerate(kinds) if kind == 'periodic')
+    if periodic_axes:
+        transformed = scipy.fft.fftn(transformed, axes=periodic_axes)
+    # --- Divide by eigenvalues and transform back ---
+    solution = transformed * inverse_eigenvalues
+    if periodic_axes:
+        solution = np.real(scipy.fft.ifftn(solution, axes=periodic_axes))
+    for axis, kind in enumerate(kinds):
+        if kind == 'neumann':
+            solution = scipy.fft.idct(solution, type=2, axis=axis + 1, norm='ortho')
+        elif kind == 'dirichlet':
+            solution = scipy.fft.idst(solution, type=1, axis=axis + 1, norm='ortho')
+    return solution
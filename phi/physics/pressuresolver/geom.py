@@ -1,42 +1,195 @@
+import time
 from numbers import Number
 
+import numpy as np
+
 from phi import math
-from phi.math.blas import conjugate_gradient
+from phi.backend.scipy_backend import active_buffer_pool
 from phi.math.helper import _dim_shifted
 from phi.physics.field import CenteredGrid
-from .solver_api import PoissonDomain, PoissonSolver
+from .solver_api import PoissonDomain, PoissonSolver, claim_telemetry, conjugate_gradient_solve
 from phi.physics.material import Material
+from phi.struct.tensorop import collapsed_gather_nd
 
 
 class GeometricCG(PoissonSolver):
 
-    def __init__(self, accuracy=1e-5, max_iterations=2000):
+    def __init__(self, accuracy=1e-5, max_iterations=2000, preconditioner=None, method='standard', check_interval=4):
         """
 Conjugate gradient solver that geometrically calculates laplace pressure in each iteration.
 Unlike most other solvers, this algorithm is TPU compatible but usually performs worse than SparseCG.
 
-Obstacles are allowed to vary between examples but the same number of iterations is performed for each example in one batch.
+Obstacles are allowed to vary between examples. Examples stop iterating individually once they have converged.
 
         :param accuracy: the maximally allowed error on the divergence channel for each cell
         :param max_iterations: integer specifying maximum conjugent gradient loop iterations or None for no limit
-        :param autodiff:
+        :param preconditioner: None for plain CG, 'jacobi' to divide residuals by the stencil diagonal, 'dct' to solve for the residual ignoring obstacles (see DCTSolver), 'multigrid' to apply a V-cycle or a GeometricMultigrid instance defining the cycle
+        :param method: 'standard' or 'fused'. The fused variant computes the dot products of each iteration in one reduction and checks convergence every `check_interval` iterations, see `phi.math.optim.fused_conjugate_gradient()`.
+            It requires a linear preconditioner.
+        :param check_interval: number of iterations between convergence checks of the fused method
         """
         PoissonSolver.__init__(self, 'Single-Phase Conjugate Gradient', supported_devices=('CPU', 'GPU', 'TPU'), supports_guess=True, supports_loop_counter=True, supports_continuous_masks=True)
         assert math.is_scalar(accuracy), 'invalid accuracy: %s' % accuracy
         self.accuracy = accuracy
         self.max_iterations = max_iterations
+        self.preconditioner = preconditioner
+        assert method in ('standard', 'fused'), method
+        self.method = method
+        self.check_interval = check_interval
 
     def solve(self, divergence, domain, guess, enable_backprop):
         assert isinstance(domain, PoissonDomain)
+        telemetry = claim_telemetry()
+        start = time.time()
         fluid_mask = domain.accessible_tensor(extend=1)
-        extrapolation = Material.extrapolation_mode(domain.domain.boundaries)
+        apply_A = MaskedLaplaceOperator(fluid_mask, Material.extrapolation_mode(domain.domain.boundaries))
+        preconditioner = _geometric_preconditioner(self.preconditioner, domain, apply_A)
+        compact = math.staticshape(fluid_mask)[0] == 1  # converged examples can be dropped from the batch
+        if telemetry is not None:
+            telemetry.assembly_time = time.time() - start
+        return conjugate_gradient_solve(divergence, apply_A, guess, self.accuracy, self.max_iterations, enable_backprop, preconditioner, compact, telemetry, self.method, self.check_interval)
+
+
+def _geometric_preconditioner(preconditioner, domain, operator):
+    """
+    Creates the preconditioner function for GeometricCG.
+
+    :param preconditioner: None, 'jacobi', 'dct', 'multigrid' or GeometricMultigrid
+    :param operator: MaskedLaplaceOperator of the domain
+    :return: function mapping residuals to approximate solutions or None
+    """
+    if preconditioner is None:
+        return None
+    if preconditioner == 'jacobi':
+        return lambda residual: math.divide_no_nan(residual, operator.diagonal)
+    if preconditioner == 'dct':
+        from .dct import dct_poisson
+        return lambda residual: dct_poisson(residual, domain)
+    from .multigrid import GeometricMultigrid, multigrid_preconditioner
+    if preconditioner == 'multigrid':
+        return multigrid_preconditioner(domain)
+    if isinstance(preconditioner, GeometricMultigrid):
+        return multigrid_preconditioner(domain, preconditioner)
+    raise ValueError('Unsupported preconditioner for GeometricCG: %s' % (preconditioner,))
+
+
+class StencilOperator(object):
+
+    def __init__(self, diagonal, faces, periodic):
+        """
+        Linear operator coupling every cell with its direct neighbours along each axis, e.g. the pressure matrix of a grid.
+
+        On NumPy, the operator adds the shifted neighbour values into the result without padding.
+        Other backends pad with zeros, or circularly along periodic axes.
+
+        :param diagonal: weight of each cell's own value, tensor of shape (batch, spatial dimensions..., 1)
+        :param faces: for each axis, the weights of the lower and upper neighbours of every cell, shaped like diagonal. Weights of faces on the domain boundary must be zero unless the axis is periodic.
+        :param periodic: for each axis, whether the first and last cells are neighbours
+        """
+        self.diagonal = diagonal
+        self.faces = faces
+        self.periodic = periodic
+        self.rank = len(faces)
+        self._np_faces = None
+        if isinstance(diagonal, np.ndarray) and all(isinstance(face, np.ndarray) for dim_faces in faces for face in dim_faces):
+            self._np_faces = [(np.ascontiguousarray(lower[_axis_slice(dimension, 1, None)]), np.ascontiguousarray(upper[_axis_slice(dimension, None, -1)]), lower[_axis_slice(dimension, 0, 1)], upper[_axis_slice(dimension, -1, None)]) for dimension, (lower, upper) in enumerate(faces)]
+
+    supports_out = True  # see phi.math.optim.apply_into()
+
+    def __call__(self, pressure, out=None):
+        """
+        Applies the operator to `pressure`.
+
+        :param pressure: tensor of shape (batch, spatial dimensions..., 1)
+        :param out: (optional) NumPy array to write the result into
+        :return: tensor shaped like pressure
+        """
+        if self._np_faces is not None and isinstance(pressure, np.ndarray):
+            return self._apply_numpy(pressure, out)
+        pad_modes = ['constant'] + ['circular' if periodic else 'constant' for periodic in self.periodic] + ['constant']
+        padded = math.pad(pressure, [[0, 0]] + [[1, 1]] * self.rank + [[0, 0]], pad_modes)
+        result = math.mul(pressure, self.diagonal)
+        for dimension, (lower, upper) in enumerate(self.faces):
+            lower_values, upper_values = _dim_shifted(padded, dimension, (-1, 1), diminish_others=(1, 1))
+            result += math.mul(lower_values, lower) + math.mul(upper_values, upper)
+        if out is not None:
+            out[...] = result
+            return out
+        return result
+
+    def _apply_numpy(self, pressure, out=None):
+        result = np.multiply(self.diagonal, pressure, out=out)
+        pool = active_buffer_pool()
+        if pool is None:
+            def accumulate(target, weights, values):
+                target += weights * values
+        else:  # in-place execution mode, products are computed in a pooled buffer
+            products = pool.get((StencilOperator, 'products'), result.shape, result.dtype)
+
+            def accumulate(target, weights, values):
+                product = products[tuple(slice(0, n) for n in target.shape)]
+                target += np.multiply(weights, values, out=product)
+        for dimension, (lower, upper, lower_first, upper_last) in enumerate(self._np_faces):
+            accumulate(result[_axis_slice(dimension, 1, None)], lower, pressure[_axis_slice(dimension, None, -1)])
+            accumulate(result[_axis_slice(dimension, None, -1)], upper, pressure[_axis_slice(dimension, 1, None)])
+            if self.periodic[dimension]:
+                accumulate(result[_axis_slice(dimension, 0, 1)], lower_first, pressure[_axis_slice(dimension, -1, None)])
+                accumulate(result[_axis_slice(dimension, -1, None)], upper_last, pressure[_axis_slice(dimension, 0, 1)])
+        return result
+
+
+class MaskedLaplaceOperator(StencilOperator):
+
+    def __init__(self, fluid_mask, extrapolation):
+        """
+        Pressure matrix of `_masked_laplace` with the stencil weights precomputed for repeated application.
+
+        For each axis, the weights of the lower and upper faces of every cell and the diagonal are computed once.
+        Boundary conditions are folded into the weights: the ghost pressure of 'boundary' faces equals the cell pressure and is added to the diagonal, 'constant' faces contribute nothing.
+        Only periodic axes need values from the opposite side of the grid, see StencilOperator.
+
+        :param fluid_mask: accessible mask extended by one cell in every direction, see `PoissonDomain.accessible_tensor(extend=1)`
+        :param extrapolation: pressure extrapolation, a string or struct of strings as returned by `Material.extrapolation_mode()`
+        """
+        rank = math.spatial_rank(fluid_mask)
+        resolution = [n - 2 for n in math.staticshape(fluid_mask)[1:-1]]
+        dtype = math.dtype(fluid_mask)
+        dtype = getattr(dtype, 'as_numpy_dtype', dtype)  # TensorFlow DType
+        periodic = []
+        all_faces = []
+        diagonal = 0
+        for dimension in range(rank):
+            lower_weights, center_weights, upper_weights = _dim_shifted(fluid_mask, dimension, (-1, 0, 1), diminish_others=(1, 1))
+            diagonal -= lower_weights + upper_weights
+            faces = []
+            for upper, neighbour_weights in enumerate((lower_weights, upper_weights)):
+                mode = collapsed_gather_nd(extrapolation, [dimension, upper])
+                face = neighbour_weights * center_weights
+                if mode != 'periodic':
+                    boundary = np.zeros([resolution[dimension] if axis == dimension else 1 for axis in range(rank)], dtype)
+                    boundary[(slice(None),) * dimension + (-upper,)] = 1
+                    boundary = np.reshape(boundary, [1] + list(boundary.shape) + [1])
+                    if mode == 'boundary':
+                        diagonal += face * boundary
+                    face = face * (1 - boundary)
+                faces.append(face)
+            periodic.append(collapsed_gather_nd(extrapolation, [dimension, 0]) == 'periodic' and collapsed_gather_nd(extrapolation, [dimension, 1]) == 'periodic')
+            all_faces.append(faces)
+        StencilOperator.__init__(self, diagonal, all_faces, periodic)
+
+
+def _axis_slice(dimension, start, stop):
+    """ Index selecting `start:stop` along the spatial `dimension` of a tensor of shape (batch, spatial dimensions..., channels). """
+    return (slice(None),) * (dimension + 1) + (slice(start, stop),)
 
-        def apply_A(pressure):
-            pressure = CenteredGrid(pressure, extrapolation=extrapolation)
-            pressure_padded = pressure.padded([[1, 1]] * pressure.rank)
-            return _weighted_sliced_laplace_nd(pressure_padded.data, weights=fluid_mask)
 
-        return conjugate_gradient(divergence, apply_A, guess, self.accuracy, self.max_iterations, back_prop=enable_backprop)
+def _masked_laplace(pressure, fluid_mask, extrapolation):
+    """
+    Applies the pressure matrix geometrically, padding `pressure` according to `extrapolation` and weighting the stencil with the extended `fluid_mask`.
+    """
+    pressure = CenteredGrid(pressure, extrapolation=extrapolation)
+    pressure_padded = pressure.padded([[1, 1]] * pressure.rank)
+    return _weighted_sliced_laplace_nd(pressure_padded.data, weights=fluid_mask)
 
 
 def _weighted_sliced_laplace_nd(tensor, weights):
@@ -0,0 +1,243 @@
+import time
+
+import numpy as np
+
+from phi import math, struct
+from phi.math.optim import conjugate_gradient
+from phi.physics.material import Material
+from .geom import MaskedLaplaceOperator, StencilOperator
+from .sor import red_black_smooth
+from .solver_api import PoissonDomain, PoissonSolver, claim_telemetry, warn_if_not_converged, _eager
+
+
+class GeometricMultigrid(PoissonSolver):
+
+    def __init__(self, accuracy=1e-5, max_cycles=100, cycle='V', smoother='jacobi', pre_smoothing=2, post_smoothing=2, relaxation=None, over_correction=1.5, coarse_resolution=4, max_levels=None):
+        """
+Geometric multigrid solver that reduces the residual with V-cycles or W-cycles over a hierarchy of grids, each half the resolution of the previous one.
+
+Each coarse cell aggregates 2^d fine cells. Grids with an odd number of cells along an axis end with a smaller aggregate.
+Residuals are restricted by summing over each aggregate and corrections are prolongated by copying the coarse value to all cells of its aggregate.
+The coarse pressure matrices are derived from the fine one (Galerkin coarsening), so obstacles, open faces and periodic axes are represented consistently on all levels.
+Since piecewise constant prolongation underestimates smooth errors, coarse corrections are scaled up by `over_correction`.
+
+The number of cycles required to reach a given accuracy is largely independent of the resolution, making the cost of a solve O(N).
+Solves that do not reach `accuracy` within `max_cycles`, or whose residual grows tenfold, are reported as not converged and issue a RuntimeWarning.
+
+        :param accuracy: the maximally allowed error on the divergence channel for each cell
+        :param max_cycles: maximum number of multigrid cycles to perform
+        :param cycle: 'V' or 'W'. A W-cycle visits each coarse level twice per visit of the next finer level.
+        :param smoother: 'jacobi' for weighted Jacobi relaxation or a function (operator, x, rhs, sweeps, relaxation) -> x where operator is a MultigridLevel
+        :param pre_smoothing: number of smoothing sweeps before the coarse-grid correction
+        :param post_smoothing: number of smoothing sweeps after the coarse-grid correction
+        :param relaxation: relaxation factor passed to the smoother, None to let the smoother choose.
+        :param over_correction: factor by which coarse-grid corrections are scaled. Larger values speed up closed domains but make cycles diverge with open boundaries.
+        :param coarse_resolution: stop coarsening once any dimension is at most this many cells. The coarsest grid is solved with conjugate gradient.
+        :param max_levels: maximum number of grids including the finest one or None for no limit
+        """
+        PoissonSolver.__init__(self, 'Geometric Multigrid', supported_devices=('CPU', 'GPU', 'TPU'), supports_guess=True, supports_loop_counter=True, supports_continuous_masks=True)
+        assert math.is_scalar(accuracy), 'invalid accuracy: %s' % accuracy
+        assert cycle in ('V', 'W'), cycle
+        if isinstance(smoother, str):
+            smoother = {'jacobi': jacobi_smooth, 'sor': red_black_smooth}[smoother]
+        self.accuracy = accuracy
+        self.max_cycles = max_cycles
+        self.cycle = cycle
+        self.smoother = smoother
+        self.pre_smoothing = pre_smoothing
+        self.post_smoothing = post_smoothing
+        self.relaxation = relaxation
+        self.over_correction = over_correction
+        self.coarse_resolution = coarse_resolution
+        self.max_levels = max_levels
+
+    def solve(self, divergence, domain, guess, enable_backprop):
+        assert isinstance(domain, PoissonDomain)
+        telemetry = claim_telemetry()
+        start = time.time()
+        levels = self.levels(domain)
+        divergence = math.to_float(divergence)
+        x0 = math.to_float(guess) if guess is not None else math.zeros_like(divergence)
+
+        def multigrid_loop(x, residual, initial_max_residual, iterations):
+            correction = self.cycle_correction(levels, 0, residual, math.zeros_like(residual))
+            x = x + correction
+            residual = residual - levels[0].apply(correction)  # updating the residual instead of recomputing it avoids cancellation in float32
+            if telemetry is not None and telemetry.level == 'full':
+                telemetry.record_residual(residual)
+            return [x, residual, initial_max_residual, iterations + 1]
+
+        def not_converged(_x, residual, initial_max_residual, _iterations):
+            max_residual = math.max(math.abs(residual))
+            return (max_residual > self.accuracy) & (max_residual < 10 * initial_max_residual)  # stop diverging cycles, the result is reported below
+
+        residual0 = divergence - levels[0].apply(x0)
+        if telemetry is not None:
+            telemetry.assembly_time = time.time() - start
+        x, residual, _initial_max_residual, iterations = math.while_loop(not_converged, multigrid_loop, [x0, residual0, math.max(math.abs(residual0)), 0], back_prop=enable_backprop, name='Multigrid', maximum_iterations=self.max_cycles)
+        final_residual = math.max(math.abs(residual))
+        if telemetry is not None:
+            telemetry.iteration_time = time.time() - start - telemetry.assembly_time
+            telemetry.iterations = _eager(iterations)
+            telemetry.final_residual = _eager(final_residual)
+            telemetry.converged = telemetry.final_residual <= self.accuracy
+            telemetry.max_iterations_reached = self.max_cycles is not None and telemetry.iterations >= self.max_cycles
+        warn_if_not_converged(self, final_residual, self.accuracy, iterations)
+        return x, iterations
+
+    def levels(self, domain):
+        """
+        Builds the grid hierarchy for the given PoissonDomain.
+
+        :return: list of MultigridLevel, finest level first
+        """
+        operator = MaskedLaplaceOperator(domain.accessible_tensor(extend=1), Material.extrapolation_mode(domain.domain.boundaries))
+        levels = [MultigridLevel(operator, singular=not struct.any(Material.open(domain.domain.boundaries)))]
+        while np.min(levels[-1].resolution) > self.coarse_resolution and (self.max_levels is None or len(levels) < self.max_levels):
+            levels.append(levels[-1].coarsened())
+        return levels
+
+    def cycle_correction(self, levels, level, rhs, x):
+        """
+        Performs one V-cycle or W-cycle starting at `level`.
+
+        :return: improved approximation of the solution to levels[level](x) = rhs
+        """
+        operator = levels[level]
+        if level == len(levels) - 1:
+            return operator.solve(rhs, self.accuracy * 1e-2)
+        x = self.smoother(operator, x, rhs, self.pre_smoothing, self.relaxation)
+        coarse_rhs = restrict(rhs - operator.apply(x))
+        coarse_x = math.zeros_like(coarse_rhs)
+        for _ in range(1 if self.cycle == 'V' or level + 2 == len(levels) else 2):
+            coarse_x = self.cycle_correction(levels, level + 1, coarse_rhs, coarse_x)
+        x = x + self.over_correction * prolongate(coarse_x, operator.resolution)
+        return self.smoother(operator, x, rhs, self.post_smoothing, self.relaxation)
+
+
+class MultigridLevel(object):
+
+    def __init__(self, operator, singular):
+        """
+        Pressure operator of one multigrid level.
+
+        :param operator: StencilOperator of this level
+        :param singular: True if no boundary fixes the pressure, i.e. the pressure is only determined up to a constant
+        """
+        self.operator = operator
+        self.singular = singular
+        self.diagonal = operator.diagonal
+        self.periodic = operator.periodic
+        self.resolution = math.staticshape(operator.diagonal)[1:-1]
+
+    def apply(self, pressure):
+        return self.operator(pressure)
+
+    def coarsened(self):
+        """
+        :return: MultigridLevel of the next coarser grid, see `galerkin_coarsening()`
+        """
+        return MultigridLevel(galerkin_coarsening(self.operator), self.singular)
+
+    def solve(self, rhs, accuracy):
+        """
+        Solves the system of this level with conjugate gradient.
+        Singular systems are solved for the component of `rhs` outside the null space and the returned solution has zero mean.
+
+        :param rhs: tensor on this level
+        :param accuracy: accuracy of the conjugate gradient solve
+        :return: solution tensor
+        """
+        if self.singular:
+            rhs = rhs - self._fluid_mean(rhs)
+        x = conjugate_gradient(self.operator, rhs, math.zeros_like(rhs), accuracy, max_iterations=2 * int(np.prod(self.resolution))).x
+        return x - self._fluid_mean(x) if self.singular else x
+
+    def _fluid_mean(self, tensor):
+        fluid = math.divide_no_nan(self.diagonal, self.diagonal)
+        spatial_axes = tuple(range(1, math.ndims(tensor) - 1))
+        return fluid * math.sum(tensor * fluid, axis=spatial_axes, keepdims=True) / math.sum(fluid, axis=spatial_axes, keepdims=True)
+
+
+def galerkin_coarsening(operator):
+    """
+    Computes the operator R·A·P of the next coarser grid where P copies the value of each coarse cell to all fine cells of its aggregate and R = Pᵀ sums over the aggregate, see `restrict()` and `prolongate()`.
+    Faces between two aggregates become faces of the coarse grid while faces inside an aggregate only contribute to the diagonal.
+
+    :param operator: StencilOperator of the fine grid
+    :return: StencilOperator of the coarse grid
+    """
+    resolution = math.staticshape(operator.diagonal)[1:-1]
+    dtype = math.dtype(operator.diagonal)
+    dtype = getattr(dtype, 'as_numpy_dtype', dtype)  # TensorFlow DType
+    diagonal = operator.diagonal
+    faces = []
+    for dimension, (lower, upper) in enumerate(operator.faces):
+        index = np.reshape(np.arange(resolution[dimension]), [1] + [-1 if axis == dimension else 1 for axis in range(len(resolution))] + [1])
+        crosses_lower = (index % 2 == 0).astype(dtype)
+        crosses_upper = ((index % 2 == 1) | (index == resolution[dimension] - 1)).astype(dtype)
+        diagonal = diagonal + lower * (1 - crosses_lower) + upper * (1 - crosses_upper)
+        faces.append([restrict(lower * crosses_lower), restrict(upper * crosses_upper)])
+    return StencilOperator(restrict(diagonal), faces, operator.periodic)
+
+
+def restrict(tensor):
+    """
+    Sums `tensor` over aggregates of 2^d cells.
+    Along axes with an odd number of cells, the last aggregate only contains one cell.
+
+    :param tensor: tensor of shape (batch, spatial dimensions..., channels)
+    :return: tensor with half the resolution (rounded up)
+    """
+    rank = math.spatial_rank(tensor)
+    for dimension, size in enumerate(math.staticshape(tensor)[1:-1]):
+        if size % 2 != 0:
+            tensor = math.pad(tensor, [[0, 0]] + [[0, 1] if axis == dimension else [0, 0] for axis in range(rank)] + [[0, 0]])
+        lower = tuple(slice(0, None, 2) if axis == dimension else slice(None) for axis in range(rank))
+        upper = tuple(slice(1, None, 2) if axis == dimension else slice(None) for axis in range(rank))
+        tensor = tensor[(slice(None),) + lower + (slice(None),)] + tensor[(slice(None),) + upper + (slice(None),)]
+    return tensor
+
+
+def prolongate(tensor, fine_resolution):
+    """
+    Copies the value of each coarse cell to all cells of its aggregate on the finer grid, the transpose of `restrict()`.
+
+    :param tensor: tensor of shape (batch, spatial dimensions..., channels)
+    :param fine_resolution: resolution of the finer grid
+    :return: tensor on the finer grid
+    """
+    for dimension in range(len(fine_resolution)):
+        shape = math.staticshape(tensor)
+        doubled = math.stack([tensor, tensor], axis=dimension + 2)
+        tensor = math.reshape(doubled, [-1] + [2 * size if axis == dimension else size for axis, size in enumerate(shape[1:-1])] + [shape[-1]])
+    return tensor[(slice(None),) + tuple(slice(0, size) for size in fine_resolution) + (slice(None),)]
+
+
+def multigrid_preconditioner(domain, multigrid=None):
+    """
+    Creates a preconditioner for the conjugate gradient solvers that performs one multigrid cycle on the residual, starting from zero.
+
+    :param domain: PoissonDomain
+    :param multigrid: GeometricMultigrid defining the cycle or None for the default V-cycle
+    :return: function mapping a residual tensor of shape (batch, spatial dimensions..., 1) to the correction
+    """
+    if multigrid is None:
+        multigrid = GeometricMultigrid()
+    levels = multigrid.levels(domain)
+    return lambda residual: multigrid.cycle_correction(levels, 0, residual, math.zeros_like(residual))
+
+
+def jacobi_smooth(operator, x, rhs, sweeps, relaxation=None):
+    """
+    Weighted Jacobi relaxation.
+
+    :param operator: MultigridLevel
+    :param relaxation: weight of each update, defaults to 2d/(2d+1) which damps high frequencies optimally for the d-dimensional Laplace stencil
+    """
+    if relaxation is None:
+        rank = math.spatial_rank(x)
+        relaxation = 2. * rank / (2 * rank + 1)
+    for _ in range(sweeps):
+        x = x + relaxation * math.divide_no_nan(rhs - operator.apply(x), operator.diagonal)
+    return x
@@ -0,0 +1,261 @@
+import atexit
+import multiprocessing
+import os
+import time
+import traceback
+import weakref
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+
+from phi import math
+from phi.physics.material import Material
+from .solver_api import PoissonSolver, FluidDomain, claim_telemetry
+from .sparse import PRESSURE_MATRIX_CACHE, incomplete_cholesky, pressure_matrix_key, sparse_pressure_matrix, _cached_matrix
+
+BARRIER_TIMEOUT = 60.  # seconds a worker waits for its neighbours before giving up, bounds the hang if a worker dies
+
+
+class DomainDecompositionCG(PoissonSolver):
+
+    def __init__(self, accuracy=1e-5, max_iterations=2000, workers=None, local_solver='ic', matrix_cache=PRESSURE_MATRIX_CACHE):
+        """
+        Experimental conjugate gradient solver that splits the domain into slabs along the first spatial axis and processes each slab in its own worker process.
+
+        This solver is experimental: its parallel efficiency has not been established.
+        The block-Jacobi preconditioner weakens with the number of slabs and every iteration synchronizes all workers twice, so it may be slower than `SparseCG`.
+        Measure it on the target machine with `demos/benchmark_pressure_solve.py parallel` before relying on it.
+        It is therefore not exported by `phi.flow`, import it from `phi.physics.pressuresolver.parallel`.
+
+        The iteration is preconditioned with block Jacobi: each worker approximately inverts the block of the pressure matrix coupling the cells of its slab.
+        All vectors of the iteration live in shared memory.
+        Each worker applies the matrix rows of its slab, reading the halo layers of the neighbouring slabs directly from the shared direction vector, and updates its part of the solution, residual and direction.
+        The main process only reduces the dot products and the maximum residual of the slabs, two round trips per iteration.
+
+        Worker processes are started on the first solve and kept alive for subsequent solves with the same masks.
+        Call `close()` to stop them early.
+        NumPy arrays are solved directly, TensorFlow tensors are passed through a py_func.
+
+        :param accuracy: the maximally allowed error on the divergence channel for each cell
+        :param max_iterations: maximum number of conjugate gradient iterations
+        :param workers: number of worker processes (slabs), defaults to the number of CPU cores. Limited to the number of cells along the first axis.
+        :param local_solver: 'ic' to apply a modified incomplete Cholesky factorization of each block (see `incomplete_cholesky()`) or 'lu' to solve the blocks exactly with scipy.sparse.linalg.splu.
+            'lu' needs fewer iterations but its fill-in makes the factorization expensive for large 3D slabs.
+        :param matrix_cache: PressureMatrixCache used to reuse assembled matrices between solves or None
+        """
+        PoissonSolver.__init__(self, 'Domain-decomposed CG', supported_devices=('CPU',), supports_guess=True, supports_loop_counter=True, supports_continuous_masks=True)
+        assert local_solver in ('ic', 'lu'), local_solver
+        self.accuracy = accuracy
+        self.max_iterations = max_iterations
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.local_solver = local_solver
+        self.matrix_cache = matrix_cache
+        self._subdomains = None
+
+    def solve(self, field, domain, guess, enable_backprop):
+        assert isinstance(domain, FluidDomain)
+        telemetry = claim_telemetry()
+        start = time.time()
+        dimensions = list(math.staticshape(field)[1:-1])
+        active_mask = domain.active_tensor(extend=1)
+        fluid_mask = domain.accessible_tensor(extend=1)
+        assert math.staticshape(active_mask)[0] == 1 and math.staticshape(fluid_mask)[0] == 1, 'DomainDecompositionCG requires masks that are shared by all examples'
+        periodic = Material.periodic(domain.domain.boundaries)
+        key = pressure_matrix_key('scipy', dimensions, periodic, active_mask, fluid_mask)
+        if self._subdomains is None or self._subdomains.key is None or self._subdomains.key != key:
+            self.close()
+            A = _cached_matrix(self.matrix_cache, key, lambda: sparse_pressure_matrix(dimensions, active_mask, fluid_mask, periodic))
+            self._subdomains = SubdomainWorkers(A, dimensions, self.workers, self.local_solver, key)
+        subdomains = self._subdomains
+        if telemetry is not None:
+            telemetry.assembly_time = time.time() - start
+        shape = math.staticshape(field)
+        dtype = math.dtype(field)
+        dtype = getattr(dtype, 'as_numpy_dtype', dtype)  # TensorFlow DType
+
+        def np_solve(rhs, x0):
+            rhs = np.reshape(rhs, [rhs.shape[0], -1])
+            x0 = np.reshape(x0, rhs.shape) if x0 is not None else np.zeros_like(rhs)
+            results = [subdomains.solve(rhs[b], x0[b], self.accuracy, self.max_iterations, telemetry) for b in range(rhs.shape[0])]
+            iterations = np.array([result[1] for result in results], np.int32)
+            if telemetry is not None:
+                telemetry.example_iterations = iterations
+                telemetry.final_residual = max(result[2] for result in results)
+                telemetry.converged = telemetry.final_residual <= self.accuracy
+                telemetry.max_iterations_reached = self.max_iterations is not None and bool(np.any(iterations >= self.max_iterations))
+            return np.reshape(np.stack([result[0] for result in results]), shape).astype(dtype), np.max(iterations)
+
+        if isinstance(field, np.ndarray):
+            pressure, iterations = np_solve(field, guess)
+            return pressure, int(iterations)
+
+        def np_solve_pressure(rhs):
+            return np_solve(rhs, None)[0]
+
+        def np_solve_gradient(_op, grad_in):
+            return math.py_func(np_solve_pressure, [grad_in], dtype, shape)
+
+        return math.py_func(np_solve_pressure, [field], dtype, shape, grad=np_solve_gradient), None
+
+    def close(self):
+        """ Stops the worker processes. They are restarted by the next solve. """
+        if self._subdomains is not None:
+            self._subdomains.close()
+            self._subdomains = None
+
+
+class SubdomainWorkers(object):
+
+    def __init__(self, A, dimensions, workers, local_solver='ic', key=None):
+        """
+        Starts one worker process per slab of the domain.
+
+        :param A: SciPy sparse pressure matrix of the whole domain
+        :param dimensions: spatial resolution of the domain, the slabs are cut along the first axis
+        :param workers: maximum number of worker processes
+        :param local_solver: 'ic' or 'lu', see `DomainDecompositionCG`
+        :param key: identifier of the matrix, used to reuse the workers
+        """
+        self.key = key
+        N = A.shape[0]
+        planes = np.array_split(np.arange(dimensions[0]), max(1, min(workers, dimensions[0])))
+        plane_size = N // dimensions[0]
+        self.slabs = [(int(p[0]) * plane_size, (int(p[-1]) + 1) * plane_size) for p in planes]
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+        self._arrays = [context.RawArray('d', N) for _ in range(5)]
+        self.x, self.r, self.z, self.p, self.q = [np.frombuffer(array, np.float64) for array in self._arrays]
+        barrier = context.Barrier(len(self.slabs), timeout=BARRIER_TIMEOUT)
+        A = scipy.sparse.csr_matrix(A, dtype=np.float64)
+        self._connections = []
+        self._processes = []
+        for start, stop in self.slabs:
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=_subdomain_worker, args=(worker_connection, A[start:stop], start, stop, [(stop - start) // plane_size] + list(dimensions[1:]), local_solver, self._arrays, barrier), daemon=True)
+            process.start()
+            self._connections.append(connection)
+            self._processes.append(process)
+        self._gather()  # wait for the factorizations
+        _register_running(self)
+
+    def solve(self, rhs, x0, accuracy, max_iterations, telemetry=None):
+        """
+        Runs the block-Jacobi preconditioned conjugate gradient iteration for one example.
+
+        :param rhs: flattened right-hand side
+        :param x0: flattened initial guess
+        :return: solution, number of iterations, final maximum residual
+        """
+        self.x[:] = x0
+        self.r[:] = rhs
+        replies = self._broadcast('start')
+        residual_z = sum(reply[0] for reply in replies)
+        max_residual = max(reply[1] for reply in replies)
+        iterations = 0
+        beta = None
+        while max_residual > accuracy and (max_iterations is None or iterations < max_iterations):
+            direction_product = sum(self._broadcast('direction', beta))
+            alpha = residual_z / direction_product if direction_product != 0 else 0.
+            replies = self._broadcast('update', alpha)
+            next_residual_z = sum(reply[0] for reply in replies)
+            max_residual = max(reply[1] for reply in replies)
+            beta = next_residual_z / residual_z if residual_z != 0 else 0.
+            residual_z = next_residual_z
+            iterations += 1
+            if telemetry is not None and telemetry.level == 'full':
+                telemetry.residual_history.append(max_residual)
+        return np.array(self.x), iterations, max_residual
+
+    def _broadcast(self, command, argument=None):
+        for connection in self._connections:
+            connection.send((command, argument))
+        return self._gather()
+
+    def _gather(self):
+        try:
+            replies = [connection.recv() for connection in self._connections]
+        except EOFError:
+            self.close()
+            raise RuntimeError('A subdomain worker process terminated unexpectedly')
+        for reply in replies:
+            if isinstance(reply, Exception):
+                self.close()
+                raise reply
+        return replies
+
+    def close(self):
+        for connection in self._connections:
+            try:
+                connection.send(('stop', None))
+            except (OSError, EOFError):
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+        self._connections = []
+        self._processes = []
+        self.key = None
+        if _RUNNING is not None:
+            _RUNNING.discard(self)
+
+
+def _subdomain_worker(connection, rows, start, stop, slab_dimensions, local_solver, arrays, barrier):
+    """
+    Main loop of a worker process owning the cells `start:stop` of the flattened domain.
+
+    :param rows: rows of the pressure matrix belonging to the slab, all columns
+    :param slab_dimensions: resolution of the slab
+    """
+    try:
+        x, r, z, p, q = [np.frombuffer(array, np.float64) for array in arrays]
+        block = rows[:, start:stop].tocsc()
+        if local_solver == 'lu':
+            shift = 1e-6 * max(1., abs(block.diagonal()).max(initial=0.))  # keeps the block invertible for singular systems and empty cells
+            precondition = scipy.sparse.linalg.splu(block - shift * scipy.sparse.identity(stop - start, format='csc')).solve
+        else:
+            solve_factor = incomplete_cholesky(block, slab_dimensions)
+
+            def precondition(residual):
+                return solve_factor(residual[:, np.newaxis])[:, 0]
+
+        slab = slice(start, stop)
+        connection.send(None)
+        while True:
+            command, argument = connection.recv()
+            if command == 'start':
+                r[slab] -= rows.dot(x)
+                z[slab] = precondition(r[slab])
+                p[slab] = z[slab]
+                connection.send((np.dot(r[slab], z[slab]), np.max(np.abs(r[slab]), initial=0.)))
+            elif command == 'direction':
+                if argument is not None:
+                    p[slab] = z[slab] + argument * p[slab]
+                barrier.wait()  # neighbouring slabs read the halo of p
+                q[slab] = rows.dot(p)
+                connection.send(np.dot(p[slab], q[slab]))
+            elif command == 'update':
+                x[slab] += argument * p[slab]
+                r[slab] -= argument * q[slab]
+                z[slab] = precondition(r[slab])
+                connection.send((np.dot(r[slab], z[slab]), np.max(np.abs(r[slab]), initial=0.)))
+            else:
+                break
+    except Exception as exception:
+        barrier.abort()  # releases the other workers waiting for this slab, they report BrokenBarrierError
+        connection.send(RuntimeError('Subdomain %d:%d failed: %s\n%s' % (start, stop, exception, traceback.format_exc())))
+
+
+_RUNNING = None  # WeakSet of the SubdomainWorkers with live processes, created with the first workers
+
+
+def _register_running(subdomains):
+    """ Tracks `subdomains` so that its processes are stopped at exit. The set and the exit hook are created on first use. """
+    global _RUNNING
+    if _RUNNING is None:
+        _RUNNING = weakref.WeakSet()
+        atexit.register(_stop_all_workers)
+    _RUNNING.add(subdomains)
+
+
+def _stop_all_workers():
+    for subdomains in list(_RUNNING or ()):
+        subdomains.close()
@@ -1,4 +1,10 @@
 # coding=utf-8
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+from numbers import Number
+
 from phi import math
 from phi import struct
 from phi.physics.domain import Domain
@@ -49,6 +55,139 @@ class PoissonSolver(object):
 PressureSolver = PoissonSolver
 
 
+class SolveTelemetry(object):
+
+    def __init__(self, level='summary'):
+        """
+        Collects information about one pressure solve.
+        Pass an instance to `poisson_solve` or `divergence_free` and read its attributes after the solve.
+
+        Attributes that are not known for the solver used remain None.
+        With TensorFlow graphs, values computed from the solve are tensors and times measure the graph construction only.
+
+        :param level: 'summary' records the solver, iteration counts, final residual, convergence and wall times with negligible overhead.
+            'full' additionally records the maximum residual after every iteration (NumPy and PyTorch only) and computes the final residual of direct solvers.
+        """
+        assert level in ('summary', 'full'), level
+        self.level = level
+        self.solver = None
+        self.iterations = None
+        self.example_iterations = None
+        self.residual_history = [] if level == 'full' else None
+        self.final_residual = None
+        self.converged = None
+        self.max_iterations_reached = None
+        self.assembly_time = None
+        self.iteration_time = None
+        self.total_time = None
+
+    def record_residual(self, residual):
+        """ Appends the maximum absolute value of `residual` to `residual_history` if it can be evaluated immediately. """
+        backend = math.choose_backend(residual)
+        if backend.matches_name('SciPy') or backend.matches_name('PyTorch'):
+            self.residual_history.append(float(math.max(math.abs(residual))))
+
+    def record_result(self, result, accuracy, max_iterations):
+        """
+        Stores iteration counts, final residual and convergence of an iterative solve.
+
+        :param result: SolveResult as returned by the solvers in phi.math.optim
+        """
+        self.iterations = _eager(result.iterations)
+        self.example_iterations = result.example_iterations
+        self.final_residual = _eager(math.max(math.abs(result.residual)))
+        if accuracy is not None:
+            self.converged = self.final_residual <= accuracy
+        if max_iterations is not None:
+            self.max_iterations_reached = self.iterations >= max_iterations
+
+    def __repr__(self):
+        return 'SolveTelemetry(%s)' % ', '.join('%s=%s' % (name, value) for name, value in sorted(self.__dict__.items()) if name != 'residual_history')
+
+
+def _eager(value):
+    """ Converts NumPy and PyTorch scalars to Python numbers, leaving graph tensors untouched. """
+    backend = math.choose_backend(value)
+    return value.item() if hasattr(value, 'item') and (backend.matches_name('SciPy') or backend.matches_name('PyTorch')) else value
+
+
+def warn_if_not_converged(solver, max_residual, accuracy, iterations):
+    """
+    Warns if an eagerly executed iterative solve stopped before its residual reached `accuracy`, e.g. because the residual stagnated or diverged.
+    Graph tensors are not checked.
+
+    :param solver: PoissonSolver that performed the solve
+    :param max_residual: maximum absolute residual after the last iteration
+    :param accuracy: requested accuracy or None if no accuracy was requested
+    :param iterations: number of iterations performed
+    """
+    max_residual = _eager(max_residual)
+    if accuracy is not None and isinstance(max_residual, Number) and not max_residual <= accuracy:
+        warnings.warn('%s did not converge: residual %s after %s iterations exceeds the accuracy %s' % (solver.name, max_residual, _eager(iterations), accuracy), RuntimeWarning)
+
+
+_ACTIVE_TELEMETRY = threading.local()  # per-thread stack of telemetries, solves in other threads do not see each other's
+
+
+def _telemetry_stack():
+    stack = getattr(_ACTIVE_TELEMETRY, 'stack', None)
+    if stack is None:
+        stack = _ACTIVE_TELEMETRY.stack = [None]
+    return stack
+
+
+@contextmanager
+def telemetry_scope(telemetry):
+    """
+    Makes `telemetry` available to the first solver calling `claim_telemetry()` within the context in the current thread.
+
+    :param telemetry: SolveTelemetry or None
+    """
+    stack = _telemetry_stack()
+    stack.append(telemetry)
+    try:
+        yield telemetry
+    finally:
+        stack.pop()
+
+
+def claim_telemetry():
+    """
+    Returns the SolveTelemetry of the `poisson_solve` call running in the current thread or None.
+    Only the first solver to claim it records information, nested solves such as coarse-grid solves or preconditioners get None.
+
+    :rtype: SolveTelemetry
+    """
+    stack = _telemetry_stack()
+    telemetry = stack[-1]
+    stack[-1] = None
+    return telemetry
+
+
+def conjugate_gradient_solve(field, apply_A, guess, accuracy, max_iterations, back_prop, preconditioner=None, compact=False, telemetry=None, method='standard', check_interval=4):
+    """
+    Runs `phi.math.optim.conjugate_gradient` or, if a preconditioner is given, `preconditioned_conjugate_gradient` and reports the result to `telemetry`.
+    With method='fused', runs `fused_conjugate_gradient` instead.
+
+    :return: solution, number of iterations
+    """
+    from phi.math.optim import conjugate_gradient, preconditioned_conjugate_gradient, fused_conjugate_gradient
+    assert method in ('standard', 'fused'), method
+    x0 = guess if guess is not None else math.zeros_like(field)
+    callback = telemetry.record_residual if telemetry is not None and telemetry.level == 'full' else None
+    start = time.time()
+    if method == 'fused':
+        result = fused_conjugate_gradient(apply_A, field, x0, preconditioner, accuracy, max_iterations, back_prop, check_interval=check_interval, compact=compact, callback=callback)
+    elif preconditioner is None:
+        result = conjugate_gradient(apply_A, field, x0, accuracy, max_iterations, back_prop, compact=compact, callback=callback)
+    else:
+        result = preconditioned_conjugate_gradient(apply_A, field, x0, preconditioner, accuracy, max_iterations, back_prop, compact=compact, callback=callback)
+    if telemetry is not None:
+        telemetry.iteration_time = time.time() - start
+        telemetry.record_result(result, accuracy, max_iterations)
+    return result.x, result.iterations
+
+
 @struct.definition()
 class PoissonDomain(struct.Struct):
 
@@ -130,7 +269,7 @@ def _active_extrapolation(boundaries):
     return 'periodic' if boundaries == 'periodic' else 'constant'
 
 
-def poisson_solve(input_field, poisson_domain, solver=None, guess=None, gradient='implicit'):
+def poisson_solve(input_field, poisson_domain, solver=None, guess=None, gradient='implicit', telemetry=None):
     """
     Solves the Poisson equation Δp = input_field for p.
 
@@ -142,7 +281,8 @@ def poisson_solve(input_field, poisson_domain, solver=None, guess=None, gradient
     :param input_field: CenteredGrid
     :param poisson_domain: PoissonDomain instance
     :param solver: PoissonSolver to use, None for default
-    :param guess: CenteredGrid with same size and resolution as input_field
+    :param guess: CenteredGrid with same size and resolution as input_field. Ignored if the solver does not support initial guesses.
+    :param telemetry: (optional) SolveTelemetry to be filled with information about the solve
     :return: p as CenteredGrid, iteration count as int or None if not available
     :rtype: CenteredGrid, int
     """
@@ -154,26 +294,49 @@ def poisson_solve(input_field, poisson_domain, solver=None, guess=None, gradient
     if isinstance(poisson_domain, Domain):
         poisson_domain = PoissonDomain(poisson_domain)
     if solver is None:
-        solver = _choose_solver(input_field.resolution, math.choose_backend([input_field.data, poisson_domain.active.data, poisson_domain.accessible.data]))
+        solver = _choose_solver(input_field.resolution, math.choose_backend([input_field.data, poisson_domain.active.data, poisson_domain.accessible.data]), poisson_domain)
+    if not solver.supports_guess:
+        guess = None
     if not struct.any(Material.open(poisson_domain.domain.boundaries)):  # has no open boundary
         input_field = input_field - math.mean(input_field.data, axis=tuple(range(1, 1 + input_field.rank)), keepdims=True)  # Subtract mean divergence
 
     assert gradient in ('autodiff', 'implicit', 'inverse')
-    if gradient == 'autodiff':
-        pressure, iteration = solver.solve(input_field.data, poisson_domain, guess, enable_backprop=True)
-    else:
-        if gradient == 'implicit':
-            def poisson_gradient(_op, grad):
-                return poisson_solve(CenteredGrid.sample(grad, poisson_domain.domain), poisson_domain, solver, None, gradient=gradient)[0].data
-        else:  # gradient = 'inverse'
-            def poisson_gradient(_op, grad):
-                return CenteredGrid.sample(grad, poisson_domain.domain).laplace(physical_units=False).data
-        pressure, iteration = math.with_custom_gradient(solver.solve, [input_field.data, poisson_domain, guess, False], poisson_gradient, input_index=0, output_index=0, name_base='poisson_solve')
+    start = time.time()
+    with telemetry_scope(telemetry):
+        if gradient == 'autodiff':
+            pressure, iteration = solver.solve(input_field.data, poisson_domain, guess, enable_backprop=True)
+        else:
+            if gradient == 'implicit':
+                def poisson_gradient(_op, grad):
+                    return poisson_solve(CenteredGrid.sample(grad, poisson_domain.domain), poisson_domain, solver, None, gradient=gradient)[0].data
+            else:  # gradient = 'inverse'
+                def poisson_gradient(_op, grad):
+                    return CenteredGrid.sample(grad, poisson_domain.domain).laplace(physical_units=False).data
+            pressure, iteration = math.with_custom_gradient(solver.solve, [input_field.data, poisson_domain, guess, False], poisson_gradient, input_index=0, output_index=0, name_base='poisson_solve')
+    if telemetry is not None:
+        _complete_telemetry(telemetry, solver, iteration, time.time() - start, input_field.data, pressure, poisson_domain)
 
     pressure = CenteredGrid(pressure, input_field.box, extrapolation=input_field.extrapolation, name='pressure')
     return pressure, iteration
 
 
+def _complete_telemetry(telemetry, solver, iterations, total_time, divergence, pressure, poisson_domain):
+    """
+    Fills in the information available for every solver.
+    At level 'full', the final residual of solvers that did not report one is computed with the geometric pressure stencil.
+    """
+    telemetry.solver = solver.name
+    telemetry.total_time = total_time
+    if telemetry.iterations is None and iterations is not None:
+        telemetry.iterations = _eager(iterations)
+    if telemetry.assembly_time is not None and telemetry.iteration_time is None:
+        telemetry.iteration_time = total_time - telemetry.assembly_time
+    if telemetry.level == 'full' and telemetry.final_residual is None:
+        from .geom import _masked_laplace
+        residual = _masked_laplace(pressure, poisson_domain.accessible_tensor(extend=1), Material.extrapolation_mode(poisson_domain.domain.boundaries)) - divergence
+        telemetry.final_residual = _eager(math.max(math.abs(residual * poisson_domain.active_tensor())))
+
+
 class _PoissonSolverChain(PoissonSolver):
 
     def __init__(self, solvers):
@@ -183,18 +346,32 @@ class _PoissonSolverChain(PoissonSolver):
             assert isinstance(solver, PoissonSolver)
             assert solver.supports_guess
 
-    def solve(self, field, domain, guess):
+    def solve(self, field, domain, guess, enable_backprop):
         iterations = None
         for solver in self.solvers:
-            guess, iterations = solver.solve(field, domain, guess)
+            guess, iterations = solver.solve(field, domain, guess, enable_backprop)
         return guess, iterations
 
 
-def _choose_solver(resolution, backend):
+def _choose_solver(resolution, backend, poisson_domain=None):
+    from .autotune import active_autotuner
+    autotuner = active_autotuner()
+    if autotuner is not None and poisson_domain is not None:
+        return autotuner
+    return _default_solver(resolution, backend, poisson_domain)
+
+
+def _default_solver(resolution, backend, poisson_domain=None):
+    from .dct import DCTSolver, dct_transforms, has_obstacles
     use_fourier = math.max(resolution) > 64
+    use_dct = poisson_domain is not None and backend.matches_name('SciPy') and dct_transforms(poisson_domain.domain.boundaries, poisson_domain.rank) is not None
+    if use_dct and not has_obstacles(poisson_domain):
+        return DCTSolver()
     if backend.precision == 64:
         from .fourier import FourierSolver
         from .geom import GeometricCG
+        if use_dct:
+            return GeometricCG(accuracy=1e-8, preconditioner='dct')
         return FourierSolver() & GeometricCG(accuracy=1e-8) if use_fourier else GeometricCG(accuracy=1e-8)
     elif backend.precision == 32 and backend.matches_name('SciPy'):
         from .sparse import SparseSciPy
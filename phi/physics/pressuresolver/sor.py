@@ -0,0 +1,151 @@
+import time
+
+import numpy as np
+
+from phi import math
+from phi.physics.material import Material
+from .geom import MaskedLaplaceOperator
+from .solver_api import PoissonDomain, PoissonSolver, claim_telemetry, warn_if_not_converged, _eager
+
+
+class RedBlackSOR(PoissonSolver):
+
+    def __init__(self, accuracy=1e-5, max_sweeps=10000, relaxation=None, check_interval=10):
+        """
+        Successive over-relaxation with red-black ordering.
+
+        The cells are coloured like a checkerboard so that no two neighbouring cells share a colour.
+        Each sweep first relaxes all red cells simultaneously, then all black cells using the updated red values.
+        This makes the Gauss-Seidel update fully vectorized on every backend.
+        Periodic axes with an odd number of cells require a third colour, see `checkerboard()`.
+        The residual is updated along with the pressure so that float32 solves can reach the accuracy.
+        The pressure matrix is applied geometrically with the masked stencil of GeometricCG, so inaccessible cells are left untouched.
+
+        With `accuracy=None`, exactly `max_sweeps` sweeps are performed which yields a cheap approximate solve for preview-quality simulations.
+        Otherwise, solves that do not reach the accuracy within `max_sweeps` are reported as not converged and issue a RuntimeWarning.
+
+        :param accuracy: the maximally allowed error on the divergence channel for each cell or None to always perform `max_sweeps` sweeps.
+        :param max_sweeps: maximum number of red-black sweeps
+        :param relaxation: over-relaxation factor between 0 and 2 or None to use 2/(1+sin(π/n)), the optimal factor for the Laplace stencil on an empty box with n cells along its longest axis
+        :param check_interval: number of sweeps between convergence checks. Each check computes the maximum of the residual.
+        """
+        PoissonSolver.__init__(self, 'Red-Black SOR', supported_devices=('CPU', 'GPU', 'TPU'), supports_guess=True, supports_loop_counter=True, supports_continuous_masks=True)
+        assert accuracy is None or math.is_scalar(accuracy), 'invalid accuracy: %s' % accuracy
+        assert relaxation is None or 0 < relaxation < 2, 'relaxation must lie between 0 and 2 but got %s' % relaxation
+        self.accuracy = accuracy
+        self.max_sweeps = max_sweeps
+        self.relaxation = relaxation
+        self.check_interval = check_interval
+
+    def solve(self, divergence, domain, guess, enable_backprop):
+        assert isinstance(domain, PoissonDomain)
+        telemetry = claim_telemetry()
+        start = time.time()
+        operator = MaskedLaplaceOperator(domain.accessible_tensor(extend=1), Material.extrapolation_mode(domain.domain.boundaries))
+        relaxation = self.relaxation if self.relaxation is not None else optimal_relaxation(domain.domain.resolution)
+        steps = red_black_steps(operator, relaxation)
+        divergence = math.to_float(divergence)
+        x0 = math.to_float(guess) if guess is not None else math.zeros_like(divergence)
+        check_interval = self.check_interval if self.accuracy is not None else self.max_sweeps
+
+        def sor_loop(x, residual, iterations):
+            for _ in range(check_interval):
+                for step in steps:
+                    correction = math.mul(step, residual)
+                    x = x + correction
+                    residual = residual - operator(correction)  # updating the residual instead of recomputing it avoids cancellation in float32
+            if telemetry is not None and telemetry.level == 'full':
+                telemetry.record_residual(residual)
+            return [x, residual, iterations + check_interval]
+
+        def not_converged(_x, residual, _iterations):
+            if self.accuracy is None:
+                return True
+            return math.max(math.abs(residual)) > self.accuracy
+
+        residual0 = divergence - operator(x0)
+        if telemetry is not None:
+            telemetry.assembly_time = time.time() - start
+        max_checks = None if self.max_sweeps is None else -(-self.max_sweeps // check_interval)
+        x, residual, iterations = math.while_loop(not_converged, sor_loop, [x0, residual0, 0], back_prop=enable_backprop, name='RedBlackSOR', maximum_iterations=max_checks)
+        final_residual = math.max(math.abs(residual))
+        if telemetry is not None:
+            telemetry.iteration_time = time.time() - start - telemetry.assembly_time
+            telemetry.iterations = _eager(iterations)
+            telemetry.final_residual = _eager(final_residual)
+            telemetry.converged = self.accuracy is None or telemetry.final_residual <= self.accuracy
+            telemetry.max_iterations_reached = self.max_sweeps is not None and telemetry.iterations >= self.max_sweeps
+        warn_if_not_converged(self, final_residual, self.accuracy, iterations)
+        return x, iterations
+
+
+def optimal_relaxation(resolution):
+    """
+    Over-relaxation factor minimizing the spectral radius of SOR for the Laplace stencil on an empty box.
+
+    :param resolution: spatial resolution of the grid
+    :return: float between 1 and 2
+    """
+    return 2. / (1 + np.sin(np.pi / max(2, np.max(resolution))))
+
+
+def checkerboard(resolution, periodic=None):
+    """
+    Colours the cells of a grid such that no two cells sharing a face have the same colour.
+
+    Two colours suffice unless a periodic axis has an odd number of cells, closing a cycle of odd length.
+    Then, the last cell along such axes is assigned the third colour and three masks are returned.
+
+    :param resolution: spatial resolution of the grid
+    :param periodic: (optional) for each axis, whether the first and last cells are neighbours
+    :return: tuple of boolean masks of shape (1, spatial dimensions..., 1), red and black or three colours
+    """
+    indices = np.indices(resolution)
+    odd_cycles = [dimension for dimension, size in enumerate(resolution) if periodic is not None and periodic[dimension] and size % 2 != 0]
+    if not odd_cycles:
+        parity = np.sum(indices, axis=0) % 2
+        red = np.reshape(parity == 0, [1] + list(resolution) + [1])
+        return red, ~red
+    colour = indices % 2
+    for dimension in odd_cycles:
+        colour[dimension][indices[dimension] == resolution[dimension] - 1] = 2  # neighbours differ by 1 or 2, never by a multiple of 3
+    colour = np.sum(colour, axis=0) % 3
+    return tuple(np.reshape(colour == i, [1] + list(resolution) + [1]) for i in range(3))
+
+
+def red_black_steps(operator, relaxation):
+    """
+    Precomputes the update weights of the red and black half-sweeps, i.e. the relaxation factor divided by the stencil diagonal on cells of the respective colour and zero elsewhere.
+
+    :param operator: MaskedLaplaceOperator or MultigridLevel providing `diagonal`
+    :param relaxation: over-relaxation factor
+    :return: red and black weight tensors
+    """
+    weights = math.divide_no_nan(relaxation * math.ones_like(operator.diagonal), operator.diagonal)
+    return [math.mul(weights, math.to_float(colour)) for colour in checkerboard(math.staticshape(operator.diagonal)[1:-1], operator.periodic)]
+
+
+def red_black_sweep(operator, x, rhs, steps):
+    """
+    Performs one red-black SOR sweep.
+
+    :param operator: function applying the pressure matrix
+    :param steps: update weights from `red_black_steps()`
+    :return: updated x
+    """
+    for step in steps:
+        x = x + math.mul(step, rhs - operator(x))
+    return x
+
+
+def red_black_smooth(operator, x, rhs, sweeps, relaxation=None):
+    """
+    Red-black Gauss-Seidel or SOR relaxation for GeometricMultigrid.
+
+    :param operator: MultigridLevel
+    :param relaxation: over-relaxation factor, defaults to 1 (Gauss-Seidel) which damps high frequencies well
+    """
+    steps = red_black_steps(operator, 1. if relaxation is None else relaxation)
+    for _ in range(sweeps):
+        x = red_black_sweep(operator.apply, x, rhs, steps)
+    return x
@@ -1,33 +1,138 @@
+import hashlib
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import scipy
 import scipy.sparse
 import scipy.sparse.linalg
 
 from phi import math
-from phi.math.blas import conjugate_gradient
 from phi.math.helper import _dim_shifted
 from phi.physics.material import Material
 from phi.struct.tensorop import collapsed_gather_nd
-from .solver_api import PoissonSolver, FluidDomain
+from .dct import dct_poisson
+from .multigrid import GeometricMultigrid, multigrid_preconditioner
+from .solver_api import PoissonSolver, FluidDomain, claim_telemetry, conjugate_gradient_solve
+
+
+class PressureMatrixCache(object):
+
+    def __init__(self, max_size=16):
+        """
+        Bounded least-recently-used cache for assembled pressure matrices.
+
+        Entries are keyed on the grid resolution, the boundary periodicity and a fingerprint of the active and accessible masks.
+        Simulations with static obstacles therefore only pay the assembly cost once.
+        Only NumPy masks can be fingerprinted; for other tensors, the matrix is rebuilt on every request.
+
+        :param max_size: maximum number of matrices held at any time. The least recently used entry is evicted first.
+        """
+        assert max_size > 0, max_size
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, build):
+        """
+        Looks up the matrix stored under `key` or builds and stores it if not present.
+
+        :param key: key created by `pressure_matrix_key()` or None to bypass the cache
+        :param build: function without arguments that assembles the matrix
+        :return: cached or newly built matrix
+        """
+        if key is None:
+            return build()
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        self.misses += 1
+        matrix = build()
+        self._entries[key] = matrix
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return matrix
+
+    def clear(self):
+        """ Removes all entries and resets the hit and miss counters. """
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return 'PressureMatrixCache(%d/%d entries, %d hits, %d misses)' % (len(self._entries), self.max_size, self.hits, self.misses)
+
+
+def pressure_matrix_key(kind, dimensions, periodic, *masks):
+    """
+    Creates a cache key for a pressure matrix or returns None if any of the masks is not a NumPy array.
+
+    :param kind: string distinguishing different matrix representations
+    :param dimensions: valid simulation dimensions
+    :param periodic: periodicity as returned by Material.periodic()
+    :param masks: mask tensors the matrix depends on
+    :return: hashable key or None
+    """
+    fingerprints = []
+    for mask in masks:
+        if not isinstance(mask, np.ndarray):
+            return None
+        fingerprints.append((mask.shape, mask.dtype.str, hashlib.sha1(np.ascontiguousarray(mask).tobytes()).hexdigest()))
+    return (kind, tuple(int(dim) for dim in dimensions), repr(periodic)) + tuple(fingerprints)
+
+
+PRESSURE_MATRIX_CACHE = PressureMatrixCache()
 
 
 class SparseSciPy(PoissonSolver):
 
-    def __init__(self):
+    def __init__(self, matrix_cache=PRESSURE_MATRIX_CACHE, factorize=False, max_workers=None):
         """
         The SciPy solver uses the function scipy.sparse.linalg.spsolve to determine the pressure.
         It does not support initial guesses for the pressure and does not keep track of a loop counter.
+
+        All examples that share the same masks are solved in one call with a matrix right-hand side.
+        If the masks differ between examples, each example gets its own matrix and the examples are solved in parallel threads.
+
+        :param matrix_cache: PressureMatrixCache used to reuse assembled matrices between solves or None to rebuild the matrix every time
+        :param factorize: If True, computes an LU factorization of the pressure matrix (scipy.sparse.linalg.splu) once and stores it in `matrix_cache`.
+            All examples, subsequent solves with the same masks and the backward pass then only perform two triangular solves.
+        :param max_workers: maximum number of threads used to solve examples with differing masks, None for the ThreadPoolExecutor default, 1 to solve sequentially
         """
         PoissonSolver.__init__(self, 'SciPy sparse solver', supported_devices=('CPU',), supports_guess=False, supports_loop_counter=False, supports_continuous_masks=True)
+        self.matrix_cache = matrix_cache
+        self.factorize = factorize
+        self.max_workers = max_workers
 
     def solve(self, field, domain, guess, enable_backprop):
         assert isinstance(domain, FluidDomain)
+        telemetry = claim_telemetry()
+        start = time.time()
         dimensions = list(field.shape[1:-1])
-        A = sparse_pressure_matrix(dimensions, domain.active_tensor(extend=1), domain.accessible_tensor(extend=1), Material.periodic(domain.domain.boundaries))
+        N = int(np.prod(dimensions))
+        active_mask = domain.active_tensor(extend=1)
+        fluid_mask = domain.accessible_tensor(extend=1)
+        periodic = Material.periodic(domain.domain.boundaries)
+        mask_batch_size = max(math.staticshape(active_mask)[0], math.staticshape(fluid_mask)[0])
+        linear_solvers = [self._linear_solver(dimensions, periodic, _batch_slice(active_mask, b), _batch_slice(fluid_mask, b)) for b in range(mask_batch_size)]
+        if telemetry is not None:
+            telemetry.assembly_time = time.time() - start
+            telemetry.converged = True  # direct solve
 
         def np_solve_p(div):
-            div_vec = div.reshape([-1, A.shape[0]])
-            pressure = [scipy.sparse.linalg.spsolve(A, div_vec[i, ...]) for i in range(div_vec.shape[0])]
+            div_vec = div.reshape([-1, N])
+            if len(linear_solvers) == 1:
+                pressure = linear_solvers[0](div_vec)
+            else:
+                assert div_vec.shape[0] == len(linear_solvers), 'Masks with batch size %d cannot be applied to %d examples' % (len(linear_solvers), div_vec.shape[0])
+                with ThreadPoolExecutor(self.max_workers) as pool:
+                    pressure = np.concatenate(list(pool.map(lambda solve, example: solve(example[np.newaxis, :]), linear_solvers, div_vec)))
             return np.array(pressure).reshape(div.shape).astype(np.float32)
 
         def np_solve_p_gradient(op, grad_in):
@@ -36,10 +141,26 @@ class SparseSciPy(PoissonSolver):
         pressure = math.py_func(np_solve_p, [field], np.float32, field.shape, grad=np_solve_p_gradient)
         return pressure, None
 
+    def _linear_solver(self, dimensions, periodic, active_mask, fluid_mask):
+        """
+        Returns a function that solves the pressure system defined by the given masks for a batch of flattened right-hand sides of shape (batch, cells).
+        """
+        key = pressure_matrix_key('scipy', dimensions, periodic, active_mask, fluid_mask)
+
+        def build_matrix():
+            return _cached_matrix(self.matrix_cache, key, lambda: sparse_pressure_matrix(dimensions, active_mask, fluid_mask, periodic))
+
+        if self.factorize:
+            lu = _cached_matrix(self.matrix_cache, None if key is None else ('splu',) + key, lambda: scipy.sparse.linalg.splu(build_matrix().tocsc()))
+            return lambda rhs: lu.solve(np.ascontiguousarray(rhs.T, dtype=np.float32)).T
+        else:
+            A = build_matrix()
+            return lambda rhs: np.reshape(scipy.sparse.linalg.spsolve(A, rhs.T), [A.shape[0], -1]).T
+
 
 class SparseCG(PoissonSolver):
 
-    def __init__(self, accuracy=1e-5, max_iterations=2000):
+    def __init__(self, accuracy=1e-5, max_iterations=2000, matrix_cache=PRESSURE_MATRIX_CACHE, preconditioner=None, method='standard', check_interval=4):
         """
         Conjugate gradient solver using sparse matrix multiplications.
 
@@ -53,101 +174,210 @@ class SparseCG(PoissonSolver):
             The intermediate results of each loop iteration will be permanently stored if backpropagation is used.
             If False, replaces autodiff by a forward pressure solve in reverse accumulation backpropagation.
             This requires less memory but is only accurate if the solution is fully converged.
+        :param matrix_cache: PressureMatrixCache used to reuse assembled SciPy matrices between solves or None to rebuild the matrix every time
+        :param preconditioner: None for plain CG or one of
+            'jacobi': divides residuals by the matrix diagonal,
+            'ic': modified incomplete Cholesky factorization of the SciPy matrix (NumPy only), stored in `matrix_cache`,
+            'dct': solves for the residual ignoring obstacles, see DCTSolver (NumPy and TensorFlow),
+            'multigrid' or a GeometricMultigrid instance: applies one multigrid cycle to the residual
+        :param method: 'standard' or 'fused'. The fused variant computes the dot products of each iteration in one reduction and checks convergence every `check_interval` iterations, see `phi.math.optim.fused_conjugate_gradient()`.
+            It requires a linear preconditioner.
+        :param check_interval: number of iterations between convergence checks of the fused method
         """
         PoissonSolver.__init__(self, 'Sparse Conjugate Gradient', supported_devices=('CPU', 'GPU'), supports_guess=True, supports_loop_counter=True, supports_continuous_masks=True)
         assert math.is_scalar(accuracy), 'invalid accuracy: %s' % accuracy
         self.accuracy = accuracy
         self.max_iterations = max_iterations
+        self.matrix_cache = matrix_cache
+        self.preconditioner = preconditioner
+        assert method in ('standard', 'fused'), method
+        self.method = method
+        self.check_interval = check_interval
 
     def solve(self, field, domain, guess, enable_backprop):
         assert isinstance(domain, FluidDomain)
+        telemetry = claim_telemetry()
+        start = time.time()
         active_mask = domain.active_tensor(extend=1)
         fluid_mask = domain.accessible_tensor(extend=1)
         dimensions = math.staticshape(field)[1:-1]
-        N = int(np.prod(dimensions))
         periodic = Material.periodic(domain.domain.boundaries)
 
+        key = pressure_matrix_key('scipy', dimensions, periodic, active_mask, fluid_mask)
         if math.choose_backend([field, active_mask, fluid_mask]).matches_name('SciPy'):
-            A = sparse_pressure_matrix(dimensions, active_mask, fluid_mask, periodic)
+            A = _cached_matrix(self.matrix_cache, key, lambda: sparse_pressure_matrix(dimensions, active_mask, fluid_mask, periodic))
         else:
-            sidx, sorting = sparse_indices(dimensions, periodic)
-            sval_data = sparse_values(dimensions, active_mask, fluid_mask, sorting, periodic)
+            structure = sparse_structure(dimensions, periodic)
             backend = math.choose_backend(field)
-            sval_data = backend.cast(sval_data, field.dtype)
-            A = backend.sparse_tensor(indices=sidx, values=sval_data, shape=[N, N])
+            sval_data = backend.cast(structure.values(active_mask, fluid_mask), field.dtype)
+            A = structure.sparse_tensor(sval_data, backend)
 
         div_vec = math.reshape(field, [-1, int(np.prod(field.shape[1:]))])
         if guess is not None:
             guess = math.reshape(guess, [-1, int(np.prod(field.shape[1:]))])
 
         def apply_A(pressure): return math.matmul(A, pressure)
-        result_vec, iterations = conjugate_gradient(div_vec, apply_A, guess, self.accuracy, self.max_iterations, enable_backprop)
+        preconditioner = self._preconditioner(A, key, dimensions, domain, active_mask, fluid_mask, field)
+        compact = math.staticshape(active_mask)[0] == 1 and math.staticshape(fluid_mask)[0] == 1  # converged examples can be dropped from the batch
+        if telemetry is not None:
+            telemetry.assembly_time = time.time() - start
+        result_vec, iterations = conjugate_gradient_solve(div_vec, apply_A, guess, self.accuracy, self.max_iterations, enable_backprop, preconditioner, compact, telemetry, self.method, self.check_interval)
         return math.reshape(result_vec, math.shape(field)), iterations
 
+    def _preconditioner(self, A, key, dimensions, domain, active_mask, fluid_mask, field):
+        """
+        Creates the preconditioner function for flattened residuals of shape (batch, cells) or returns None.
+        """
+        if self.preconditioner is None:
+            return None
+        if self.preconditioner == 'jacobi':
+            diagonal = math.expand_dims(_stencil_values(active_mask, fluid_mask, [])[0], 0)
+            diagonal = math.choose_backend(field).cast(diagonal, field.dtype)
+            return lambda residual: residual / diagonal
+        if self.preconditioner == 'ic':
+            assert isinstance(A, scipy.sparse.spmatrix), "The 'ic' preconditioner requires NumPy tensors"
+            solve_factor = _cached_matrix(self.matrix_cache, None if key is None else ('ic',) + key, lambda: incomplete_cholesky(A, dimensions))
+            return lambda residual: solve_factor(residual.T).T
+        grid_shape = [-1] + list(dimensions) + [1]
+        if self.preconditioner == 'dct':
+            return lambda residual: math.reshape(dct_poisson(math.reshape(residual, grid_shape), domain), math.shape(residual))
+        multigrid = None if self.preconditioner == 'multigrid' else self.preconditioner
+        assert isinstance(multigrid, (GeometricMultigrid, type(None))), 'Unsupported preconditioner for SparseCG: %s' % (self.preconditioner,)
+        cycle = multigrid_preconditioner(domain, multigrid)
+        return lambda residual: math.reshape(cycle(math.reshape(residual, grid_shape)), math.shape(residual))
+
+
+def incomplete_cholesky(A, dimensions, modification=0.97):
+    """
+    Computes a modified incomplete Cholesky factorization without fill-in, MIC(0), of the symmetric pressure matrix for use as a preconditioner.
+
+    The factorization has the form M = (D + L) D^-1 (D + L^T) where L is the strictly lower triangle of A.
+    The pivots D are determined by a recurrence over the lower neighbours of each cell.
+    Cells with the same sum of grid coordinates do not depend on each other, so the recurrence is evaluated one such wavefront at a time.
+    Triangular solves with (D + L) and its transpose are performed by SuperLU.
+
+    :param A: SciPy sparse pressure matrix
+    :param dimensions: valid simulation dimensions
+    :param modification: fraction of the dropped fill-in that is compensated on the diagonal. 0 yields plain incomplete Cholesky.
+    :return: function mapping right-hand sides of shape (cells, batch) to the preconditioned vectors
+    """
+    A = scipy.sparse.csr_matrix(A, dtype=np.float64)
+    lower = scipy.sparse.tril(A, k=-1, format='csr')
+    products = lower.multiply(scipy.sparse.triu(A, k=1, format='csr').T).tocsr()  # a_ij * a_ji
+    upper_sums = np.asarray(scipy.sparse.triu(A, k=1).sum(axis=1)).ravel()
+    diagonal = A.diagonal()
+    inverse_pivots = np.zeros_like(diagonal)
+    wavefront = np.sum(np.indices(dimensions), axis=0).ravel()
+    order = np.argsort(wavefront, kind='stable')
+    bounds = np.searchsorted(wavefront[order], np.arange(wavefront.max() + 2))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        rows = order[start:end]
+        pivots = diagonal[rows] - (1 - modification) * (products[rows] @ inverse_pivots) - modification * (lower[rows] @ (inverse_pivots * upper_sums))
+        pivots = np.where(np.abs(pivots) < 0.25 * np.abs(diagonal[rows]), diagonal[rows], pivots)  # guard against breakdown
+        inverse_pivots[rows] = 1. / pivots
+    pivots = (1. / inverse_pivots).astype(np.float32)
+    factor = (lower + scipy.sparse.diags(1. / inverse_pivots)).astype(np.float32)
+    lower_solve = scipy.sparse.linalg.splu(factor.tocsc(), permc_spec='NATURAL', diag_pivot_thresh=0, options=dict(SymmetricMode=True))
+    upper_solve = scipy.sparse.linalg.splu(factor.T.tocsc(), permc_spec='NATURAL', diag_pivot_thresh=0, options=dict(SymmetricMode=True))
+    return lambda rhs: upper_solve.solve(pivots[:, np.newaxis] * lower_solve.solve(np.ascontiguousarray(rhs, dtype=np.float32)))
+
+
+def _cached_matrix(cache, key, build):
+    return build() if cache is None else cache.get(key, build)
+
+
+def _batch_slice(tensor, batch_index):
+    return tensor if math.staticshape(tensor)[0] == 1 else tensor[batch_index:batch_index + 1, ...]
+
 
 def sparse_pressure_matrix(dimensions, extended_active_mask, extended_fluid_mask, periodic=False):
     """
 Builds a sparse matrix such that when applied to a flattened pressure channel, it calculates the laplace
 of that channel, taking into account obstacles and empty cells.
 
+The (row, column, value) triplets of all stencil entries are computed in one vectorized pass and assembled into a CSR matrix directly.
+Triplets at the same position are summed. This happens on periodic axes of size 1 and 2 where a cell couples to the same neighbour (or itself) from both sides, so the matrix equals the periodic Laplace stencil.
+
     :param dimensions: valid simulation dimensions. Pressure channel should be of shape (batch size, dimensions..., 1)
     :param extended_active_mask: Binary tensor with 2 more entries in every dimension than 'dimensions'.
     :param extended_fluid_mask: Binary tensor with 2 more entries in every dimension than 'dimensions'.
     :return: SciPy sparse matrix that acts as a laplace on a flattened pressure channel given obstacles and empty cells
     """
     N = int(np.prod(dimensions))
-    d = len(dimensions)
-    A = scipy.sparse.lil_matrix((N, N), dtype=np.float32)
-    dims = range(d)
+    neighbours = sparse_structure(dimensions, periodic).neighbours
+    rows = np.concatenate([np.arange(N)] + [n_rows for _dim, _upper, n_rows, _columns in neighbours])
+    columns = np.concatenate([np.arange(N)] + [n_columns for _dim, _upper, _rows, n_columns in neighbours])
+    values = np.concatenate(_stencil_values(extended_active_mask, extended_fluid_mask, neighbours))
+    return scipy.sparse.csr_matrix((values.astype(np.float32), (rows, columns)), shape=(N, N))
 
-    diagonal_entries = np.zeros(N, extended_active_mask.dtype)  # diagonal matrix entries
 
-    gridpoints_linear = np.arange(N)
-    gridpoints = np.stack(np.unravel_index(gridpoints_linear, dimensions))  # d * (N^2) array mapping from linear to spatial frames
+class SparseStructure(object):
 
-    for dim in dims:
-        lower_active, self_active, upper_active = _dim_shifted(extended_active_mask, dim, (-1, 0, 1), diminish_others=(1,1))
-        lower_accessible, upper_accessible = _dim_shifted(extended_fluid_mask, dim, (-1, 1), diminish_others=(1, 1))
+    def __init__(self, dimensions, periodic=False):
+        """
+        Sparsity pattern of the pressure matrix which only depends on the resolution and the boundary periodicity.
 
-        stencil_upper = upper_active * self_active
-        stencil_lower = lower_active * self_active
-        stencil_center = - lower_accessible - upper_accessible
+        Holds the stencil neighbours, the positions of all nonzero entries sorted in row-major order as required by sparse tensors and the permutation that sorts the stencil values accordingly.
+        Use `sparse_structure()` to obtain a cached instance.
 
-        diagonal_entries += math.flatten(stencil_center)
+        :param dimensions: valid simulation dimensions
+        :param periodic: periodicity as returned by Material.periodic()
+        """
+        self.N = int(np.prod(dimensions))
+        self.neighbours = _stencil_neighbours(dimensions, periodic)
+        indices = np.concatenate([np.stack([np.arange(self.N)] * 2, axis=-1)] + [np.stack([rows, columns], axis=-1) for _dim, _upper, rows, columns in self.neighbours], axis=0)
+        self.sorting = np.lexsort((indices[:, 1], indices[:, 0]))  # rows first, then columns
+        self.indices = indices[self.sorting]
+        for array in (self.sorting, self.indices):
+            array.setflags(write=False)  # shared between all solves
+        self._sparse_tensor = None
+
+    def values(self, extended_active_mask, extended_fluid_mask):
+        """
+        Computes the nonzero entries of the pressure matrix in the order of `indices`.
 
-        dim_direction = math.expand_dims([1 if i == dim else 0 for i in range(d)], axis=-1)
-        # --- Stencil upper cells ---
-        upper_points, upper_idx = wrap_or_discard(gridpoints + dim_direction, dim, dimensions, periodic=collapsed_gather_nd(periodic, [dim, 1]))
-        A[gridpoints_linear[upper_idx], upper_points] = stencil_upper.flatten()[upper_idx]
-        # --- Stencil lower cells ---
-        lower_points, lower_idx = wrap_or_discard(gridpoints - dim_direction, dim, dimensions, periodic=collapsed_gather_nd(periodic, [dim, 0]))
-        A[gridpoints_linear[lower_idx], lower_points] = stencil_lower.flatten()[lower_idx]
+        :return: 1D tensor
+        """
+        return math.gather(math.concat(_stencil_values(extended_active_mask, extended_fluid_mask, self.neighbours), axis=0), self.sorting)
 
-    A[gridpoints_linear, gridpoints_linear] = math.minimum(diagonal_entries, -1)  # avoid 0, could lead to NaN
+    def sparse_tensor(self, values, backend):
+        """
+        Creates a sparse tensor with this sparsity pattern.
+        If the previous call used the same backend and graph, its index tensor is reused and only the values are replaced.
 
-    return scipy.sparse.csc_matrix(A)
+        :param values: nonzero entries as returned by `values()`
+        :param backend: Backend creating the tensor
+        :return: backend sparse tensor of shape (N, N)
+        """
+        graph = getattr(values, 'graph', None)  # TensorFlow tensors cannot be shared between graphs
+        if self._sparse_tensor is not None and self._sparse_tensor[0] == backend.name and self._sparse_tensor[1] is graph:
+            A = backend.sparse_tensor_with_values(self._sparse_tensor[2], values)
+        else:
+            A = backend.sparse_tensor(indices=self.indices, values=values, shape=[self.N, self.N])
+        self._sparse_tensor = (backend.name, graph, A)
+        return A
+
+
+SPARSE_STRUCTURE_CACHE = PressureMatrixCache(max_size=8)
+
+
+def sparse_structure(dimensions, periodic=False):
+    """
+    Returns the SparseStructure for the given resolution and periodicity, building it only on the first request.
+    The most recently used structures are kept in `SPARSE_STRUCTURE_CACHE`.
+
+    :return: SparseStructure
+    """
+    key = (tuple(int(dim) for dim in dimensions), repr(periodic))
+    return SPARSE_STRUCTURE_CACHE.get(key, lambda: SparseStructure(dimensions, periodic))
 
 
 def sparse_indices(dimensions, periodic=False):
-    N = int(np.prod(dimensions))
-    d = len(dimensions)
-    dims = range(d)
-    gridpoints_linear = np.arange(N)
-    gridpoints = np.stack(np.unravel_index(gridpoints_linear, dimensions))  # d * (N^2) array mapping from linear to spatial frames
-    indices_list = [np.stack([gridpoints_linear] * 2, axis=-1)]
-    for dim in dims:
-        dim_direction = math.expand_dims([1 if i == dim else 0 for i in range(d)], axis=-1)
-        # --- Stencil upper cells ---
-        upper_points, upper_idx = wrap_or_discard(gridpoints + dim_direction, dim, dimensions, periodic=collapsed_gather_nd(periodic, [dim, 1]))
-        indices_list.append(np.stack([gridpoints_linear[upper_idx], upper_points], axis=-1))
-        # --- Stencil lower cells ---
-        lower_points, lower_idx = wrap_or_discard(gridpoints - dim_direction, dim, dimensions, periodic=collapsed_gather_nd(periodic, [dim, 0]))
-        indices_list.append(np.stack([gridpoints_linear[lower_idx], lower_points], axis=-1))
-    indices = np.concatenate(indices_list, axis=0)
-    # --- Sort indices ---
-    sorting = np.lexsort(np.transpose(indices)[:, ::-1])
-    sorted_indices = indices[sorting]
-    return sorted_indices, sorting
+    """
+    :return: read-only arrays holding the sorted positions of the nonzero pressure matrix entries and the permutation sorting them, see `SparseStructure`
+    """
+    structure = sparse_structure(dimensions, periodic)
+    return structure.indices, structure.sorting
 
 
 def sparse_values(dimensions, extended_active_mask, extended_fluid_mask, sorting=None, periodic=False):
@@ -160,39 +390,54 @@ def sparse_values(dimensions, extended_active_mask, extended_fluid_mask, sorting
     :param extended_fluid_mask: Binary tensor with 2 more entries in every dimension than 'dimensions'.
     :return: SciPy sparse matrix that acts as a laplace on a flattened pressure channel given obstacles and empty cells
     """
-    N = int(np.prod(dimensions))
-    d = len(dimensions)
-    dims = range(d)
+    values = math.concat(_stencil_values(extended_active_mask, extended_fluid_mask, sparse_structure(dimensions, periodic).neighbours), axis=0)
+    if sorting is not None:
+        values = math.gather(values, sorting)
+    return values
 
-    values_list = []
-    diagonal_entries = 0  # diagonal matrix entries
 
+def _stencil_neighbours(dimensions, periodic):
+    """
+    Computes the positions of the off-diagonal pressure matrix entries.
+    Each cell couples to its upper and lower neighbour along every dimension unless the neighbour lies outside a non-periodic domain.
+
+    :return: list of (dim, upper, rows, columns) with rows and columns being linear cell indices. rows also selects the matching stencil values.
+    """
+    N = int(np.prod(dimensions))
+    d = len(dimensions)
     gridpoints_linear = np.arange(N)
     gridpoints = np.stack(np.unravel_index(gridpoints_linear, dimensions))  # d * (N^2) array mapping from linear to spatial frames
-
-    for dim in dims:
-        lower_active, self_active, upper_active = _dim_shifted(extended_active_mask, dim, (-1, 0, 1), diminish_others=(1, 1))
-        lower_accessible, upper_accessible = _dim_shifted(extended_fluid_mask, dim, (-1, 1), diminish_others=(1, 1))
-
-        stencil_upper = upper_active * self_active
-        stencil_lower = lower_active * self_active
-        stencil_center = - lower_accessible - upper_accessible
-
-        diagonal_entries += math.flatten(stencil_center)
-
+    neighbours = []
+    for dim in range(d):
         dim_direction = math.expand_dims([1 if i == dim else 0 for i in range(d)], axis=-1)
         # --- Stencil upper cells ---
         upper_points, upper_idx = wrap_or_discard(gridpoints + dim_direction, dim, dimensions, periodic=collapsed_gather_nd(periodic, [dim, 1]))
-        values_list.append(math.gather(math.flatten(stencil_upper), upper_idx))
+        neighbours.append((dim, True, gridpoints_linear[upper_idx], upper_points))
         # --- Stencil lower cells ---
         lower_points, lower_idx = wrap_or_discard(gridpoints - dim_direction, dim, dimensions, periodic=collapsed_gather_nd(periodic, [dim, 0]))
-        values_list.append(math.gather(math.flatten(stencil_lower), lower_idx))
+        neighbours.append((dim, False, gridpoints_linear[lower_idx], lower_points))
+    return neighbours
 
-    values_list.insert(0, math.minimum(diagonal_entries, -1.))
-    values = math.concat(values_list, axis=0)
-    if sorting is not None:
-        values = math.gather(values, sorting)
-    return values
+
+def _stencil_values(extended_active_mask, extended_fluid_mask, neighbours):
+    """
+    Computes the pressure matrix entries belonging to the diagonal and the `neighbours` from `_stencil_neighbours()`.
+
+    :return: list of value tensors, the diagonal first, followed by one tensor per entry in `neighbours`
+    """
+    d = math.spatial_rank(extended_active_mask)
+    diagonal_entries = 0  # diagonal matrix entries
+    stencils = {}
+    for dim in range(d):
+        lower_active, self_active, upper_active = _dim_shifted(extended_active_mask, dim, (-1, 0, 1), diminish_others=(1, 1))
+        lower_accessible, upper_accessible = _dim_shifted(extended_fluid_mask, dim, (-1, 1), diminish_others=(1, 1))
+        stencils[dim, True] = math.flatten(upper_active * self_active)
+        stencils[dim, False] = math.flatten(lower_active * self_active)
+        diagonal_entries += math.flatten(- lower_accessible - upper_accessible)
+    values_list = [math.minimum(diagonal_entries, -1.)]  # avoid 0, could lead to NaN
+    for dim, upper, rows, _columns in neighbours:
+        values_list.append(math.gather(stencils[dim, upper], rows))
+    return values_list
 
 
 def wrap_or_discard(points, check_bounds_dim, dimensions, periodic=False):
@@ -416,6 +416,9 @@ class TFBackend(Backend):
     def sparse_tensor(self, indices, values, shape):
         return tf.SparseTensor(indices=indices, values=values, dense_shape=shape)
 
+    def sparse_tensor_with_values(self, sparse_tensor, values):
+        return tf.SparseTensor(indices=sparse_tensor.indices, values=values, dense_shape=sparse_tensor.dense_shape)
+
 
 # from niftynet.layer.resampler.py
 # https://cmiclab.cs.ucl.ac.uk/CMIC/NiftyNet/blob/69c98e5a95cc6788ad9fb8c5e27dc24d1acec634/niftynet/layer/resampler.py
@@ -204,7 +204,11 @@ class TorchBackend(Backend):
             if keepdims:
                 result = self.expand_dims(result, axis=0, number=self.ndims(x))
             return result
-        return torch.max(x, dim=axis, keepdim=keepdims)
+        if isinstance(axis, (tuple, list)):
+            for dim in sorted(axis, reverse=True):
+                x = torch.max(x, dim=dim, keepdim=keepdims)[0]
+            return x
+        return torch.max(x, dim=axis, keepdim=keepdims)[0]
 
     def min(self, x, axis=None, keepdims=False):
         if axis is None:
@@ -212,7 +216,11 @@ class TorchBackend(Backend):
             if keepdims:
                 result = self.expand_dims(result, axis=0, number=self.ndims(x))
             return result
-        return torch.min(x, dim=axis, keepdim=keepdims)
+        if isinstance(axis, (tuple, list)):
+            for dim in sorted(axis, reverse=True):
+                x = torch.min(x, dim=dim, keepdim=keepdims)[0]
+            return x
+        return torch.min(x, dim=axis, keepdim=keepdims)[0]
 
     def maximum(self, a, b):
         a_ = self.as_tensor(a)
@@ -401,6 +409,9 @@ class TorchBackend(Backend):
         values_ = torch.FloatTensor(values)
         return torch.sparse.FloatTensor(indices_, values_, shape)
 
+    def sparse_tensor_with_values(self, sparse_tensor, values):
+        return torch.sparse.FloatTensor(sparse_tensor._indices(), torch.FloatTensor(values), sparse_tensor.shape)
+
 
 def channels_first(x):
     if isinstance(x, ComplexTensor):
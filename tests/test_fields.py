@@ -117,3 +117,105 @@ class TestFields(TestCase):
         vel = staggered_curl_2d(pot)
         div = vel.divergence()
         np.testing.assert_almost_equal(div.data, 0, decimal=3)
+
+    def test_staggered_semi_lagrangian(self):
+        from phi.physics.field.advect import semi_lagrangian
+        from phi.physics.material import CLOSED, OPEN, PERIODIC
+        for resolution, boundaries in (([7, 5], CLOSED), ([7, 5], [PERIODIC, OPEN]), ([6, 5, 4], [OPEN, PERIODIC, CLOSED])):
+            domain = Domain(resolution, boundaries=boundaries, box=AABox(0, [2 * n for n in resolution]))
+            velocity = domain.staggered_grid(Noise(len(resolution)), batch_size=2) * 3
+            fused = semi_lagrangian(velocity, velocity, dt=1.0)
+            separate = velocity.with_data([semi_lagrangian(component, velocity, dt=1.0) for component in velocity.unstack()])
+            np.testing.assert_almost_equal(fused.staggered_tensor(), separate.staggered_tensor(), decimal=5)
+
+    def test_interpolation_plan(self):
+        from phi.physics.field.advect import semi_lagrangian, semi_lagrangian_all
+        for extrapolation in ('boundary', 'periodic', 'constant', [('boundary', 'constant'), 'periodic']):
+            density = CenteredGrid(np.random.rand(2, 6, 5, 1), box=AABox(0, [3, 5]), extrapolation=extrapolation)
+            color = CenteredGrid(np.random.rand(2, 6, 5, 3), box=AABox(0, [3, 5]), extrapolation=extrapolation, extrapolation_value=0.5)
+            points = np.random.rand(2, 10, 2) * 8 - 2
+            plan = density.interpolation_plan(points)
+            np.testing.assert_almost_equal(density.sample_with(plan), density.sample_at(points), decimal=5)
+            np.testing.assert_almost_equal(color.sample_with(plan), color.sample_at(points), decimal=5)
+            minimum, maximum = color.sample_with(plan, 'minmax')
+            np.testing.assert_equal(minimum, color.general_sample_at(points, 'min'))
+            np.testing.assert_equal(maximum, color.general_sample_at(points, 'max'))
+            velocity = Domain([6, 5], box=AABox(0, [3, 5])).staggered_grid(Noise(2), batch_size=2)
+            advected = semi_lagrangian_all([density, velocity, color], velocity, dt=1.0)
+            np.testing.assert_almost_equal(advected[0].data, semi_lagrangian(density, velocity, 1.0).data, decimal=5)
+            np.testing.assert_almost_equal(advected[1].staggered_tensor(), semi_lagrangian(velocity, velocity, 1.0).staggered_tensor(), decimal=5)
+            np.testing.assert_almost_equal(advected[2].data, semi_lagrangian(color, velocity, 1.0).data, decimal=5)
+
+    def test_sample_point_cache(self):
+        from phi.physics.field.grid import SAMPLE_POINT_CACHE, SamplePointCache, sample_point_key
+        SAMPLE_POINT_CACHE.clear()
+        grid = CenteredGrid(np.zeros([1, 4, 5, 1]), box=AABox(0, [2, 3]))
+        points = grid.points
+        self.assertIs(points, grid.points)
+        self.assertFalse(points.data.flags.writeable)
+        np.testing.assert_almost_equal(points.data[0, 0, 0], [0.25, 0.3])
+        self.assertEqual((1, 1), (SAMPLE_POINT_CACHE.hits, SAMPLE_POINT_CACHE.misses))
+        self.assertEqual(points.data.nbytes, SAMPLE_POINT_CACHE.nbytes)
+        # --- Staggered components ---
+        velocity = Domain([4, 5], box=AABox(0, [2, 3])).staggered_grid(0)
+        for component in velocity.unstack():
+            self.assertIs(component.points, component.points)
+        self.assertEqual(3, len(SAMPLE_POINT_CACHE))
+        # --- Bounded size ---
+        cache = SamplePointCache(max_size=2, max_bytes=points.data.nbytes * 2)
+        for resolution in ([4, 5], [4, 6], [4, 7]):
+            cache.get(sample_point_key(grid.box, resolution), lambda: CenteredGrid.getpoints(grid.box, resolution))
+        self.assertEqual(1, len(cache))
+
+    def test_lazy_operations(self):
+        import threading
+        from phi.physics.field import lazy_operations
+        from phi.physics.field.lazy import _LazyOpField
+        density = CenteredGrid(np.random.rand(2, 6, 5, 1).astype(np.float32), box=AABox(0, [3, 5]), extrapolation='periodic')
+        color = CenteredGrid(np.random.rand(2, 6, 5, 3).astype(np.float32), box=AABox(0, [3, 5]), extrapolation='periodic')
+
+        def expressions():
+            return [(1 - density * 2) / (color + 0.5) ** 2, density * -np.array([0, -9.81]) * 0.1 * 0.5, (color - density > 0.2) | (density < 0.3), 2 / density.points]
+
+        eager = expressions()
+        with lazy_operations():
+            lazy = expressions()
+        velocity = Domain([6, 5], box=AABox(0, [3, 5])).staggered_grid(1.0, batch_size=2)
+        for lazy_field, eager_field in zip(lazy, eager):
+            self.assertIsInstance(lazy_field, _LazyOpField)
+            self.assertEqual(eager_field.component_count, lazy_field.component_count)
+            self.assertEqual(eager_field.flags, lazy_field.flags)
+            self.assertEqual(eager_field.data.dtype, lazy_field.data.dtype)
+            np.testing.assert_almost_equal(lazy_field.data, eager_field.data, decimal=5)
+            self.assertIsInstance(lazy_field.evaluate(), type(eager_field))
+            self.assertEqual(eager_field.extrapolation, lazy_field.evaluate().extrapolation)
+        np.testing.assert_almost_equal(lazy[1].at(velocity).staggered_tensor(), eager[1].at(velocity).staggered_tensor())
+        # --- Operations on lazy fields stay lazy within the context, operands are not modified ---
+        with lazy_operations():
+            combined = lazy[0] * lazy[0] + lazy[1].unstack()[1]
+        self.assertIsInstance(combined, _LazyOpField)
+        np.testing.assert_almost_equal(combined.data, eager[0].data ** 2 + eager[1].data[..., 1:], decimal=5)
+        np.testing.assert_almost_equal(lazy[0].data, eager[0].data, decimal=5)
+        # --- Outside of the context and with struct functions, lazy fields evaluate to CenteredGrids ---
+        with lazy_operations():
+            lazy_density = density * 2 - 1
+        eager_density = density * 2 - 1
+        for result, expected in ((lazy_density * 2, eager_density.data * 2),
+                                 (1 + lazy_density, eager_density.data + 1),
+                                 (struct.map(lambda x: x * 3, lazy_density), eager_density.data * 3),
+                                 (lazy_density.with_data(density.data), density.data),
+                                 (math.abs(lazy_density), np.abs(eager_density.data)),
+                                 (density.at(lazy_density), density.data)):
+            self.assertIs(type(result), CenteredGrid)
+            np.testing.assert_almost_equal(result.data, expected, decimal=5)
+        self.assertEqual(lazy_density.evaluate().staticshape.data, lazy_density.staticshape.data)
+        with lazy_operations():
+            self.assertIsInstance(velocity * 2 + 1, StaggeredGrid)
+        # --- The lazy mode only applies to the thread that entered the context ---
+        other_thread = []
+        with lazy_operations():
+            thread = threading.Thread(target=lambda: other_thread.append(density * 2))
+            thread.start()
+            thread.join()
+            self.assertIsInstance(density * 2, _LazyOpField)
+        self.assertIs(type(other_thread[0]), CenteredGrid)
@@ -8,7 +8,7 @@ from phi.physics.domain import Domain
 from phi.physics.field import StaggeredGrid, Noise
 from phi.physics.field.effect import Fan, Inflow
 from phi.physics.material import CLOSED, OPEN
-from phi.physics.fluid import Fluid, INCOMPRESSIBLE_FLOW, IncompressibleFlow
+from phi.physics.fluid import Fluid, INCOMPRESSIBLE_FLOW, IncompressibleFlow, divergence_free
 from phi.physics.obstacle import Obstacle
 from phi.physics.pressuresolver.sparse import SparseCG
 from phi.physics.world import World
@@ -99,6 +99,81 @@ class TestFluid(TestCase):
         numpy.testing.assert_equal(vy1, vy2)
         numpy.testing.assert_equal(vx1, vx2)
 
+    def test_warm_start(self):
+        def simulate(warm_start):
+            world = World()
+            fluid = world.add(Fluid(Domain([32, 32], boundaries=CLOSED), buoyancy_factor=0.1), physics=IncompressibleFlow(pressure_solver=SparseCG(), warm_start=warm_start))
+            world.add(Inflow(Sphere((16, 16), radius=4)))
+            infos = []
+            for _ in range(4):
+                world.step(dt=0.25)
+                infos.append(fluid.solve_info)
+            return infos
+        self.assertFalse(IncompressibleFlow().warm_start)
+        warm_infos = simulate(True)
+        cold_infos = simulate(False)
+        self.assertFalse(warm_infos[0]['warm_start'])  # no previous pressure
+        self.assertTrue(all(info['warm_start'] for info in warm_infos[1:]))
+        self.assertFalse(any(info['warm_start'] for info in cold_infos))
+        self.assertEqual(warm_infos[0]['iterations'], cold_infos[0]['iterations'])
+        self.assertLess(sum(info['iterations'] for info in warm_infos), sum(info['iterations'] for info in cold_infos))
+
+    def test_solve_telemetry(self):
+        fluid = Fluid(Domain([16, 16], boundaries=CLOSED), density=math.maximum(0, Noise()), buoyancy_factor=0.1)
+        fluid = IncompressibleFlow(pressure_solver=SparseCG(), telemetry='summary').step(fluid, dt=1.0)
+        telemetry = fluid.solve_info['telemetry']
+        self.assertEqual(telemetry.iterations, fluid.solve_info['iterations'])
+        self.assertTrue(telemetry.converged)
+        fluid = IncompressibleFlow(pressure_solver=SparseCG()).step(fluid, dt=1.0)
+        self.assertNotIn('telemetry', fluid.solve_info)
+
+    def test_lazy_step(self):
+        from phi.physics.field import lazy_operations
+        fluid = Fluid(Domain([16, 16], boundaries=CLOSED), density=math.maximum(0, Noise()), buoyancy_factor=0.1)
+        eager = IncompressibleFlow().step(fluid, dt=1.0)
+        with lazy_operations():
+            lazy = IncompressibleFlow().step(fluid, dt=1.0)
+        numpy.testing.assert_almost_equal(lazy.velocity.staggered_tensor(), eager.velocity.staggered_tensor(), decimal=5)
+        numpy.testing.assert_almost_equal(lazy.density.data, eager.density.data, decimal=5)
+
+    def test_buffer_pool_step(self):
+        import tracemalloc
+        from phi.physics.pressuresolver.geom import GeometricCG
+        domain = Domain([32, 32], boundaries=CLOSED)
+        fluid = Fluid(domain, density=numpy.random.RandomState(0).rand(2, 32, 32, 1).astype(numpy.float32), buoyancy_factor=0.1, batch_size=2)
+        solver = GeometricCG(accuracy=1e-3, max_iterations=200)
+        physics = IncompressibleFlow(pressure_solver=solver)
+        reference = physics.step(physics.step(fluid, dt=1.0), dt=1.0)
+        pool = math.BufferPool()
+        with math.buffer_pool(pool):
+            pooled = physics.step(fluid, dt=1.0)
+        allocations = pool.allocations
+        self.assertGreater(allocations, 0)
+        with math.buffer_pool(pool):
+            pooled = physics.step(pooled, dt=1.0)
+        self.assertEqual(allocations, pool.allocations)  # the second step reuses all buffers
+        numpy.testing.assert_almost_equal(pooled.velocity.staggered_tensor(), reference.velocity.staggered_tensor(), decimal=4)
+        numpy.testing.assert_almost_equal(pooled.density.data, reference.density.data, decimal=4)
+        # --- Peak memory of a pressure solve that iterates, both paths warmed up ---
+        velocity = pooled.solve_info['divergent_velocity']
+
+        def project():
+            return divergence_free(velocity, domain, (), pressure_solver=solver, return_info=True)[1]
+
+        self.assertGreater(project()['iterations'], 10)
+        peaks = []
+        for use_pool in (False, True):
+            tracemalloc.start()
+            if use_pool:
+                with math.buffer_pool(pool):
+                    project()
+            else:
+                project()
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        self.assertEqual(allocations, pool.allocations)
+        self.assertLess(peaks[1], peaks[0])
+
     def test_precision_64(self):
         try:
             math.set_precision(64)
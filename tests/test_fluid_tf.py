@@ -2,7 +2,7 @@ from unittest import TestCase
 
 import numpy
 
-from phi.tf.flow import tf, Session, placeholder, variable, tf_bake_subgraph, tf_bake_graph, Noise, constant, struct, OPEN, PERIODIC, STICKY, SLIPPERY, World, Fluid, IncompressibleFlow, Obstacle, CLOSED, Inflow, Domain, Sphere, box, Scene, math
+from phi.tf.flow import tf, Session, placeholder, variable, tf_bake_subgraph, tf_bake_graph, Noise, constant, struct, OPEN, PERIODIC, STICKY, SLIPPERY, World, Fluid, IncompressibleFlow, Obstacle, CLOSED, Inflow, Domain, Sphere, box, Scene, math, RedBlackSOR
 
 
 class TestFluidTF(TestCase):
@@ -43,6 +43,16 @@ class TestFluidTF(TestCase):
                     tf_eval = tf_tensor.eval()
                     numpy.testing.assert_almost_equal(np_tensor, tf_eval, decimal=5)
 
+    def test_red_black_sor_tf(self):
+        tf.reset_default_graph()
+        np_fluid = Fluid(Domain([16, 16], boundaries=CLOSED), velocity=Noise(2), batch_size=2)
+        tf_fluid = constant(np_fluid)
+        physics = IncompressibleFlow(pressure_solver=RedBlackSOR(), conserve_density=False)
+        np_fluid = physics.step(np_fluid, 1.0)
+        tf_fluid = physics.step(tf_fluid, 1.0)
+        with tf.Session() as sess:
+            numpy.testing.assert_almost_equal(np_fluid.velocity.staggered_tensor(), sess.run(tf_fluid.velocity.staggered_tensor()), decimal=4)
+
     def test_tf_subgraph(self):
         tf.reset_default_graph()
         world = World()
@@ -1,6 +1,6 @@
 from unittest import TestCase
 
-from phi.torch.flow import torch, torch_from_numpy, World, Fluid, IncompressibleFlow, Obstacle, CLOSED, Inflow, Domain, Sphere, box, OPEN, STICKY, SLIPPERY, PERIODIC, Noise, struct, numpy, math
+from phi.torch.flow import torch, torch_from_numpy, World, Fluid, IncompressibleFlow, Obstacle, CLOSED, Inflow, Domain, Sphere, box, OPEN, STICKY, SLIPPERY, PERIODIC, Noise, struct, numpy, math, RedBlackSOR, SparseCG
 
 
 class TestFluidPyTorch(TestCase):
@@ -34,6 +34,24 @@ class TestFluidPyTorch(TestCase):
                     torch_eval = torch_tensor.numpy()
                     numpy.testing.assert_almost_equal(np_tensor, torch_eval, decimal=5)
 
+    def test_red_black_sor_pytorch(self):
+        np_fluid = Fluid(Domain([16, 16], boundaries=CLOSED), velocity=Noise(2), batch_size=2)
+        torch_fluid = math.to_float(torch_from_numpy(np_fluid))
+        physics = IncompressibleFlow(pressure_solver=RedBlackSOR(), conserve_density=False)
+        np_fluid = physics.step(np_fluid, 1.0)
+        torch_fluid = physics.step(torch_fluid, 1.0)
+        numpy.testing.assert_almost_equal(np_fluid.velocity.staggered_tensor(), torch_fluid.velocity.staggered_tensor().numpy(), decimal=4)
+
+    def test_sparse_cg_pytorch_masks(self):
+        domain = Domain([8, 8], boundaries=CLOSED)
+        for obstacle in (box[2:4, 2:6], box[4:6, 1:3], None):
+            fluid = Fluid(domain, velocity=Noise(2), batch_size=1)
+            physics = IncompressibleFlow(pressure_solver=SparseCG(), conserve_density=False)
+            obstacles = [] if obstacle is None else [Obstacle(obstacle)]
+            np_fluid = physics.step(fluid, 1.0, obstacles=obstacles)
+            torch_fluid = physics.step(math.to_float(torch_from_numpy(fluid)), 1.0, obstacles=obstacles)
+            numpy.testing.assert_almost_equal(np_fluid.velocity.staggered_tensor(), torch_fluid.velocity.staggered_tensor().numpy(), decimal=4)
+
     def test_precision_64(self):
         try:
             math.set_precision(64)
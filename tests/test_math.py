@@ -51,6 +51,48 @@ class TestMath(TestCase):
             np.testing.assert_equal(l, 0)
             np.testing.assert_equal(l.shape, [2] + [2] * dims + [3])
 
+    def test_numpy_stencils(self):
+        sess = tf.InteractiveSession()
+        for shape in ([2, 5, 6, 3], [2, 4, 5, 6, 1]):
+            rank = len(shape) - 2
+            x = np.random.randn(*shape).astype(np.float32)
+            for padding in ('replicate', 'circular', 'constant', 'valid'):
+                np.testing.assert_almost_equal(laplace(x, padding=padding), sess.run(laplace(tf.constant(x), padding=padding)), decimal=5)
+            np.testing.assert_almost_equal(laplace(x, axes=[0]), sess.run(laplace(tf.constant(x), axes=[0])), decimal=5)
+            for difference in ('forward', 'backward', 'central'):
+                np.testing.assert_almost_equal(gradient(x[..., :1], difference=difference, padding='circular'), sess.run(gradient(tf.constant(x[..., :1]), difference=difference, padding='circular')), decimal=5)
+                vector = np.random.randn(*shape[:-1] + [rank]).astype(np.float32)
+                np.testing.assert_almost_equal(divergence(vector, difference=difference), sess.run(divergence(tf.constant(vector), difference=difference)), decimal=5)
+        # --- Like the convolution it replaces, the Laplace stencil returns the precision dtype ---
+        for dtype in (np.int32, np.float64):
+            for precision, expected in ((32, np.float32), (64, np.float64)):
+                try:
+                    set_precision(precision)
+                    x = np.arange(2 * 4 * 5).reshape([2, 4, 5, 1]).astype(dtype)
+                    self.assertEqual(expected, laplace(x).dtype)
+                    np.testing.assert_almost_equal(laplace(x), laplace(x.astype(np.float64)), decimal=5)
+                finally:
+                    set_precision(32)
+
+    def test_scipy_conv_methods(self):
+        import scipy.signal
+        from phi.backend.scipy_backend import separable_factors
+        backend = SciPyBackend()
+        for tensor_shape, kernel_shape in (([2, 9, 10, 1], [3, 3, 1, 1]), ([2, 9, 10, 2], [4, 5, 2, 3]), ([1, 7, 8, 9, 1], [3, 4, 2, 1, 2])):
+            tensor = np.random.randn(*tensor_shape).astype(np.float32)
+            factors = [np.random.randn(n) for n in kernel_shape[:-2]]
+            separable = factors[0]
+            for factor in factors[1:]:
+                separable = np.multiply.outer(separable, factor)
+            for kernel, is_separable in ((np.random.randn(*kernel_shape), False), (np.tile(np.reshape(separable, kernel_shape[:-2] + [1, 1]), kernel_shape[-2:]), True)):
+                self.assertEqual(is_separable, separable_factors(kernel) is not None)
+                for padding in ('same', 'valid'):
+                    expected = np.stack([np.sum([[scipy.signal.correlate(tensor[b, ..., i], kernel[..., i, o], padding) for i in range(kernel_shape[-2])] for b in range(tensor_shape[0])], axis=1) for o in range(kernel_shape[-1])], axis=-1)
+                    for method in ('direct', 'fft', 'auto'):
+                        np.testing.assert_almost_equal(backend.conv(tensor, kernel, padding, method=method), expected, decimal=4)
+                    if is_separable:
+                        np.testing.assert_almost_equal(backend.conv(tensor, kernel, padding, method='separable'), expected, decimal=4)
+
     def test_struct_broadcast(self):
         s = {'a': 0, 'b': 1}
         result = cos(s)
@@ -156,6 +198,132 @@ class TestMath(TestCase):
         _resample_test('constant', [0, -1, 0, 0], (0.5, 1, 1.5, 2, 1, 0, -1))
         _resample_test(['constant', 'circular', ['symmetric', 'reflect'], 'constant'], None, (1, 1, 1.5, 2, 1.5, 2.5, 1.5))
 
+    def test_conjugate_gradient_per_example(self):
+        from phi.math.optim import conjugate_gradient, preconditioned_conjugate_gradient
+        diagonal = np.linspace(1, 100, 64)
+        y = np.stack([np.zeros(64), np.eye(64)[5], np.random.randn(64)]).astype(np.float32)
+
+        def function(x):
+            return x * diagonal
+
+        for compact in (False, True):
+            result = conjugate_gradient(function, y, np.zeros_like(y), accuracy=1e-4, compact=compact)
+            np.testing.assert_almost_equal(function(result.x), y, decimal=3)
+            self.assertEqual(0, result.example_iterations[0])
+            self.assertEqual(result.iterations, np.max(result.example_iterations))
+            self.assertEqual(1, result.example_iterations[1])
+            result = preconditioned_conjugate_gradient(function, y, np.zeros_like(y), lambda r: r / 50, accuracy=1e-4, compact=compact)
+            np.testing.assert_almost_equal(function(result.x), y, decimal=3)
+            self.assertEqual(0, result.example_iterations[0])
+            self.assertEqual(result.iterations, np.max(result.example_iterations))
+
+    def test_fused_conjugate_gradient(self):
+        from phi.math.optim import conjugate_gradient, fused_conjugate_gradient
+        diagonal = np.linspace(1, 100, 64).astype(np.float32)
+        y = np.stack([np.zeros(64), np.random.randn(64)]).astype(np.float32)
+
+        def function(x):
+            return x * diagonal
+
+        reference = conjugate_gradient(function, y, np.zeros_like(y), accuracy=1e-4)
+        for check_interval in (1, 4):
+            for compact in (False, True):
+                result = fused_conjugate_gradient(function, y, np.zeros_like(y), accuracy=1e-4, check_interval=check_interval, compact=compact)
+                np.testing.assert_almost_equal(function(result.x), y, decimal=3)
+                self.assertEqual(0, result.example_iterations[0])
+                self.assertEqual(0, result.iterations % check_interval)
+                self.assertLessEqual(result.iterations, reference.iterations + check_interval)
+        result = fused_conjugate_gradient(function, y, np.zeros_like(y), lambda r: r / diagonal, accuracy=1e-4)
+        np.testing.assert_almost_equal(function(result.x), y, decimal=3)
+        self.assertLessEqual(result.iterations, 4)
+
+    def test_resample_numpy_flat_indices(self):
+        from phi.backend.backend_helper import InterpolationPlan
+        from phi.tf.tf_backend import TFBackend
+        sess = tf.InteractiveSession()
+        for boundary in ('replicate', 'circular', 'constant', 'symmetric', 'reflect', ['constant', ['circular', 'replicate'], ['symmetric', 'constant'], 'constant']):
+            for grid_batch, coords_batch in ((3, 3), (1, 3), (3, 1)):
+                grid = np.random.randn(grid_batch, 4, 5, 2).astype(np.float32)
+                coords = (np.random.rand(coords_batch, 7, 2) * 12 - 4).astype(np.float32)
+                plan = InterpolationPlan(coords, [4, 5], boundary, SciPyBackend())
+                grid_tf = tf.constant(np.tile(grid, [3 // grid_batch, 1, 1, 1]))
+                coords_tf = tf.constant(np.tile(coords, [3 // coords_batch, 1, 1]))
+                np.testing.assert_almost_equal(plan.apply(grid, 0.5), sess.run(helper_resample(grid_tf, coords_tf, boundary, 0.5, TFBackend())), decimal=5)
+                np.testing.assert_equal(plan.apply(grid, 0.5, 'max'), sess.run(helper_resample(grid_tf, coords_tf, boundary, 0.5, TFBackend(), reduce='max')))
+        # --- 3D ---
+        grid = np.random.randn(2, 3, 4, 5, 1)
+        coords = np.random.rand(2, 6, 3) * 8 - 2
+        np.testing.assert_almost_equal(helper_resample(grid, coords, 'circular', 0, SciPyBackend()), sess.run(helper_resample(tf.constant(grid), tf.constant(coords), 'circular', 0, TFBackend())))
+
+    def test_gather_nd_batch_broadcasting(self):
+        backend = SciPyBackend()
+        for values_batch, indices_batch in ((3, 3), (1, 3), (3, 1)):
+            values = np.random.randn(values_batch, 4, 5, 2)
+            indices = np.stack([np.random.randint(0, 4, (indices_batch, 6, 7)), np.random.randint(0, 5, (indices_batch, 6, 7))], axis=-1)
+            result = backend.gather_nd(values, indices, batch_dims=1)
+            self.assertEqual((3, 6, 7, 2), result.shape)
+            for b in range(3):
+                example_values = values[b % values_batch]
+                example_indices = indices[b % indices_batch]
+                np.testing.assert_equal(result[b], example_values[example_indices[..., 0], example_indices[..., 1]])
+        # --- Negative indices wrap per axis, out-of-range indices raise like NumPy indexing ---
+        values = np.random.randn(2, 4, 5, 2)
+        indices = np.array([[[-1, 0], [0, -5], [3, -1]]] * 2)
+        np.testing.assert_equal(backend.gather_nd(values, indices, batch_dims=1)[1], values[1][indices[1, :, 0], indices[1, :, 1]])
+        for invalid in ([0, 5], [4, 0], [-5, 0], [0, -6]):
+            self.assertRaises(IndexError, lambda: backend.gather_nd(values, np.array([[invalid]] * 2), batch_dims=1))
+
+    def test_buffer_pool(self):
+        import threading
+        import tracemalloc
+        from phi.backend.scipy_backend import PAD_INTO_MODES, active_buffer_pool, pad_into
+        from phi.math.optim import conjugate_gradient
+        value = np.random.randn(2, 5, 4, 1)
+        pad_width = [[0, 0], [1, 2], [2, 1], [0, 0]]
+        for mode, numpy_mode in zip(PAD_INTO_MODES, ('constant', 'edge', 'wrap')):
+            np.testing.assert_equal(pad_into(value, pad_width, mode, np.empty([2, 8, 7, 1])), np.pad(value, pad_width, numpy_mode))
+            expected = laplace(value, padding=mode), gradient(value, padding=mode)
+            with buffer_pool():
+                np.testing.assert_equal(laplace(value, padding=mode), expected[0])
+                np.testing.assert_equal(gradient(value, padding=mode), expected[1])
+        # --- Conjugate gradient in place ---
+        diagonal = np.linspace(1, 100, 64 * 64).reshape([1, 64, 64, 1]).astype(np.float32)
+        y = np.random.randn(2, 64, 64, 1).astype(np.float32)
+
+        def function(x, out=None):
+            return np.multiply(x, diagonal, out=out)
+
+        function.supports_out = True
+        reference = conjugate_gradient(function, y, np.zeros_like(y), accuracy=1e-4)
+        pool = BufferPool()
+        with buffer_pool(pool):
+            result = conjugate_gradient(function, y, np.zeros_like(y), accuracy=1e-4)
+        np.testing.assert_almost_equal(result.x, reference.x, decimal=4)
+        np.testing.assert_equal(result.example_iterations, reference.example_iterations)
+        allocations = pool.allocations
+        peak_memory = []
+        for pooled in (False, True):
+            x0 = np.zeros_like(y)
+            tracemalloc.start()
+            if pooled:
+                with buffer_pool(pool):
+                    conjugate_gradient(function, y, x0, accuracy=1e-4)
+            else:
+                conjugate_gradient(function, y, x0, accuracy=1e-4)
+            peak_memory.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        self.assertEqual(allocations, pool.allocations)
+        self.assertLess(peak_memory[1], 3 * y.nbytes)  # result x and residual
+        self.assertLess(peak_memory[1], peak_memory[0] / 2)
+        # --- Pools are only active in the thread that entered the context ---
+        other_thread = []
+        with buffer_pool(pool):
+            thread = threading.Thread(target=lambda: other_thread.append(active_buffer_pool()))
+            thread.start()
+            thread.join()
+            self.assertIs(pool, active_buffer_pool())
+        self.assertEqual([None], other_thread)
+
 
 def _resample_test(mode, constant_values, expected):
     grid = np.tile(np.reshape(np.array([[1,2], [4,5]]), [1,2,2,1]), [1, 1, 1, 2])
@@ -1,12 +1,23 @@
+import os
+import tempfile
+import threading
+import time
 from unittest import TestCase
 
 import numpy as np
+import scipy.sparse
 from phi import math
 
-from phi.flow import CLOSED, PERIODIC, OPEN, Domain, poisson_solve, Noise
-from phi.physics.pressuresolver.geom import GeometricCG
-from phi.physics.pressuresolver.sparse import SparseCG, SparseSciPy
+from phi.flow import CLOSED, PERIODIC, OPEN, Domain, Material, PoissonDomain, SolveTelemetry, poisson_solve, Noise
+from phi.physics.pressuresolver.geom import GeometricCG, MaskedLaplaceOperator, _masked_laplace
+from phi.physics.pressuresolver.multigrid import GeometricMultigrid
+from phi.physics.pressuresolver.sparse import SparseCG, SparseSciPy, PressureMatrixCache, sparse_indices, sparse_pressure_matrix, sparse_structure, sparse_values
 from phi.physics.pressuresolver.fourier import FourierSolver
+from phi.physics.pressuresolver.dct import DCTSolver
+from phi.physics.pressuresolver.parallel import DomainDecompositionCG
+from phi.physics.pressuresolver.sor import RedBlackSOR, checkerboard
+from phi.physics.pressuresolver.solver_api import _choose_solver, claim_telemetry, telemetry_scope
+from phi.physics.pressuresolver.autotune import AutotunedSolver, autotune_key, default_candidates, enable_autotuning, disable_autotuning, load_winners
 from phi.physics.field import CenteredGrid
 from phi.geom.geometry import AABox
 
@@ -90,9 +101,307 @@ class TestPoissonSolve(TestCase):
     def test_sparse_scipy(self):
         _test_all(SparseSciPy())
 
+    def test_sparse_scipy_factorized(self):
+        _test_all(SparseSciPy(matrix_cache=PressureMatrixCache(), factorize=True))
+
     def test_geometric_cg(self):
         _test_all(GeometricCG())
 
+    def test_dct_solver(self):
+        _test_all(DCTSolver())
+        domain = Domain([8, 6, 10], boundaries=[CLOSED, OPEN, PERIODIC])
+        div = domain.centered_grid(Noise())
+        np.testing.assert_almost_equal(poisson_solve(div, domain, DCTSolver())[0].laplace().data, div.data, decimal=4)
+
+    def test_choose_solver(self):
+        backend = math.choose_backend(np.zeros(1))
+        obstacle_free = PoissonDomain(Domain([16, 16], boundaries=[CLOSED, OPEN]))
+        self.assertIsInstance(_choose_solver([16, 16], backend, obstacle_free), DCTSolver)
+        active = np.ones([1, 16, 16, 1], np.float32)
+        active[0, 4:8, 4:8, 0] = 0
+        with_obstacle = PoissonDomain(obstacle_free.domain, active=CenteredGrid(active, extrapolation='constant'), accessible=CenteredGrid(active))
+        self.assertIsInstance(_choose_solver([16, 16], backend, with_obstacle), SparseSciPy)
+        mixed = PoissonDomain(Domain([16, 16], boundaries=[(CLOSED, OPEN), CLOSED]))
+        self.assertIsInstance(_choose_solver([16, 16], backend, mixed), SparseSciPy)
+
+    def test_autotuned_solver(self):
+        _test_all(AutotunedSolver(cache_file=None))
+        domain = Domain([16, 16], boundaries=CLOSED)
+        div = domain.centered_grid(Noise())
+        div -= math.mean(div.data)
+        with tempfile.TemporaryDirectory() as directory:
+            cache_file = os.path.join(directory, 'autotune.json')
+            candidates = {'SparseCG': SparseCG(), 'SparseSciPy': SparseSciPy()}
+            solver = AutotunedSolver(candidates, trials=2, cache_file=cache_file)
+            for _ in range(4):
+                np.testing.assert_almost_equal(poisson_solve(div, domain, solver)[0].laplace().data, div.data, decimal=3)
+            self.assertEqual(1, len(solver.winners))
+            self.assertEqual(solver.winners, load_winners(cache_file))
+            # --- New instance reuses persisted winner without timing ---
+            solver = enable_autotuning(cache_file, candidates=candidates)
+            try:
+                self.assertIs(solver, _choose_solver([16, 16], math.choose_backend(div.data), PoissonDomain(domain)))
+                poisson_solve(div, domain)
+                self.assertEqual({}, solver.timings)
+            finally:
+                disable_autotuning()
+        # --- Candidates that do not reach the accuracy are disqualified ---
+        solver = AutotunedSolver({'SparseCG': SparseCG(), 'SparseCG(2)': SparseCG(max_iterations=2)}, trials=1, cache_file=None)
+        for _ in range(2):
+            poisson_solve(div, domain, solver)
+        self.assertEqual(float('inf'), solver.timings[autotune_key(div.data, PoissonDomain(domain))]['SparseCG(2)'][0])
+        self.assertEqual(['SparseCG'], list(solver.winners.values()))
+        self.assertNotIn('GeometricMultigrid', default_candidates(div.data, PoissonDomain(domain)))
+
+    def test_domain_decomposition_cg(self):
+        import phi.flow
+        from phi.physics.pressuresolver import parallel
+        self.assertFalse(hasattr(phi.flow, 'DomainDecompositionCG'))  # experimental, not exported
+        for local_solver in ('ic', 'lu'):
+            solver = DomainDecompositionCG(workers=3, local_solver=local_solver)
+            try:
+                _test_all(solver)
+                domain = Domain([12, 10], boundaries=OPEN)
+                div = domain.centered_grid(Noise(), batch_size=2)
+                pressure, iterations = poisson_solve(div, domain, solver)
+                np.testing.assert_almost_equal(pressure.data, poisson_solve(div, domain, SparseSciPy())[0].data, decimal=4)
+                self.assertEqual(0, poisson_solve(div, domain, solver, guess=pressure)[1])
+            finally:
+                solver.close()
+        # --- A failing worker must not leave the others waiting at the barrier ---
+        domain = Domain([12, 10], boundaries=OPEN)
+        solver = DomainDecompositionCG(workers=3)
+        try:
+            poisson_solve(domain.centered_grid(Noise()), domain, solver)
+            workers = solver._subdomains
+            self.assertIn(workers, parallel._RUNNING)  # created with the first workers
+            workers._broadcast('start')
+            for i, connection in enumerate(workers._connections):
+                connection.send(('direction', 'invalid' if i == 0 else None))
+            start = time.time()
+            self.assertRaises(RuntimeError, workers._gather)
+            self.assertLess(time.time() - start, 10)
+            self.assertIsNone(workers.key)
+            poisson_solve(domain.centered_grid(Noise()), domain, solver)  # restarts the workers
+            self.assertIsNot(workers, solver._subdomains)
+        finally:
+            solver.close()
+
+    def test_masked_laplace_operator(self):
+        for boundaries in (CLOSED, OPEN, PERIODIC, [(CLOSED, OPEN), PERIODIC], [CLOSED, OPEN, PERIODIC]):
+            domain = Domain([6, 5, 7][:len(boundaries) if isinstance(boundaries, list) else 2], boundaries=boundaries)
+            active = np.ones([1] + list(domain.resolution) + [1], np.float32)
+            active[(0,) + (slice(2, 4),) * domain.rank] = 0
+            poisson_domain = PoissonDomain(domain, active=CenteredGrid(active, extrapolation='constant'), accessible=CenteredGrid(active))
+            fluid_mask = poisson_domain.accessible_tensor(extend=1)
+            extrapolation = Material.extrapolation_mode(domain.boundaries)
+            operator = MaskedLaplaceOperator(fluid_mask, extrapolation)
+            pressure = np.random.randn(2, *domain.resolution, 1).astype(np.float32)
+            expected = _masked_laplace(pressure, fluid_mask, extrapolation)
+            np.testing.assert_almost_equal(operator(pressure), expected, decimal=5)
+            operator._np_faces = None  # backend-independent implementation
+            np.testing.assert_almost_equal(operator(pressure), expected, decimal=5)
+
+    def test_solve_telemetry(self):
+        domain = Domain([16, 16], boundaries=OPEN)
+        div = domain.centered_grid(Noise(), batch_size=2)
+        for solver in (SparseCG(), GeometricCG(preconditioner='jacobi'), GeometricMultigrid()):
+            telemetry = SolveTelemetry('full')
+            _, iterations = poisson_solve(div, domain, solver, telemetry=telemetry)
+            self.assertEqual(iterations, telemetry.iterations)
+            self.assertEqual(iterations, len(telemetry.residual_history))
+            self.assertTrue(telemetry.converged)
+            self.assertFalse(telemetry.max_iterations_reached)
+            self.assertLessEqual(telemetry.final_residual, 1e-5)
+            self.assertGreaterEqual(telemetry.total_time, telemetry.assembly_time + telemetry.iteration_time)
+        telemetry = SolveTelemetry('summary')
+        poisson_solve(div, domain, SparseCG(max_iterations=5), telemetry=telemetry)
+        self.assertIsNone(telemetry.residual_history)
+        self.assertFalse(telemetry.converged)
+        self.assertTrue(telemetry.max_iterations_reached)
+        np.testing.assert_equal(telemetry.example_iterations, [5, 5])
+        # --- Direct solvers ---
+        telemetry = SolveTelemetry('full')
+        poisson_solve(div, domain, SparseSciPy(), telemetry=telemetry)
+        self.assertIsNone(telemetry.iterations)
+        self.assertTrue(telemetry.converged)
+        self.assertLess(telemetry.final_residual, 1e-3)
+        # --- Telemetry scopes are per thread ---
+        claimed = []
+        with telemetry_scope(telemetry):
+            thread = threading.Thread(target=lambda: claimed.append(claim_telemetry()))
+            thread.start()
+            thread.join()
+            self.assertIs(telemetry, claim_telemetry())
+        self.assertEqual([None], claimed)
+
+    def test_preconditioned_cg(self):
+        for preconditioner in ('jacobi', 'ic', 'dct', 'multigrid', GeometricMultigrid(cycle='W')):
+            _test_all(SparseCG(matrix_cache=PressureMatrixCache(), preconditioner=preconditioner))
+        for preconditioner in ('jacobi', 'dct', 'multigrid'):
+            _test_all(GeometricCG(preconditioner=preconditioner))
+
+    def test_fused_cg(self):
+        _test_all(SparseCG(method='fused'))
+        _test_all(SparseCG(matrix_cache=PressureMatrixCache(), preconditioner='jacobi', method='fused', check_interval=1))
+        _test_all(GeometricCG(method='fused', check_interval=8))
+
+    def test_preconditioned_cg_iterations(self):
+        domain = Domain([32, 32], boundaries=CLOSED)
+        div = domain.centered_grid(Noise())
+        div -= math.mean(div.data)
+        iterations = {preconditioner: poisson_solve(div, domain, SparseCG(preconditioner=preconditioner))[1] for preconditioner in (None, 'ic', 'multigrid')}
+        self.assertLess(iterations['ic'], iterations[None] / 2)
+        self.assertLess(iterations['multigrid'], iterations['ic'])
+
+    def test_geometric_multigrid(self):
+        _test_all(GeometricMultigrid())
+        _test_all(GeometricMultigrid(cycle='W', coarse_resolution=2))
+
+    def test_geometric_multigrid_obstacle(self):
+        for boundaries in (CLOSED, OPEN, PERIODIC):
+            domain = Domain([32, 32], boundaries=boundaries)
+            active = np.ones([1, 32, 32, 1], np.float32)
+            active[0, 10:16, 12:20, 0] = 0
+            div = (np.random.RandomState(0).rand(1, 32, 32, 1).astype(np.float32) - 0.5) * active
+            div -= active * np.sum(div) / np.sum(active)
+            poisson_domain = PoissonDomain(domain, active=CenteredGrid(active, extrapolation='constant'), accessible=CenteredGrid(active, extrapolation=Material.accessible_extrapolation_mode(boundaries)))
+            reference = poisson_solve(CenteredGrid(div), poisson_domain, GeometricCG(accuracy=1e-6))[0].data * active
+            pressure, cycles = poisson_solve(CenteredGrid(div), poisson_domain, GeometricMultigrid())
+            pressure = pressure.data * active
+            if boundaries is not OPEN:
+                reference -= active * np.sum(reference) / np.sum(active)
+                pressure -= active * np.sum(pressure) / np.sum(active)
+            np.testing.assert_almost_equal(pressure, reference, decimal=3)
+            self.assertLess(cycles, 20)
+
+    def test_geometric_multigrid_odd_resolution(self):
+        for resolution, boundaries in (([33, 17], OPEN), ([31, 31], OPEN), ([17, 17], OPEN), ([30, 30], OPEN), ([31, 17], [CLOSED, OPEN]), ([33, 30], [PERIODIC, OPEN]), ([31, 17], PERIODIC)):
+            domain = Domain(resolution, boundaries=boundaries)
+            div = domain.centered_grid(Noise())
+            if boundaries is PERIODIC:
+                div -= math.mean(div.data)
+            reference = poisson_solve(div, domain, SparseCG(accuracy=1e-6))[0].data
+            telemetry = SolveTelemetry()
+            pressure, cycles = poisson_solve(div, domain, GeometricMultigrid(), telemetry=telemetry)
+            pressure = pressure.data
+            if boundaries is PERIODIC:
+                reference -= np.mean(reference)
+                pressure -= np.mean(pressure)
+            self.assertTrue(telemetry.converged, '%s %s' % (resolution, boundaries))
+            self.assertLess(cycles, 40)
+            np.testing.assert_almost_equal(pressure, reference, decimal=3)
+
+    def test_geometric_multigrid_not_converged(self):
+        domain = Domain([32, 32], boundaries=OPEN)
+        div = domain.centered_grid(Noise())
+        telemetry = SolveTelemetry()
+        with self.assertWarns(RuntimeWarning):
+            poisson_solve(div, domain, GeometricMultigrid(max_cycles=3), telemetry=telemetry)
+        self.assertFalse(telemetry.converged)
+        self.assertTrue(telemetry.max_iterations_reached)
+        with self.assertWarns(RuntimeWarning):
+            poisson_solve(div, domain, GeometricMultigrid(over_correction=4.), telemetry=telemetry)
+        self.assertFalse(telemetry.converged)
+        self.assertFalse(telemetry.max_iterations_reached)
+
+    def test_red_black_sor(self):
+        _test_all(RedBlackSOR())
+        _test_all(GeometricMultigrid(smoother='sor'))
+        domain = Domain([32, 32], boundaries=CLOSED)
+        active = np.ones([1, 32, 32, 1], np.float32)
+        active[0, 10:16, 12:20, 0] = 0
+        div = (np.random.RandomState(0).rand(1, 32, 32, 1).astype(np.float32) - 0.5) * active
+        div -= active * np.sum(div) / np.sum(active)
+        poisson_domain = PoissonDomain(domain, active=CenteredGrid(active, extrapolation='constant'), accessible=CenteredGrid(active, extrapolation='constant'))
+        reference = poisson_solve(CenteredGrid(div), poisson_domain, GeometricCG(accuracy=1e-6))[0].data * active
+        reference -= active * np.sum(reference) / np.sum(active)
+        for solver in (RedBlackSOR(), RedBlackSOR(relaxation=1.5, check_interval=1), GeometricMultigrid(smoother='sor')):
+            pressure = poisson_solve(CenteredGrid(div), poisson_domain, solver)[0].data * active
+            pressure -= active * np.sum(pressure) / np.sum(active)
+            np.testing.assert_almost_equal(pressure, reference, decimal=3)
+        # --- Fixed number of sweeps ---
+        telemetry = SolveTelemetry()
+        pressure, sweeps = poisson_solve(CenteredGrid(div), poisson_domain, RedBlackSOR(accuracy=None, max_sweeps=5), telemetry=telemetry)
+        self.assertEqual(5, sweeps)
+        self.assertTrue(telemetry.max_iterations_reached)
+        # --- Not converged ---
+        with self.assertWarns(RuntimeWarning):
+            poisson_solve(CenteredGrid(div), poisson_domain, RedBlackSOR(max_sweeps=20), telemetry=telemetry)
+        self.assertFalse(telemetry.converged)
+
+    def test_red_black_sor_odd_periodic(self):
+        for resolution, periodic in (([31, 17], [True, True]), ([31, 16], [True, False]), ([7, 5, 4], [True, False, True])):
+            colours = checkerboard(resolution, periodic)
+            self.assertEqual(3 if resolution[0] % 2 else 2, len(colours))
+            np.testing.assert_equal(sum(colours), 1)
+            for dimension in range(len(resolution)):
+                neighbours = [np.roll(colour, 1, dimension + 1) if periodic[dimension] else np.take(colour, range(1, resolution[dimension]), dimension + 1) for colour in colours]
+                colours_ = colours if periodic[dimension] else [np.take(colour, range(resolution[dimension] - 1), dimension + 1) for colour in colours]
+                for colour, neighbour in zip(colours_, neighbours):
+                    self.assertFalse(np.any(colour & neighbour))
+        domain = Domain([31, 17], boundaries=PERIODIC)
+        div = domain.centered_grid(Noise())
+        div -= math.mean(div.data)
+        reference = poisson_solve(div, domain, SparseCG(accuracy=1e-6))[0].data
+        telemetry = SolveTelemetry()
+        pressure = poisson_solve(div, domain, RedBlackSOR(), telemetry=telemetry)[0].data
+        self.assertTrue(telemetry.converged)
+        np.testing.assert_almost_equal(pressure - np.mean(pressure), reference - np.mean(reference), decimal=4)
+
+    def test_sparse_scipy_batched_masks(self):
+        domain = Domain([8, 8], boundaries=OPEN)
+        active = np.ones([2, 8, 8, 1], np.float32)
+        active[0, 3:5, 3:5, 0] = 0
+        div = np.random.RandomState(0).rand(2, 8, 8, 1).astype(np.float32) * active
+        batched_domain = PoissonDomain(domain, active=CenteredGrid(active, extrapolation='constant'), accessible=CenteredGrid(active))
+        pressure = poisson_solve(CenteredGrid(div), batched_domain, SparseSciPy())[0].data
+        for b in range(2):
+            example_domain = PoissonDomain(domain, active=CenteredGrid(active[b:b + 1], extrapolation='constant'), accessible=CenteredGrid(active[b:b + 1]))
+            example_pressure = poisson_solve(CenteredGrid(div[b:b + 1]), example_domain, SparseSciPy())[0].data
+            np.testing.assert_almost_equal(pressure[b:b + 1], example_pressure, decimal=5)
+
+    def test_sparse_structure(self):
+        for periodic in (False, True, [True, False]):
+            structure = sparse_structure([6, 5], periodic)
+            self.assertIs(structure, sparse_structure((6, 5), periodic))
+            indices, sorting = sparse_indices([6, 5], periodic)
+            self.assertIs(indices, structure.indices)
+            self.assertFalse(indices.flags.writeable)
+            np.testing.assert_equal(indices, sorted(indices.tolist()))
+            active = np.ones([1, 8, 7, 1], np.float32)
+            active[0, 3, 2:4, 0] = 0
+            values = sparse_values([6, 5], active, active, sorting, periodic)
+            np.testing.assert_equal(values, structure.values(active, active))
+            dense = np.zeros([30, 30], np.float32)
+            dense[indices[:, 0], indices[:, 1]] = values
+            np.testing.assert_equal(dense, sparse_pressure_matrix([6, 5], active, active, periodic).toarray())
+
+    def test_sparse_pressure_matrix_small_periodic(self):
+        # Periodic axes of size 1 and 2 couple a cell to the same neighbour twice. Both couplings are summed so that the matrix equals the periodic Laplace stencil.
+        for dimensions in ([1, 4], [2, 4], [2, 1, 3]):
+            active = np.ones([1] + [n + 2 for n in dimensions] + [1], np.float32)
+            matrix = sparse_pressure_matrix(dimensions, active, active, True)
+            pressure = np.random.randn(1, *dimensions, 1).astype(np.float32)
+            np.testing.assert_almost_equal(matrix.dot(pressure.flatten()), math.laplace(pressure, padding='circular').flatten(), decimal=5)
+            indices, sorting = sparse_indices(dimensions, True)
+            values = sparse_values(dimensions, active, active, sorting, True)
+            summed = scipy.sparse.coo_matrix((values, (indices[:, 0], indices[:, 1])), shape=matrix.shape)
+            np.testing.assert_almost_equal(matrix.toarray(), summed.toarray())
+
+    def test_pressure_matrix_cache(self):
+        domain = Domain([16, 16], boundaries=CLOSED)
+        div = domain.centered_grid(Noise())
+        for solver_type in (SparseCG, SparseSciPy):
+            cache = PressureMatrixCache(max_size=1)
+            solver = solver_type(matrix_cache=cache)
+            p1 = poisson_solve(div, domain, solver)[0]
+            p2 = poisson_solve(div, domain, solver)[0]
+            self.assertEqual((cache.hits, cache.misses, len(cache)), (1, 1, 1))
+            np.testing.assert_equal(p1.data, p2.data)
+            poisson_solve(div, Domain([16, 16], boundaries=PERIODIC), solver)
+            self.assertEqual((cache.hits, cache.misses, len(cache)), (1, 2, 1))
+
 
 # def _run_higher_order_fft_reconstruction(in_field, set_accuracy, tolerance=20, order=2):
 #     # Higher Order FFT test